@@ -5,26 +5,2707 @@ from qgis.PyQt.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
     QLineEdit, QFileDialog, QCheckBox, QListWidget, QListWidgetItem,
     QComboBox, QMessageBox, QTabWidget, QWidget, QProgressDialog, QSizePolicy,
-    QColorDialog, QInputDialog
+    QColorDialog, QInputDialog, QTableWidget, QTableWidgetItem, QHeaderView,
+    QAbstractItemView
 )
-from qgis.PyQt.QtGui import QColor, QFont, QPixmap
-from qgis.PyQt.QtCore import QVariant, Qt, pyqtSignal
-from qgis.gui import QgsMapToolEmitPoint
+from qgis.PyQt.QtGui import QColor, QFont, QPixmap, QTransform
+from qgis.PyQt.QtCore import QCoreApplication, QVariant, Qt, QTimer, pyqtSignal
+from qgis.gui import QgsMapToolEmitPoint, QgsRubberBand
 from qgis.core import (
     QgsProject, QgsVectorLayer, QgsFeature, QgsFields, QgsField,
     QgsDefaultValue, QgsCoordinateTransform, QgsCoordinateReferenceSystem,
     QgsWkbTypes, QgsGeometry, QgsPointXY, QgsMessageLog, Qgis,
     QgsSnappingConfig, QgsTolerance, QgsVectorLayerSimpleLabeling,
     QgsPalLayerSettings, QgsTextFormat, QgsTextBufferSettings, QgsMarkerSymbol,
-    QgsSingleSymbolRenderer, QgsRuleBasedLabeling
+    QgsSingleSymbolRenderer, QgsRuleBasedLabeling, QgsLineString,
+    QgsGeometryCollection, QgsCsException, QgsTask, QgsApplication,
+    QgsFeatureRequest, QgsUnitTypes, QgsSpatialIndex, QgsRectangle, QgsVectorDataProvider,
+    QgsMultiLineString, QgsExpression, qgsfunction, NULL
 )
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+import codecs
 import csv
+import io
+import itertools
+import math
 import os
+import re
+import time
 import traceback
 import logging
+from abc import ABCMeta, abstractmethod
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+###############################################################################
+# RILEVAMENTO ENCODING DEI FILE CSV
+###############################################################################
+# Byte letti dall'inizio del file per determinare l'encoding (non serve leggere tutto il file)
+ENCODING_SAMPLE_SIZE = 256 * 1024
+# Dimensione dei blocchi passati al decoder incrementale
+ENCODING_CHUNK_SIZE = 16 * 1024
+
+# BOM riconosciuti: UTF-32 va controllato prima di UTF-16 perché ne condivide i primi byte
+ENCODING_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Encoding provati in ordine (iso-8859-1 decodifica qualsiasi byte, quindi è l'ultima spiaggia)
+ENCODING_CANDIDATES = ['utf-8', 'cp1252', 'iso-8859-1']
+
+# Cache dell'encoding per file: (percorso, dimensione, data modifica) -> encoding
+_encoding_cache = {}
+
+
+def sniff_bom_encoding(sample):
+    """Restituisce l'encoding indicato dal BOM all'inizio del campione, oppure None"""
+    for bom, encoding in ENCODING_BOMS:
+        if sample.startswith(bom):
+            return encoding
+    return None
+
+
+def sample_decodes_as(sample, encoding, is_complete):
+    """Verifica con un decoder incrementale se il campione è decodificabile con l'encoding dato"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        for start in range(0, len(sample), ENCODING_CHUNK_SIZE):
+            decoder.decode(sample[start:start + ENCODING_CHUNK_SIZE], final=False)
+        # Se il campione è troncato, un carattere multibyte a metà non è un errore
+        decoder.decode(b'', final=is_complete)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def detect_file_encoding(file_path, sample_size=ENCODING_SAMPLE_SIZE):
+    """Determina l'encoding di un file leggendone solo l'inizio (risultato in cache per file)"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return 'utf-8'
+
+    cache_key = (os.path.normcase(os.path.abspath(file_path)), stat.st_size, stat.st_mtime_ns)
+    cached = _encoding_cache.get(cache_key)
+    if cached:
+        return cached
+
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    is_complete = len(sample) >= stat.st_size
+
+    encoding = sniff_bom_encoding(sample)
+    if not encoding:
+        for candidate in ENCODING_CANDIDATES:
+            if sample_decodes_as(sample, candidate, is_complete):
+                encoding = candidate
+                break
+        else:
+            encoding = 'utf-8'
+
+    _encoding_cache[cache_key] = encoding
+    logging.info(f"Encoding rilevato per {file_path}: {encoding} (campione di {len(sample)} byte)")
+    return encoding
+
+###############################################################################
+# LETTURA CSV IN STREAMING (SENZA PROVIDER DELIMITEDTEXT)
+###############################################################################
+# Righe lette per dedurre il tipo dei campi
+TYPE_SAMPLE_ROWS = 1000
+
+# Feature accumulate in memoria prima di ogni addFeatures sul provider
+IMPORT_BATCH_SIZE = 10000
+
+# Feature lette per ogni blocco di trasformazione in esportazione
+EXPORT_BATCH_SIZE = 10000
+
+# Intervallo minimo (in secondi) tra due aggiornamenti della barra di avanzamento
+PROGRESS_UPDATE_INTERVAL = 0.1
+# Righe errate dopo le quali la validazione dell'importazione si ferma
+VALIDATION_MAX_ERRORS = 50
+
+# Riconoscimento dei valori numerici (stesse regole del rilevamento tipi di QGIS)
+INTEGER_VALUE_RE = re.compile(r'^\s*[+-]?\d+\s*$')
+REAL_VALUE_RE = re.compile(r'^\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*$')
+
+# Nome del tipo usato per i campi del layer in memoria
+CSV_FIELD_TYPE_NAMES = {
+    QVariant.Int: 'integer',
+    QVariant.LongLong: 'integer64',
+    QVariant.Double: 'double',
+    QVariant.String: 'text',
+}
+
+# Conversione del testo di una cella nel tipo del campo
+CSV_VALUE_PARSERS = {
+    QVariant.Int: int,
+    QVariant.LongLong: int,
+    QVariant.Double: float,
+}
+
+
+def widen_field_type(field_type, value):
+    """Tipo più stretto tra Int, LongLong, Double e String che contiene field_type (None = ancora nessun valore) e value"""
+    if not value or value.isspace() or field_type == QVariant.String:
+        return field_type
+    if field_type in (None, QVariant.Int, QVariant.LongLong) and INTEGER_VALUE_RE.match(value):
+        if -2**31 <= int(value) < 2**31:
+            return field_type or QVariant.Int
+        return QVariant.LongLong
+    if REAL_VALUE_RE.match(value):
+        return QVariant.Double
+    return QVariant.String
+
+
+def infer_field_type(values):
+    """Deduce il tipo di una colonna (Int, LongLong, Double o String) da un campione di valori"""
+    field_type = None
+    for value in values:
+        field_type = widen_field_type(field_type, value)
+        if field_type == QVariant.String:
+            break
+    return field_type if field_type is not None else QVariant.String
+
+
+def build_row_converter(source_fields, selected_fields, field_types, failures=None):
+    """Crea la funzione che estrae da una riga CSV i valori dei campi selezionati, già convertiti.
+
+    I valori che non rientrano nel tipo del campo diventano NULL e vengono contati per campo in failures.
+    """
+    columns = [(name, source_fields.index(name), CSV_VALUE_PARSERS.get(field_types[name]))
+               for name in selected_fields]
+    failures = failures if failures is not None else Counter()
+
+    def convert(row):
+        values = []
+        row_length = len(row)
+        for name, index, parser in columns:
+            value = row[index] if index < row_length else None
+            if parser is not None:
+                # Campi numerici: vuoto diventa NULL, non convertibile diventa NULL e viene contato
+                try:
+                    value = parser(value) if value and not value.isspace() else None
+                except ValueError:
+                    failures[name] += 1
+                    value = None
+            values.append(value)
+        return values
+
+    return convert
+
+
+class CsvPointReader:
+    """Legge un file CSV in streaming, riga per riga, con il modulo csv di Python"""
+
+    def __init__(self, file_path, encoding, has_header):
+        self.file_path = file_path
+        self.encoding = encoding
+        self.has_header = has_header
+        self.file_size = os.path.getsize(file_path)
+        self.field_names = []
+        self.sample_row_count = 0
+        self._raw = None
+
+    def read_field_names(self):
+        """Legge la prima riga e restituisce i nomi dei campi (field_N se il file non ha header)"""
+        with open(self.file_path, 'r', encoding=self.encoding, errors='replace', newline='') as f:
+            first_row = next(csv.reader(f), [])
+        if self.has_header:
+            self.field_names = first_row
+        else:
+            self.field_names = [f"field_{i+1}" for i in range(len(first_row))]
+        return self.field_names
+
+    def infer_field_types(self, field_names, sample_size=TYPE_SAMPLE_ROWS):
+        """Deduce il tipo dei campi indicati leggendo solo le prime righe del file"""
+        indexes = [(name, self.field_names.index(name)) for name in field_names]
+        samples = {name: [] for name in field_names}
+        count = 0
+        rows = self.rows()
+        try:
+            for _, row in rows:
+                for name, index in indexes:
+                    if index < len(row):
+                        samples[name].append(row[index])
+                count += 1
+                if count >= sample_size:
+                    break
+        finally:
+            rows.close()
+        self.sample_row_count = count
+        return {name: infer_field_type(values) for name, values in samples.items()}
+
+    def rows(self):
+        """Generatore di (numero di riga nel file, valori) per ogni riga di dati"""
+        raw = open(self.file_path, 'rb')
+        self._raw = raw
+        try:
+            text = io.TextIOWrapper(raw, encoding=self.encoding, errors='replace', newline='')
+            reader = csv.reader(text)
+            if self.has_header:
+                next(reader, None)
+            for row in reader:
+                if not row:
+                    continue  # Salta le righe vuote
+                yield reader.line_num, row
+        finally:
+            self._raw = None
+            raw.close()
+
+    def position(self):
+        """Byte del file letti finora (per la barra di avanzamento)"""
+        raw = self._raw
+        if raw is None or raw.closed:
+            return self.file_size
+        return raw.tell()
+
+
+###############################################################################
+# CONVERSIONE DELLE COORDINATE SESSAGESIMALI (DMS)
+###############################################################################
+# Pattern precompilati, uno per ogni formato del menu "Formato" dell'importazione.
+# Ogni pattern riconosce l'emisfero sia prima che dopo il valore.
+DMS_PATTERNS = {
+    # Formato: 45°30'15.5"N o N 45° 30' 15.5"
+    'standard': re.compile(
+        r"""([NSEWnsew]?)\s*([+-]?\d+)\s*[°º\s]\s*(\d+)\s*['’′\s]\s*(\d+(?:\.\d+)?)\s*(?:["”″]|'')?\s*([NSEWnsew]?)"""
+    ),
+    # Formato: 45 30 15.5 N
+    'spaces': re.compile(r"([NSEWnsew]?)\s*([+-]?\d+)\s+(\d+)\s+(\d+(?:\.\d+)?)\s*([NSEWnsew]?)"),
+    # Formato: 45:30:15.5N
+    'colons': re.compile(r"([NSEWnsew]?)\s*([+-]?\d+):(\d+):(\d+(?:\.\d+)?)\s*([NSEWnsew]?)"),
+    # Formato: 45d30m15.5s (la "s" minuscola finale indica i secondi, la "S" maiuscola l'emisfero sud)
+    'letters': re.compile(r"([NSEWnsew]?)\s*([+-]?\d+)\s*[dD]\s*(\d+)\s*[mM]\s*(\d+(?:\.\d+)?)\s*s?\s*([NSEWnsew]?)"),
+}
+
+
+def parse_float_column(values):
+    """Converte una colonna di testi in decimali restituendo (valori, [(indice, valore non valido)])"""
+    result = array('d')
+    failures = []
+    for i, value in enumerate(values):
+        try:
+            result.append(float(value))
+        except (TypeError, ValueError):
+            result.append(math.nan)
+            failures.append((i, value))
+    return result, failures
+
+
+class DmsParser:
+    """Converte coordinate sessagesimali in decimali usando i pattern precompilati di DMS_PATTERNS.
+
+    Il primo pattern che riconosce un valore viene agganciato e provato per primo sui valori
+    successivi: in una colonna omogenea ogni valore costa un solo match.
+    """
+
+    def __init__(self, preferred_format=None):
+        names = list(DMS_PATTERNS)
+        if preferred_format in DMS_PATTERNS:
+            names.remove(preferred_format)
+            names.insert(0, preferred_format)
+        self.patterns = [DMS_PATTERNS[name] for name in names]
+        self.locked_pattern = None
+
+    def match(self, text):
+        """Restituisce il match del primo pattern che riconosce l'intero testo (o None)"""
+        if self.locked_pattern is not None:
+            match = self.locked_pattern.fullmatch(text)
+            if match:
+                return match
+        for pattern in self.patterns:
+            if pattern is self.locked_pattern:
+                continue
+            match = pattern.fullmatch(text)
+            if match:
+                self.locked_pattern = pattern
+                return match
+        return None
+
+    def parse(self, value):
+        """Converte un singolo valore DMS (o già decimale) in gradi decimali"""
+        text = str(value).strip()
+        match = self.match(text)
+        if match is None:
+            # Se non matcha nessun pattern DMS, prova come decimale
+            try:
+                return float(text)
+            except ValueError:
+                raise ValueError(f"Formato coordinate non valido: {value}")
+
+        prefix, degrees, minutes, seconds, suffix = match.groups()
+        if prefix and suffix:
+            raise ValueError(f"Emisfero indicato due volte: {value}")
+        minutes = float(minutes)
+        seconds = float(seconds)
+        if minutes >= 60 or seconds >= 60:
+            raise ValueError(f"Minuti o secondi fuori intervallo: {value}")
+
+        decimal = abs(float(degrees)) + minutes / 60 + seconds / 3600
+        # Il segno si legge dal testo, così anche "-0 30 00" resta negativo
+        if degrees.startswith('-') or (prefix or suffix).upper() in ('S', 'W'):
+            decimal = -decimal
+        return decimal
+
+    def parse_column(self, values):
+        """Converte una colonna di valori restituendo (valori, [(indice, valore non valido)])"""
+        result = array('d')
+        failures = []
+        parse = self.parse
+        for i, value in enumerate(values):
+            try:
+                result.append(parse(value))
+            except ValueError:
+                result.append(math.nan)
+                failures.append((i, value))
+        return result, failures
+
+
+###############################################################################
+# TRASFORMAZIONE DELLE COORDINATE A BLOCCHI
+###############################################################################
+class TransformCache:
+    """Cache delle QgsCoordinateTransform del progetto, per coppia di CRS e contesto di trasformazione.
+
+    Le trasformazioni usano il contesto (trasformazioni di datum) del progetto corrente; la cache
+    viene svuotata quando cambiano il CRS del progetto, il contesto o il progetto stesso.
+    Da usare solo nel thread principale (i task creano le proprie trasformazioni).
+    """
+
+    transforms = {}   # (CRS sorgente, CRS destinazione, generazione del contesto) -> trasformazione
+    generation = 0    # Incrementata a ogni cambio del contesto di trasformazione
+    connected = False
+
+    @staticmethod
+    def crs_key(crs):
+        return crs.authid() or crs.toWkt()
+
+    @classmethod
+    def get(cls, source_crs, dest_crs):
+        """Restituisce la trasformazione da source_crs a dest_crs (None se i CRS coincidono)"""
+        if source_crs == dest_crs:
+            return None
+        if not cls.connected:
+            project = QgsProject.instance()
+            project.crsChanged.connect(cls.invalidate)
+            project.transformContextChanged.connect(cls.invalidate)
+            project.cleared.connect(cls.invalidate)
+            cls.connected = True
+        key = (cls.crs_key(source_crs), cls.crs_key(dest_crs), cls.generation)
+        transform = cls.transforms.get(key)
+        if transform is None:
+            transform = QgsCoordinateTransform(source_crs, dest_crs, QgsProject.instance())
+            cls.transforms[key] = transform
+        return transform
+
+    @classmethod
+    def invalidate(cls):
+        """Scarta tutte le trasformazioni in cache"""
+        cls.transforms.clear()
+        cls.generation += 1
+
+
+def line_coordinates(line):
+    """Restituisce le coordinate x e y di un QgsLineString come liste"""
+    if hasattr(line, 'xVector'):
+        return line.xVector(), line.yVector()
+    count = line.numPoints()
+    return [line.xAt(i) for i in range(count)], [line.yAt(i) for i in range(count)]
+
+
+def transform_coordinates(transform, xs, ys):
+    """Trasforma interi blocchi di coordinate con una sola chiamata a QGIS
+    
+    xs e ys possono essere array('d'), array NumPy o liste. Restituisce (xs, ys, failed) con
+    le coordinate trasformate come array('d') e gli indici dei punti non trasformabili
+    (che restano a NaN). Se il blocco fallisce si ripiega sulla trasformazione punto per punto.
+    """
+    xs = xs.tolist() if hasattr(xs, 'tolist') else list(xs)
+    ys = ys.tolist() if hasattr(ys, 'tolist') else list(ys)
+    if transform is None or not xs:
+        return array('d', xs), array('d', ys), []
+
+    try:
+        line = QgsLineString(xs, ys)
+        line.transform(transform)
+        out_x, out_y = line_coordinates(line)
+        return array('d', out_x), array('d', out_y), []
+    except QgsCsException as e:
+        logging.warning(f"Trasformazione a blocchi non riuscita, uso la trasformazione punto per punto: {e}")
+
+    out_x = array('d', xs)
+    out_y = array('d', ys)
+    failed = []
+    for i in range(len(xs)):
+        try:
+            point = transform.transform(QgsPointXY(xs[i], ys[i]))
+            out_x[i] = point.x()
+            out_y[i] = point.y()
+        except QgsCsException:
+            out_x[i] = out_y[i] = math.nan
+            failed.append(i)
+    return out_x, out_y, failed
+
+
+def transform_geometries(transform, geometries):
+    """Trasforma un elenco di QgsGeometry con una sola chiamata, raggruppandole in una collezione
+    
+    Restituisce nuove geometrie nello stesso ordine; le geometrie nulle o non trasformabili
+    diventano None.
+    """
+    if transform is None:
+        return [QgsGeometry(geom) if geom and not geom.isNull() else None for geom in geometries]
+
+    collection = QgsGeometryCollection()
+    positions = []
+    for i, geom in enumerate(geometries):
+        if geom and not geom.isNull():
+            collection.addGeometry(geom.constGet().clone())
+            positions.append(i)
+
+    result = [None] * len(geometries)
+    try:
+        collection.transform(transform)
+        for part_index, i in enumerate(positions):
+            result[i] = QgsGeometry(collection.geometryN(part_index).clone())
+        return result
+    except QgsCsException as e:
+        logging.warning(f"Trasformazione a blocchi non riuscita, uso la trasformazione per geometria: {e}")
+
+    for i in positions:
+        geom_copy = QgsGeometry(geometries[i])
+        try:
+            geom_copy.transform(transform)
+            result[i] = geom_copy
+        except QgsCsException:
+            logging.warning(f"Impossibile trasformare la geometria {i}")
+    return result
+
+
+###############################################################################
+# IMPORTAZIONE CSV IN BACKGROUND
+###############################################################################
+class CsvImportTask(QgsTask):
+    """Legge il CSV, converte le coordinate e costruisce il layer in memoria in un thread secondario.
+
+    Prima della costruzione un passaggio di sola validazione controlla le coordinate e si ferma
+    dopo max_errors righe errate. Il layer viene creato nel thread del task e spostato nel thread
+    principale alla fine di run(): aggiunta al progetto, etichette e stile restano al dialog,
+    che ascolta taskCompleted/taskTerminated.
+    """
+
+    def __init__(self, reader, layer_name, selected_fields, x_field, y_field,
+                 source_crs, target_crs, transform_context, dms_format=None,
+                 batch_size=IMPORT_BATCH_SIZE, name_field=None, elevation_field=None,
+                 skip_invalid=False, max_errors=VALIDATION_MAX_ERRORS):
+        super().__init__(f"Importazione CSV: {layer_name}", QgsTask.CanCancel)
+        self.reader = reader
+        self.layer_name = layer_name
+        self.selected_fields = selected_fields
+        self.x_field = x_field
+        self.y_field = y_field
+        self.source_crs = source_crs
+        self.target_crs = target_crs
+        self.transform_context = transform_context
+        self.dms_format = dms_format
+        self.batch_size = max(1, batch_size)
+        # Campi nome e quota: non servono alla lettura, il dialog li riprende al termine
+        self.name_field = name_field
+        self.elevation_field = elevation_field
+        # Con skip_invalid la validazione viene saltata e le righe errate vengono scartate
+        self.skip_invalid = skip_invalid
+        self.max_errors = max(1, max_errors)
+        # Coordinate geografiche: si controllano i limiti WGS84 prima di qualsiasi trasformazione
+        self.check_wgs84_bounds = QgsCoordinateReferenceSystem(source_crs).isGeographic()
+
+        # Risultati letti dal dialog nel thread principale
+        self.layer = None
+        self.field_types = {}
+        # Tipi dei campi dedotti da tutte le righe durante la validazione (None se non completata)
+        self.scanned_field_types = None
+        self.scanned_rows = 0
+        self.unconverted_values = Counter()  # campo -> valori non convertibili nel tipo dedotto (NULL)
+        self.processed_features = 0
+        self.invalid_features = 0
+        self.validation_errors = []      # (numero di riga, descrizione) delle righe errate
+        self.validation_complete = True  # False se la validazione si è fermata a max_errors
+        self.error = None       # Messaggio per l'utente (importazione non eseguita)
+        self.exception = None   # Errore imprevisto durante la lettura
+        self.last_progress_update = 0.0
+
+    def with_skip_invalid(self):
+        """Crea un nuovo task con le stesse impostazioni che scarta le righe errate"""
+        task = CsvImportTask(
+            self.reader, self.layer_name, self.selected_fields, self.x_field, self.y_field,
+            self.source_crs, self.target_crs, self.transform_context, dms_format=self.dms_format,
+            batch_size=self.batch_size, name_field=self.name_field,
+            elevation_field=self.elevation_field, skip_invalid=True, max_errors=self.max_errors
+        )
+        # Se la validazione ha letto tutto il file i tipi dedotti su tutte le righe restano validi
+        task.scanned_field_types = self.scanned_field_types
+        task.scanned_rows = self.scanned_rows
+        return task
+
+    def run(self):
+        try:
+            if self.skip_invalid:
+                return self.build_layer(0, 100)
+            # Validazione sul 30% della barra, costruzione del layer sul resto
+            if not self.validate_rows(0, 30):
+                return False
+            return self.build_layer(30, 70)
+        except Exception as e:
+            self.exception = e
+            logging.error(f"Errore durante l'importazione delle feature: {e}")
+            return False
+
+    def progress_checkpoint(self, start, span):
+        """Aggiorna l'avanzamento (al massimo ogni PROGRESS_UPDATE_INTERVAL secondi); False se annullato"""
+        now = time.monotonic()
+        if now - self.last_progress_update >= PROGRESS_UPDATE_INTERVAL:
+            self.last_progress_update = now
+            file_size = max(self.reader.file_size, 1)
+            self.setProgress(start + min(span - 1, self.reader.position() * span // file_size))
+            if self.isCanceled():
+                logging.info("Importazione interrotta dall'utente.")
+                return False
+        return True
+
+    def coordinate_checker(self):
+        """Restituisce la funzione che converte un blocco di coordinate segnalando gli errori riga per riga"""
+        # Il parser DMS aggancia il formato della colonna: uno per colonna
+        if self.dms_format is not None:
+            parse_x_column = DmsParser(self.dms_format).parse_column
+            parse_y_column = DmsParser(self.dms_format).parse_column
+        else:
+            parse_x_column = parse_y_column = parse_float_column
+        check_wgs84_bounds = self.check_wgs84_bounds
+        x_field = self.x_field
+        y_field = self.y_field
+
+        def check(raw_x, raw_y):
+            """Restituisce (xs, ys, {indice nel blocco: descrizione dell'errore})"""
+            xs, x_failures = parse_x_column(raw_x)
+            ys, y_failures = parse_y_column(raw_y)
+            errors = {}
+            for i, value in x_failures:
+                errors[i] = f"valore non valido nel campo '{x_field}': {value!r}"
+            for i, value in y_failures:
+                errors.setdefault(i, f"valore non valido nel campo '{y_field}': {value!r}")
+            if check_wgs84_bounds:
+                for i in range(len(xs)):
+                    if i not in errors and not (-90 <= ys[i] <= 90 and -180 <= xs[i] <= 180):
+                        errors[i] = f"coordinate fuori dai limiti WGS84: {raw_x[i]!r}, {raw_y[i]!r}"
+            return xs, ys, errors
+
+        return check
+
+    def validate_rows(self, progress_start, progress_span):
+        """Controlla le coordinate di tutte le righe senza costruire feature; si ferma dopo max_errors errori"""
+        reader = self.reader
+        source_fields = reader.field_names
+        x_index = source_fields.index(self.x_field)
+        y_index = source_fields.index(self.y_field)
+        min_length = max(x_index, y_index) + 1
+        check = self.coordinate_checker()
+        errors = self.validation_errors
+        # I tipi dei campi si allargano su tutte le righe lette (il campione iniziale può non bastare);
+        # senza header i campi sono tutti testo
+        field_types = {name: None for name in self.selected_fields}
+        typed_columns = [(name, source_fields.index(name)) for name in self.selected_fields] if reader.has_header else []
+        row_count = 0
+
+        batch_raw_x = []
+        batch_raw_y = []
+        batch_lines = []
+
+        def check_batch():
+            _, _, batch_errors = check(batch_raw_x, batch_raw_y)
+            for i in sorted(batch_errors):
+                errors.append((batch_lines[i], batch_errors[i]))
+            del batch_raw_x[:], batch_raw_y[:], batch_lines[:]
+
+        rows = reader.rows()
+        try:
+            for line_number, row in rows:
+                if not self.progress_checkpoint(progress_start, progress_span):
+                    return False
+                row_count += 1
+                row_length = len(row)
+                for name, index in typed_columns:
+                    if index < row_length:
+                        field_types[name] = widen_field_type(field_types[name], row[index])
+                if typed_columns and row_count % TYPE_SAMPLE_ROWS == 0:
+                    # I campi diventati testo non vanno più controllati
+                    typed_columns = [(name, index) for name, index in typed_columns
+                                     if field_types[name] != QVariant.String]
+                if len(row) < min_length:
+                    errors.append((line_number, "colonne delle coordinate mancanti"))
+                else:
+                    batch_raw_x.append(row[x_index])
+                    batch_raw_y.append(row[y_index])
+                    batch_lines.append(line_number)
+                    if len(batch_lines) >= self.batch_size:
+                        check_batch()
+                if len(errors) >= self.max_errors:
+                    # Fail-fast: bastano i primi errori per decidere
+                    self.validation_complete = False
+                    break
+            if batch_lines:
+                check_batch()
+        finally:
+            rows.close()
+
+        if self.validation_complete:
+            # Tutto il file è stato letto: i tipi valgono per ogni riga
+            self.scanned_field_types = {
+                name: field_type if field_type is not None and reader.has_header else QVariant.String
+                for name, field_type in field_types.items()
+            }
+            self.scanned_rows = row_count
+
+        if errors:
+            errors.sort()
+            if len(errors) > self.max_errors:
+                self.validation_complete = False
+                del errors[self.max_errors:]
+            self.error = "Sono state trovate righe con coordinate non valide."
+            logging.warning(f"Validazione CSV: {len(errors)} righe con coordinate non valide")
+            return False
+        return True
+
+    def build_layer(self, progress_start, progress_span):
+        """Crea il layer in memoria e lo popola a blocchi di batch_size feature"""
+        reader = self.reader
+        source_fields = reader.field_names
+
+        # Tipi dei campi dedotti da tutte le righe in validazione, altrimenti da un campione
+        # (senza header sono tutti testo)
+        if self.scanned_field_types is not None:
+            field_types = self.scanned_field_types
+            row_count = self.scanned_rows
+        else:
+            field_types = reader.infer_field_types(self.selected_fields)
+            row_count = reader.sample_row_count
+        if not reader.has_header:
+            field_types = {field_name: QVariant.String for field_name in self.selected_fields}
+        self.field_types = field_types
+
+        if row_count == 0:
+            self.error = "Il file CSV non contiene alcuna feature."
+            logging.warning("File CSV vuoto.")
+            return False
+
+        # Creazione layer in memoria
+        mem_layer = QgsVectorLayer(f"Point?crs={self.target_crs}", self.layer_name, "memory")
+        mem_provider = mem_layer.dataProvider()
+
+        # Costruzione dei campi
+        fields = QgsFields()
+        for field_name in self.selected_fields:
+            field_type = field_types[field_name]
+            fields.append(QgsField(field_name, field_type, CSV_FIELD_TYPE_NAMES[field_type]))
+        mem_provider.addAttributes(fields)
+        mem_layer.updateFields()
+
+        # Prepara la trasformazione delle coordinate se necessario
+        source_crs = QgsCoordinateReferenceSystem(self.source_crs)
+        dest_crs = QgsCoordinateReferenceSystem(self.target_crs)
+        transform = None
+        if source_crs != dest_crs:
+            transform = QgsCoordinateTransform(source_crs, dest_crs, self.transform_context)
+
+        x_index = source_fields.index(self.x_field)
+        y_index = source_fields.index(self.y_field)
+        convert_row = build_row_converter(source_fields, self.selected_fields, field_types, self.unconverted_values)
+        check = self.coordinate_checker()
+
+        # Blocco di righe in attesa: testi delle coordinate (convertiti per colonna) e attributi
+        batch_raw_x = []
+        batch_raw_y = []
+        batch_attributes = []
+        batch_lines = []
+
+        def flush_batch():
+            """Converte e trasforma il blocco di coordinate e inserisce le feature con un solo addFeatures"""
+            raw_xs, raw_ys, rejected = check(batch_raw_x, batch_raw_y)
+            for i in sorted(rejected):
+                logging.warning(f"Riga {batch_lines[i]} scartata: {rejected[i]}")
+
+            # Solo le righe valide entrano nella trasformazione a blocco
+            valid = [i for i in range(len(batch_lines)) if i not in rejected]
+            if rejected:
+                raw_xs = array('d', (raw_xs[i] for i in valid))
+                raw_ys = array('d', (raw_ys[i] for i in valid))
+            xs, ys, failed = transform_coordinates(transform, raw_xs, raw_ys)
+            for j in failed:
+                logging.warning(f"Errore nella trasformazione delle coordinate alla riga {batch_lines[valid[j]]}")
+            failed = set(failed)
+
+            new_features = []
+            for j, i in enumerate(valid):
+                if j in failed:
+                    continue
+                new_feat = QgsFeature()
+                new_feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(xs[j], ys[j])))
+                new_feat.setAttributes(batch_attributes[i])
+                new_features.append(new_feat)
+            mem_provider.addFeatures(new_features)
+            self.processed_features += len(new_features)
+            self.invalid_features += len(rejected) + len(failed)
+            del batch_raw_x[:], batch_raw_y[:], batch_attributes[:], batch_lines[:]
+
+        for line_number, row in reader.rows():
+            if not self.progress_checkpoint(progress_start, progress_span):
+                return False
+            # Le righe troppo corte non hanno le colonne delle coordinate
+            if len(row) <= max(x_index, y_index):
+                logging.warning(f"Riga {line_number} scartata: colonne delle coordinate mancanti")
+                self.invalid_features += 1
+                continue
+
+            batch_raw_x.append(row[x_index])
+            batch_raw_y.append(row[y_index])
+            batch_attributes.append(convert_row(row))
+            batch_lines.append(line_number)
+
+            # Converte, trasforma e inserisce le feature a blocchi
+            if len(batch_attributes) >= self.batch_size:
+                flush_batch()
+
+        if batch_attributes:
+            flush_batch()
+
+        # Senza "salta righe errate" un errore (es. di trasformazione) annulla l'importazione
+        if self.invalid_features > 0 and not self.skip_invalid:
+            self.error = f"Sono state trovate {self.invalid_features} feature con coordinate non valide. Importazione annullata."
+            return False
+        if self.processed_features == 0:
+            self.error = "Nessuna riga del file CSV ha coordinate valide."
+            return False
+        for field_name, count in self.unconverted_values.items():
+            logging.warning(f"Campo '{field_name}': {count} valori non compatibili con il tipo dedotto, importati come NULL")
+
+        mem_layer.updateExtents()
+        # Il layer è stato creato in questo thread: va restituito al thread principale prima di usarlo
+        mem_layer.moveToThread(QCoreApplication.instance().thread())
+        self.layer = mem_layer
+        self.setProgress(100)
+        return True
+
+
+###############################################################################
+# INDICE DEI NUMERI DEI PUNTI
+###############################################################################
+# Numero di un punto: le cifre iniziali del nome ("12", "12a", "12-bis")
+POINT_NUMBER_RE = re.compile(r'(\d+)(?:\D|$)')
+# Campi usati come nome del punto se il layer non indica il campo dell'importazione
+POINT_NAME_FIELD_CANDIDATES = ['nome', 'name', 'id', 'punto', 'point', 'numero', 'number']
+
+
+def point_number(value):
+    """Restituisce il numero all'inizio del nome di un punto (None se il nome non inizia con cifre)"""
+    if value is None:
+        return None
+    match = POINT_NUMBER_RE.match(str(value))
+    return int(match.group(1)) if match else None
+
+
+def point_name_field(layer):
+    """Campo con il nome dei punti: quello dell'importazione CSV o un campo dal nome comune"""
+    field_names = layer.fields().names()
+    name_field = layer.customProperty('import_name_field')
+    if name_field:
+        return name_field if name_field in field_names else None
+    lower_names = {name.lower(): name for name in field_names}
+    for candidate in POINT_NAME_FIELD_CANDIDATES:
+        if candidate in lower_names:
+            return lower_names[candidate]
+    return None
+
+
+class PointNumberIndex:
+    """Nomi e numeri dei punti di un layer, aggiornati dai segnali di modifica invece di riscandire il layer.
+
+    C'è un solo indice per layer (for_layer), condiviso da tutte le funzioni di numerazione: viene
+    costruito alla prima richiesta e poi segue le modifiche in corso (featureAdded, featureDeleted,
+    attributeValueChanged) e quelle salvate (committedFeaturesAdded, committedAttributeValuesChanges,
+    committedFeaturesRemoved), così massimo, prossimo numero ed esistenza di un nome costano O(1).
+    """
+
+    instances = {}  # id del layer -> indice
+
+    @classmethod
+    def for_layer(cls, layer):
+        """Restituisce (creandolo se serve) l'indice del layer"""
+        index = cls.instances.get(layer.id())
+        if index is None:
+            index = cls(layer)
+            cls.instances[layer.id()] = index
+            layer.willBeDeleted.connect(lambda layer_id=layer.id(): cls.instances.pop(layer_id, None))
+        return index
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.name_field = None
+        self.name_index = -1
+        self.names = {}             # fid -> nome del punto
+        self.name_counts = Counter()  # nome -> quante feature lo usano
+        self.numbers = {}           # fid -> numero del punto
+        self.counts = Counter()     # numero -> quante feature lo usano
+        self.temporary_fids = set()  # ids negativi delle feature nuove non ancora salvate
+        self.max_number = 0
+        self.built = False
+        self.deferred_fids = None  # Feature aggiunte durante deferred_updates()
+        # Modifiche nel buffer di editing (ids temporanei negativi per le feature nuove)
+        layer.featureAdded.connect(self.on_feature_added)
+        layer.featureDeleted.connect(self.on_feature_deleted)
+        layer.attributeValueChanged.connect(self.on_attribute_value_changed)
+        # Modifiche salvate nel provider (ids definitivi)
+        layer.committedFeaturesAdded.connect(self.on_committed_features_added)
+        layer.committedFeaturesRemoved.connect(self.on_committed_features_removed)
+        layer.committedAttributeValuesChanges.connect(self.on_committed_attribute_values_changes)
+        layer.updatedFields.connect(self.invalidate)
+        layer.afterRollBack.connect(self.invalidate)
+
+    def invalidate(self):
+        """Segna l'indice da ricostruire alla prossima richiesta"""
+        self.built = False
+
+    def build(self):
+        """Legge una sola volta il campo nome di tutte le feature"""
+        self.names = {}
+        self.name_counts = Counter()
+        self.numbers = {}
+        self.counts = Counter()
+        self.temporary_fids = set()
+        self.max_number = 0
+        self.name_field = point_name_field(self.layer)
+        self.name_index = self.layer.fields().indexFromName(self.name_field) if self.name_field else -1
+        self.built = True
+        if self.name_index == -1:
+            return
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes([self.name_index])
+        for feature in self.layer.getFeatures(request):
+            self.set_name(feature.id(), feature.attribute(self.name_index))
+
+    def ensure_built(self):
+        if not self.built:
+            self.build()
+
+    def set_name(self, fid, value):
+        """Registra (o sostituisce) il nome della feature fid"""
+        self.remove_feature(fid)
+        if value is None or value == NULL:
+            return
+        name = str(value)
+        self.names[fid] = name
+        if fid < 0:
+            self.temporary_fids.add(fid)
+        self.name_counts[name] += 1
+        number = point_number(name)
+        if number is None:
+            return
+        self.numbers[fid] = number
+        self.counts[number] += 1
+        if number > self.max_number:
+            self.max_number = number
+
+    def remove_feature(self, fid):
+        """Toglie dall'indice nome e numero della feature fid"""
+        name = self.names.pop(fid, None)
+        self.temporary_fids.discard(fid)
+        if name is not None:
+            self.name_counts[name] -= 1
+            if self.name_counts[name] <= 0:
+                del self.name_counts[name]
+        number = self.numbers.pop(fid, None)
+        if number is None:
+            return
+        self.counts[number] -= 1
+        if self.counts[number] <= 0:
+            del self.counts[number]
+            # Il massimo va ricalcolato solo se sparisce l'ultimo punto con quel numero
+            if number == self.max_number:
+                self.max_number = max(self.counts, default=0)
+
+    def on_feature_added(self, fid):
+        if not self.built or self.name_index == -1:
+            return
+        if self.deferred_fids is not None:
+            self.deferred_fids.append(fid)
+            return
+        self.set_name(fid, self.layer.getFeature(fid).attribute(self.name_index))
+
+    @contextmanager
+    def deferred_updates(self):
+        """Durante il blocco raccoglie le feature aggiunte e le indicizza alla fine con una sola richiesta"""
+        self.deferred_fids = []
+        try:
+            yield self
+        finally:
+            fids, self.deferred_fids = self.deferred_fids, None
+            if fids and self.built:
+                request = (QgsFeatureRequest().setFilterFids(fids)
+                           .setFlags(QgsFeatureRequest.NoGeometry)
+                           .setSubsetOfAttributes([self.name_index]))
+                for feature in self.layer.getFeatures(request):
+                    self.set_name(feature.id(), feature.attribute(self.name_index))
+
+    def on_feature_deleted(self, fid):
+        if self.built:
+            self.remove_feature(fid)
+
+    def on_attribute_value_changed(self, fid, field_index, value):
+        if self.built and field_index == self.name_index:
+            self.set_name(fid, value)
+
+    def on_committed_features_added(self, layer_id, features):
+        if not self.built or self.name_index == -1:
+            return
+        # Le feature salvate sostituiscono quelle con id temporaneo (negativo) del buffer
+        for fid in list(self.temporary_fids):
+            self.remove_feature(fid)
+        for feature in features:
+            self.set_name(feature.id(), feature.attribute(self.name_index))
+
+    def on_committed_features_removed(self, layer_id, fids):
+        if self.built:
+            for fid in fids:
+                self.remove_feature(fid)
+
+    def on_committed_attribute_values_changes(self, layer_id, changed_values):
+        if not self.built or self.name_index == -1:
+            return
+        for fid, attributes in changed_values.items():
+            if self.name_index in attributes:
+                self.set_name(fid, attributes[self.name_index])
+
+    def next_number(self):
+        """Prossimo numero libero dopo il massimo del layer"""
+        self.ensure_built()
+        return self.max_number + 1
+
+    def max_point_number(self):
+        """Numero più alto tra i nomi dei punti (0 se non ce ne sono)"""
+        self.ensure_built()
+        return self.max_number
+
+    def name_exists(self, name):
+        """True se un punto del layer ha già questo nome"""
+        self.ensure_built()
+        return str(name) in self.name_counts
+
+    def gaps(self, limit=100):
+        """Primi numeri non usati tra 1 e il massimo, in ordine crescente (al più limit)"""
+        self.ensure_built()
+        missing = []
+        expected = 1
+        # Si scorrono solo i numeri usati: i buchi sono gli intervalli tra due numeri consecutivi
+        for number in sorted(self.counts):
+            while expected < number and len(missing) < limit:
+                missing.append(expected)
+                expected += 1
+            if len(missing) >= limit:
+                break
+            expected = number + 1
+        return missing
+
+
+@qgsfunction(args='auto', group='Spotter', referenced_columns=[], register=False)
+def spotter_next_number(feature, parent, context):
+    """
+    Restituisce il prossimo numero progressivo dei punti del layer corrente, letto dall'indice
+    dei numeri invece di aggregare tutte le feature. Conta le cifre iniziali del nome ("12a" -> 12,
+    "P12" non è numerato). Nei progetti salvati viene sostituita da un'espressione equivalente
+    con sole funzioni native di QGIS.
+    <h4>Sintassi</h4>
+    <p>spotter_next_number()</p>
+    """
+    layer = QgsProject.instance().mapLayer(context.variable('layer_id'))
+    if layer is None:
+        return 1
+    return PointNumberIndex.for_layer(layer).next_number()
+
+
+class PointNumberDefaults:
+    """Valore predefinito del campo nome dei layer importati: il prossimo numero progressivo.
+
+    A plugin caricato è spotter_next_number(), che legge l'indice dei numeri invece di aggregare
+    tutte le feature a ogni punto digitalizzato. Nel progetto salvato e allo scarico del plugin
+    torna l'espressione equivalente con sole funzioni native, così il progetto resta valido anche
+    senza spotter. Le due espressioni usano la stessa regola di POINT_NUMBER_RE (cifre iniziali).
+    """
+
+    FAST_EXPRESSION = 'spotter_next_number()'
+    installed = False
+
+    @staticmethod
+    def portable_expression(field_name):
+        """Espressione con sole funzioni native di QGIS (scandisce tutto il layer a ogni valutazione)"""
+        column = QgsExpression.quotedColumnRef(field_name)
+        return f"coalesce(maximum(to_int(nullif(regexp_substr({column}, '^[0-9]+'), ''))), 0) + 1"
+
+    @staticmethod
+    def legacy_expression(field_name):
+        """Espressione delle versioni precedenti del plugin (cifre in qualsiasi posizione del nome)"""
+        return (f"coalesce(array_max(array_foreach(array_agg(regexp_substr(\"{field_name}\", '[0-9]+')), "
+                f"to_int(@element))), 0) + 1")
+
+    @classmethod
+    def apply(cls, layer, field_index):
+        """Imposta il valore predefinito del campo nome di un layer"""
+        field_name = layer.fields().at(field_index).name()
+        expression = cls.FAST_EXPRESSION if cls.installed else cls.portable_expression(field_name)
+        layer.setDefaultValueDefinition(field_index, QgsDefaultValue(expression))
+
+    @classmethod
+    def install(cls):
+        """Registra la funzione e usa l'espressione veloce nei layer del progetto (all'avvio del plugin)"""
+        QgsExpression.registerFunction(spotter_next_number)
+        project = QgsProject.instance()
+        project.layersAdded.connect(cls.use_fast_defaults)
+        project.writeMapLayer.connect(cls.write_portable_defaults)
+        cls.installed = True
+        cls.use_fast_defaults(project.mapLayers().values())
+
+    @classmethod
+    def uninstall(cls):
+        """Rimette l'espressione nativa nei layer e toglie la funzione (allo scarico del plugin)"""
+        project = QgsProject.instance()
+        project.layersAdded.disconnect(cls.use_fast_defaults)
+        project.writeMapLayer.disconnect(cls.write_portable_defaults)
+        cls.installed = False
+        for layer in project.mapLayers().values():
+            cls.replace_default(layer, fast=False)
+        QgsExpression.unregisterFunction(spotter_next_number.name())
+
+    @classmethod
+    def use_fast_defaults(cls, layers):
+        for layer in layers:
+            cls.replace_default(layer, fast=True)
+
+    @classmethod
+    def replace_default(cls, layer, fast):
+        """Scambia espressione nativa ed espressione veloce sul campo nome del layer"""
+        if not isinstance(layer, QgsVectorLayer):
+            return
+        field_name = point_name_field(layer)
+        field_index = layer.fields().indexFromName(field_name) if field_name else -1
+        if field_index == -1:
+            return
+        current = layer.defaultValueDefinition(field_index)
+        if fast:
+            if current.expression() not in (cls.portable_expression(field_name), cls.legacy_expression(field_name)):
+                return
+            expression = cls.FAST_EXPRESSION
+        else:
+            if current.expression() != cls.FAST_EXPRESSION:
+                return
+            expression = cls.portable_expression(field_name)
+        layer.setDefaultValueDefinition(field_index, QgsDefaultValue(expression, current.applyOnUpdate()))
+
+    @classmethod
+    def write_portable_defaults(cls, layer, layer_element, document):
+        """Nel progetto salvato scrive l'espressione nativa al posto di spotter_next_number()"""
+        defaults = layer_element.elementsByTagName('default')
+        for i in range(defaults.count()):
+            element = defaults.at(i).toElement()
+            if element.attribute('expression') == cls.FAST_EXPRESSION:
+                element.setAttribute('expression', cls.portable_expression(element.attribute('field')))
+
+
+###############################################################################
+# GRIGLIA DEI PUNTI PER LA DE-DUPLICAZIONE DEI VERTICI
+###############################################################################
+# Distanza (in metri) entro la quale due vertici sono considerati lo stesso punto
+VERTEX_MERGE_TOLERANCE = 0.001
+
+
+def metric_tolerance_in_layer_units(layer, tolerance):
+    """Converte una tolleranza in metri nelle unità del CRS del layer (gradi compresi, in modo approssimato)"""
+    factor = QgsUnitTypes.fromUnitToUnitFactor(QgsUnitTypes.DistanceMeters, layer.crs().mapUnits())
+    return tolerance * factor
+
+
+class PointGrid:
+    """Griglia hash di punti: celle di lato pari alla tolleranza, così un punto entro la tolleranza
+    può stare solo nella stessa cella o in una delle 8 adiacenti e la ricerca costa O(1)"""
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.cell_size = tolerance if tolerance > 0 else 1e-9
+        self.cells = {}    # (colonna, riga) -> {chiave: (x, y)}
+        self.points = {}   # chiave -> (cella, x, y)
+
+    def cell_of(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def add(self, key, x, y):
+        self.remove(key)
+        cell = self.cell_of(x, y)
+        self.cells.setdefault(cell, {})[key] = (x, y)
+        self.points[key] = (cell, x, y)
+
+    def remove(self, key):
+        entry = self.points.pop(key, None)
+        if entry is None:
+            return
+        bucket = self.cells[entry[0]]
+        del bucket[key]
+        if not bucket:
+            del self.cells[entry[0]]
+
+    def find_near(self, x, y):
+        """Restituisce la chiave di un punto entro la tolleranza da (x, y), o None"""
+        column, row = self.cell_of(x, y)
+        max_distance = self.tolerance * self.tolerance
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                bucket = self.cells.get((column + dx, row + dy))
+                if not bucket:
+                    continue
+                for key, (px, py) in bucket.items():
+                    if (px - x) * (px - x) + (py - y) * (py - y) <= max_distance:
+                        return key
+        return None
+
+    def __len__(self):
+        return len(self.points)
+
+
+class PointGridIndex:
+    """Griglia dei punti di un layer, costruita una volta e riusata tra un'estrazione e l'altra.
+
+    Come PointNumberIndex c'è un solo indice per layer (for_layer), aggiornato dai segnali di
+    modifica del layer; cambiare tolleranza o CRS lo fa ricostruire alla richiesta successiva.
+    """
+
+    instances = {}  # id del layer -> indice
+
+    @classmethod
+    def for_layer(cls, layer, tolerance=VERTEX_MERGE_TOLERANCE):
+        """Restituisce (creandolo se serve) l'indice del layer con la tolleranza in metri indicata"""
+        index = cls.instances.get(layer.id())
+        if index is None:
+            index = cls(layer, tolerance)
+            cls.instances[layer.id()] = index
+            layer.willBeDeleted.connect(lambda layer_id=layer.id(): cls.instances.pop(layer_id, None))
+        elif index.tolerance != tolerance:
+            index.tolerance = tolerance
+            index.invalidate()
+        return index
+
+    def __init__(self, layer, tolerance):
+        self.layer = layer
+        self.tolerance = tolerance   # in metri
+        self.grid = None
+        self.temporary_fids = set()  # ids negativi delle feature nuove non ancora salvate
+        self.deferred_fids = None    # Feature aggiunte durante deferred_updates()
+        layer.featureAdded.connect(self.on_feature_added)
+        layer.featureDeleted.connect(self.on_feature_deleted)
+        layer.geometryChanged.connect(self.on_geometry_changed)
+        layer.committedFeaturesAdded.connect(self.on_committed_features_added)
+        layer.afterRollBack.connect(self.invalidate)
+        layer.crsChanged.connect(self.invalidate)
+
+    @property
+    def built(self):
+        return self.grid is not None
+
+    def invalidate(self):
+        """Segna la griglia da ricostruire alla prossima richiesta"""
+        self.grid = None
+        self.temporary_fids = set()
+
+    def ensure_built(self):
+        """Legge una sola volta le geometrie del layer (senza attributi)"""
+        if self.grid is not None:
+            return self.grid
+        self.grid = PointGrid(metric_tolerance_in_layer_units(self.layer, self.tolerance))
+        request = QgsFeatureRequest().setNoAttributes()
+        for feature in self.layer.getFeatures(request):
+            self.add_feature(feature.id(), feature.geometry())
+        return self.grid
+
+    def add_feature(self, fid, geom):
+        if geom is None or geom.isEmpty():
+            self.grid.remove(fid)
+            return
+        point = geom.asPoint()
+        self.grid.add(fid, point.x(), point.y())
+        if fid < 0:
+            self.temporary_fids.add(fid)
+
+    def on_feature_added(self, fid):
+        if not self.built:
+            return
+        if self.deferred_fids is not None:
+            self.deferred_fids.append(fid)
+            return
+        self.add_feature(fid, self.layer.getFeature(fid).geometry())
+
+    def on_feature_deleted(self, fid):
+        if self.built:
+            self.grid.remove(fid)
+            self.temporary_fids.discard(fid)
+
+    def on_geometry_changed(self, fid, geom):
+        if self.built:
+            self.add_feature(fid, geom)
+
+    def on_committed_features_added(self, layer_id, features):
+        if not self.built:
+            return
+        # Le feature salvate sostituiscono quelle con id temporaneo (negativo) del buffer
+        for fid in self.temporary_fids:
+            self.grid.remove(fid)
+        self.temporary_fids = set()
+        for feature in features:
+            self.add_feature(feature.id(), feature.geometry())
+
+    @contextmanager
+    def deferred_updates(self):
+        """Durante il blocco raccoglie le feature aggiunte e le indicizza alla fine con una sola richiesta"""
+        self.deferred_fids = []
+        try:
+            yield self
+        finally:
+            fids, self.deferred_fids = self.deferred_fids, None
+            if fids and self.built:
+                request = QgsFeatureRequest().setFilterFids(fids).setNoAttributes()
+                for feature in self.layer.getFeatures(request):
+                    self.add_feature(feature.id(), feature.geometry())
+
+    def find_near(self, x, y):
+        """Id di un punto del layer entro la tolleranza da (x, y), o None"""
+        return self.ensure_built().find_near(x, y)
+
+
+###############################################################################
+# INDICE SPAZIALE DEI PUNTI (RICERCHE NEL RAGGIO E DEI PIÙ VICINI)
+###############################################################################
+class PointSpatialIndex:
+    """QgsSpatialIndex dei punti di un layer per ricerche nel raggio e dei k punti più vicini.
+
+    Uno per layer (for_layer), costruito alla prima ricerca e scartato a ogni modifica delle
+    geometrie: finché il layer non cambia, ogni clic costa una ricerca nell'R-tree.
+    """
+
+    instances = {}  # id del layer -> indice
+
+    @classmethod
+    def for_layer(cls, layer):
+        """Restituisce (creandolo se serve) l'indice del layer"""
+        index = cls.instances.get(layer.id())
+        if index is None:
+            index = cls(layer)
+            cls.instances[layer.id()] = index
+            layer.willBeDeleted.connect(lambda layer_id=layer.id(): cls.instances.pop(layer_id, None))
+        return index
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.index = None
+        self.points = {}  # fid -> QgsPointXY
+        layer.featureAdded.connect(self.invalidate)
+        layer.featureDeleted.connect(self.invalidate)
+        layer.geometryChanged.connect(self.invalidate)
+        layer.committedFeaturesAdded.connect(self.invalidate)
+        layer.committedFeaturesRemoved.connect(self.invalidate)
+        layer.committedGeometriesChanges.connect(self.invalidate)
+        layer.afterRollBack.connect(self.invalidate)
+        layer.crsChanged.connect(self.invalidate)
+
+    def invalidate(self, *args):
+        """Scarta l'indice: verrà ricostruito alla prossima ricerca"""
+        self.index = None
+        self.points = {}
+
+    def ensure_built(self):
+        if self.index is not None:
+            return
+        self.index = QgsSpatialIndex()
+        points = {}
+        for feature in self.layer.getFeatures(QgsFeatureRequest().setNoAttributes()):
+            geom = feature.geometry()
+            if geom is None or geom.isEmpty():
+                continue
+            points[feature.id()] = geom.asPoint()
+            self.index.addFeature(feature)
+        self.points = points
+        logging.info(f"Indice spaziale costruito per il layer {self.layer.name()}: {len(points)} punti")
+
+    def within_radius(self, point, radius):
+        """Restituisce [(distanza, fid)] dei punti entro radius da point, dal più vicino"""
+        self.ensure_built()
+        rect = QgsRectangle(point.x() - radius, point.y() - radius, point.x() + radius, point.y() + radius)
+        matches = []
+        for fid in self.index.intersects(rect):
+            distance = point.distance(self.points[fid])
+            if distance <= radius:
+                matches.append((distance, fid))
+        matches.sort()
+        return matches
+
+    def nearest(self, point, count=1):
+        """Restituisce [(distanza, fid)] dei count punti più vicini a point, dal più vicino"""
+        self.ensure_built()
+        matches = [(point.distance(self.points[fid]), fid) for fid in self.index.nearestNeighbor(point, count)]
+        matches.sort()
+        return matches[:count]
+
+
+###############################################################################
+# AGGIORNAMENTO DEGLI ATTRIBUTI E DELLE GEOMETRIE IN BLOCCO
+###############################################################################
+def apply_attribute_changes(layer, changes, description):
+    """Applica in blocco le modifiche {fid: {indice campo: valore}}; restituisce True se riuscito.
+
+    Se il layer è già in modifica le variazioni entrano nel buffer come un unico comando annullabile
+    (senza salvare), altrimenti vengono scritte nel provider con una sola changeAttributeValues.
+    """
+    if not changes:
+        return True
+    provider = layer.dataProvider()
+    if not layer.isEditable() and provider.capabilities() & QgsVectorDataProvider.ChangeAttributeValues:
+        if not provider.changeAttributeValues(changes):
+            return False
+        layer.reload()
+        layer.triggerRepaint()
+        return True
+
+    # Provider senza scrittura diretta o sessione di modifica aperta: passa dal buffer di editing
+    started_editing = not layer.isEditable()
+    if started_editing and not layer.startEditing():
+        return False
+    layer.beginEditCommand(description)
+    for fid, attributes in changes.items():
+        layer.changeAttributeValues(fid, attributes)
+    layer.endEditCommand()
+    if started_editing:
+        return layer.commitChanges()
+    return True
+
+
+def apply_geometry_changes(layer, geometries, description):
+    """Applica in blocco le geometrie {fid: QgsGeometry}; restituisce True se riuscito.
+
+    Stesso schema di apply_attribute_changes: buffer di editing se il layer è in modifica,
+    altrimenti una sola changeGeometryValues sul provider.
+    """
+    if not geometries:
+        return True
+    provider = layer.dataProvider()
+    if not layer.isEditable() and provider.capabilities() & QgsVectorDataProvider.ChangeGeometries:
+        if not provider.changeGeometryValues(geometries):
+            return False
+        layer.reload()
+        layer.updateExtents()
+        layer.triggerRepaint()
+        return True
+
+    started_editing = not layer.isEditable()
+    if started_editing and not layer.startEditing():
+        return False
+    layer.beginEditCommand(description)
+    for fid, geometry in geometries.items():
+        layer.changeGeometry(fid, geometry)
+    layer.endEditCommand()
+    if started_editing:
+        return layer.commitChanges()
+    return True
+
+
+###############################################################################
+# COMPENSAZIONE DELLE QUOTE AI MINIMI QUADRATI
+###############################################################################
+# Modelli di correzione delle quote: (chiave, etichetta, numero di parametri)
+VERTICAL_ADJUSTMENT_MODELS = [
+    ('constant', "Costante", 1),
+    ('plane', "Piano inclinato", 3),
+    ('quadratic', "Superficie quadratica", 6),
+]
+
+
+def vertical_model_terms(model, dx, dy):
+    """Termini del modello di correzione nel punto (dx, dy), coordinate ridotte al baricentro"""
+    if model == 'constant':
+        return (1.0,)
+    if model == 'plane':
+        return (1.0, dx, dy)
+    return (1.0, dx, dy, dx * dx, dx * dy, dy * dy)
+
+
+def solve_linear_system(matrix, vector):
+    """Risolve matrix · x = vector (eliminazione di Gauss con pivot parziale); ValueError se singolare"""
+    size = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(size)]
+    scale = max((abs(value) for row in rows for value in row[:size]), default=0.0) or 1.0
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda r: abs(rows[r][column]))
+        if abs(rows[pivot][column]) <= 1e-12 * scale:
+            raise ValueError("Sistema singolare: i punti di controllo non determinano il modello scelto")
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for r in range(column + 1, size):
+            factor = rows[r][column] / rows[column][column]
+            if factor:
+                for c in range(column, size + 1):
+                    rows[r][c] -= factor * rows[column][c]
+    solution = [0.0] * size
+    for r in range(size - 1, -1, -1):
+        total = rows[r][size] - sum(rows[r][c] * solution[c] for c in range(r + 1, size))
+        solution[r] = total / rows[r][r]
+    return solution
+
+
+def least_squares(design, observations):
+    """Coefficienti x che minimizzano |A·x - l| (A = righe di design, l = observations), con le equazioni normali"""
+    size = len(design[0])
+    normal = [[0.0] * size for _ in range(size)]
+    known = [0.0] * size
+    for terms, observed in zip(design, observations):
+        for i in range(size):
+            known[i] += terms[i] * observed
+            for j in range(size):
+                normal[i][j] += terms[i] * terms[j]
+    return solve_linear_system(normal, known)
+
+
+class VerticalAdjustment:
+    """Correzione delle quote f(x, y) stimata ai minimi quadrati dai punti di controllo.
+
+    controls è una lista di (x, y, correzione osservata = quota nota - quota attuale). Le coordinate
+    vengono ridotte al baricentro e scalate per tenere ben condizionate le equazioni normali.
+    """
+
+    def __init__(self, model, controls):
+        parameters = {key: count for key, _, count in VERTICAL_ADJUSTMENT_MODELS}
+        if model not in parameters:
+            raise ValueError(f"Modello di compensazione sconosciuto: {model}")
+        if len(controls) < parameters[model]:
+            raise ValueError(f"Servono almeno {parameters[model]} punti di controllo per questo modello")
+        self.model = model
+        count = len(controls)
+        self.origin_x = sum(c[0] for c in controls) / count
+        self.origin_y = sum(c[1] for c in controls) / count
+        spread = max((max(abs(c[0] - self.origin_x), abs(c[1] - self.origin_y)) for c in controls), default=0.0)
+        self.scale = spread if spread > 0 else 1.0
+
+        size = parameters[model]
+        self.coefficients = least_squares([self.terms(x, y) for x, y, _ in controls], [c[2] for c in controls])
+
+        # Residui: correzione stimata meno correzione osservata (= quota compensata - quota nota)
+        self.residuals = [self.correction(x, y) - observed for x, y, observed in controls]
+        self.redundancy = count - size
+        if self.redundancy > 0:
+            self.rms = math.sqrt(sum(v * v for v in self.residuals) / self.redundancy)
+        else:
+            self.rms = None  # Nessuna ridondanza: il modello passa esattamente per i punti
+
+    def terms(self, x, y):
+        return vertical_model_terms(self.model, (x - self.origin_x) / self.scale, (y - self.origin_y) / self.scale)
+
+    def correction(self, x, y):
+        """Correzione di quota nel punto (x, y)"""
+        return sum(c * t for c, t in zip(self.coefficients, self.terms(x, y)))
+
+    def corrections(self, xs, ys):
+        """Correzioni per interi blocchi di coordinate, come array('d')"""
+        coefficients = self.coefficients
+        origin_x, origin_y, scale = self.origin_x, self.origin_y, self.scale
+        if self.model == 'constant':
+            return array('d', [coefficients[0]]) * len(xs)
+        result = array('d', bytes(8 * len(xs)))
+        if self.model == 'plane':
+            a, b, c = coefficients
+            for i in range(len(xs)):
+                result[i] = a + b * (xs[i] - origin_x) / scale + c * (ys[i] - origin_y) / scale
+            return result
+        a, b, c, d, e, f = coefficients
+        for i in range(len(xs)):
+            dx = (xs[i] - origin_x) / scale
+            dy = (ys[i] - origin_y) / scale
+            result[i] = a + b * dx + c * dy + d * dx * dx + e * dx * dy + f * dy * dy
+        return result
+
+
+###############################################################################
+# LETTURA DEI FILE DXF IN STREAMING (SENZA DRIVER OGR)
+###############################################################################
+# Entità lette dal lettore interno; le altre vengono contate e ignorate
+DXF_SUPPORTED_ENTITIES = ('LINE', 'LWPOLYLINE', 'POLYLINE', 'ARC', 'CIRCLE', 'HATCH', 'INSERT', 'POINT', 'TEXT')
+# Entità che finiscono nel modello da posizionare (solo linee e poligoni)
+DXF_LINEWORK_ENTITIES = ('LINE', 'LWPOLYLINE', 'POLYLINE', 'ARC', 'CIRCLE', 'HATCH', 'INSERT')
+# Entità geometriche gestite solo dal driver OGR: se presenti si ripiega su OGR
+DXF_OGR_ONLY_ENTITIES = ('SPLINE', 'ELLIPSE', '3DFACE', 'SOLID', 'TRACE', 'MLINE')
+# Passo angolare (gradi) con cui archi, cerchi e bulge vengono approssimati da segmenti
+DXF_ARC_STEP_DEGREES = 5.0
+# Profondità massima dei blocchi annidati (INSERT dentro BLOCK)
+DXF_MAX_BLOCK_DEPTH = 8
+
+
+def dxf_tags(stream):
+    """Genera le coppie (codice di gruppo, valore in byte) di un DXF ASCII letto in binario"""
+    while True:
+        code_line = stream.readline()
+        if not code_line:
+            return
+        value_line = stream.readline()
+        try:
+            code = int(code_line)
+        except ValueError:
+            raise ValueError(f"Codice di gruppo DXF non valido: {code_line[:40]!r}")
+        yield code, value_line.rstrip(b'\r\n')
+
+
+def dxf_raw_entities(stream):
+    """Genera (sezione, tipo, tag) per ogni entità del file, raggruppando i tag fino al codice 0 successivo.
+
+    Anche l'apertura di ogni sezione viene generata come entità 'SECTION': per la HEADER i suoi
+    tag sono le variabili dell'intestazione.
+    """
+    section = None
+    entity_type = None
+    tags = []
+    for code, value in dxf_tags(stream):
+        if code != 0:
+            tags.append((code, value))
+            continue
+        if entity_type == 'SECTION':
+            section = next((v.strip().decode('ascii', 'replace') for c, v in tags if c == 2), None)
+            yield section, entity_type, tags
+        elif entity_type == 'ENDSEC':
+            section = None
+        elif entity_type is not None:
+            yield section, entity_type, tags
+        entity_type = value.strip().decode('ascii', 'replace').upper()
+        tags = []
+        if entity_type == 'EOF':
+            return
+    if entity_type not in (None, 'ENDSEC', 'EOF'):
+        yield section, entity_type, tags
+
+
+def dxf_value(tags, code, default=None):
+    """Primo valore numerico con il codice dato, oppure default"""
+    for c, v in tags:
+        if c == code:
+            return float(v)
+    return default
+
+
+def arc_points(cx, cy, radius, start, sweep):
+    """Punti di un arco (angoli in radianti, sweep con segno), estremi compresi"""
+    segments = max(1, int(math.ceil(abs(math.degrees(sweep)) / DXF_ARC_STEP_DEGREES)))
+    return [
+        (cx + radius * math.cos(start + sweep * k / segments), cy + radius * math.sin(start + sweep * k / segments))
+        for k in range(segments + 1)
+    ]
+
+
+def bulge_points(x1, y1, x2, y2, bulge):
+    """Punti intermedi dell'arco definito da un bulge tra due vertici (estremi esclusi)"""
+    chord = math.hypot(x2 - x1, y2 - y1)
+    if not bulge or chord == 0:
+        return []
+    sweep = 4.0 * math.atan(bulge)
+    offset = (chord / 2.0) / math.tan(sweep / 2.0)
+    cx = (x1 + x2) / 2.0 - offset * (y2 - y1) / chord
+    cy = (y1 + y2) / 2.0 + offset * (x2 - x1) / chord
+    radius = math.hypot(x1 - cx, y1 - cy)
+    return arc_points(cx, cy, radius, math.atan2(y1 - cy, x1 - cx), sweep)[1:-1]
+
+
+def vertices_with_bulges(vertices, closed):
+    """Espande i vertici [(x, y, bulge)] in punti, approssimando i tratti ad arco"""
+    points = []
+    count = len(vertices)
+    for i, (x, y, bulge) in enumerate(vertices):
+        points.append((x, y))
+        if i + 1 < count or closed:
+            nx, ny, _ = vertices[(i + 1) % count]
+            points.extend(bulge_points(x, y, nx, ny, bulge))
+    if closed and points and points[0] != points[-1]:
+        points.append(points[0])
+    return points
+
+
+def lwpolyline_vertices(tags):
+    """Vertici (x, y, bulge) di una LWPOLYLINE"""
+    vertices = []
+    x = None
+    for code, value in tags:
+        if code == 10:
+            x = float(value)
+        elif code == 20 and x is not None:
+            vertices.append([x, float(value), 0.0])
+            x = None
+        elif code == 42 and vertices:
+            vertices[-1][2] = float(value)
+    return vertices
+
+
+def hatch_rings(tags):
+    """Anelli di contorno di una HATCH (contorni a polilinea, linee e archi); ValueError se non gestiti"""
+    position = next((i for i, (code, _) in enumerate(tags) if code == 91), None)
+    if position is None:
+        return []
+    path_count = int(tags[position][1])
+    position += 1
+
+    def take(code):
+        nonlocal position
+        while position < len(tags) and tags[position][0] != code:
+            position += 1
+        if position >= len(tags):
+            raise ValueError(f"HATCH incompleta: manca il codice {code}")
+        value = tags[position][1]
+        position += 1
+        return value
+
+    def peek(code):
+        return position < len(tags) and tags[position][0] == code
+
+    rings = []
+    for _ in range(path_count):
+        flags = int(take(92))
+        if flags & 2:
+            # Contorno a polilinea
+            take(72)
+            closed = bool(int(take(73)))
+            vertices = []
+            for _ in range(int(take(93))):
+                x = float(take(10))
+                y = float(take(20))
+                bulge = float(take(42)) if peek(42) else 0.0
+                vertices.append((x, y, bulge))
+            points = vertices_with_bulges(vertices, True)
+        else:
+            # Contorno a lati
+            points = []
+            for _ in range(int(take(93))):
+                edge_type = int(take(72))
+                if edge_type == 1:
+                    edge = [(float(take(10)), float(take(20))), (float(take(11)), float(take(21)))]
+                elif edge_type == 2:
+                    cx, cy = float(take(10)), float(take(20))
+                    radius = float(take(40))
+                    start, end = math.radians(float(take(50))), math.radians(float(take(51)))
+                    counter_clockwise = bool(int(take(73)))
+                    sweep = (end - start) % (2 * math.pi) or 2 * math.pi
+                    if not counter_clockwise:
+                        # Negli archi orari gli angoli sono misurati in senso orario
+                        start, sweep = -start, -sweep
+                    edge = arc_points(cx, cy, radius, start, sweep)
+                else:
+                    raise ValueError("HATCH con contorni a ellisse o spline")
+                if points and points[-1] == edge[0]:
+                    edge = edge[1:]
+                points.extend(edge)
+            if points and points[0] != points[-1]:
+                points.append(points[0])
+        if len(points) >= 4:
+            rings.append(points)
+    return rings
+
+
+def dxf_header_variables(tags):
+    """Variabili della HEADER: {b'$NOME': {codice: valore}}"""
+    variables = {}
+    current = None
+    for code, value in tags:
+        if code == 9:
+            current = variables.setdefault(value.strip(), {})
+        elif current is not None:
+            current[code] = value.strip()
+    return variables
+
+
+def dxf_text_encoding(variables):
+    """Encoding dei testi del DXF in base a $ACADVER e $DWGCODEPAGE"""
+    # Da AutoCAD 2007 (AC1021) i DXF sono sempre in UTF-8
+    if variables.get(b'$ACADVER', {}).get(1, b'') >= b'AC1021':
+        return 'utf-8'
+    codepage = variables.get(b'$DWGCODEPAGE', {}).get(3, b'').upper()
+    if codepage.startswith(b'ANSI_') and codepage[5:].isdigit():
+        return 'cp' + codepage[5:].decode('ascii')
+    return 'cp1252'
+
+
+# Unità di disegno di $INSUNITS
+DXF_INSUNITS = {
+    0: "senza unità", 1: "pollici", 2: "piedi", 3: "miglia", 4: "millimetri", 5: "centimetri",
+    6: "metri", 7: "chilometri", 8: "microinch", 9: "mil", 10: "iarde", 11: "angstrom",
+    12: "nanometri", 13: "micron", 14: "decimetri", 15: "decametri", 16: "ettometri",
+    17: "gigametri", 18: "unità astronomiche", 19: "anni luce", 20: "parsec",
+}
+# Byte medi per entità, per stimare il numero di entità dalla dimensione del file
+DXF_BYTES_PER_ENTITY = 250
+# Oltre questo numero (stimato) di entità il DXF è considerato grande
+DXF_LARGE_ENTITY_COUNT = 20000
+
+
+class DxfHeader:
+    """Informazioni lette dalla sola sezione HEADER: estensione, unità e stima del numero di entità.
+
+    La lettura si ferma alla fine della HEADER, quindi costa millisecondi anche sui DXF più grandi.
+    extent è None se il file non la dichiara (o dichiara un disegno vuoto).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file_size = os.path.getsize(path)
+        self.version = ''
+        self.extent = None
+        self.units = 0
+        handle_seed = None
+
+        with open(path, 'rb') as stream:
+            binary = stream.read(18) == b'AutoCAD Binary DXF'
+            stream.seek(0)
+            header_tags = []
+            if not binary:
+                for section, entity_type, tags in dxf_raw_entities(stream):
+                    # La HEADER, se c'è, è sempre la prima sezione
+                    if entity_type == 'SECTION' and section == 'HEADER':
+                        header_tags = tags
+                    break
+
+        variables = dxf_header_variables(header_tags)
+        self.version = variables.get(b'$ACADVER', {}).get(1, b'').decode('ascii', 'replace')
+        try:
+            self.units = int(variables.get(b'$INSUNITS', {}).get(70, b'0'))
+            extmin = variables.get(b'$EXTMIN', {})
+            extmax = variables.get(b'$EXTMAX', {})
+            if extmin and extmax:
+                xmin, ymin = float(extmin[10]), float(extmin[20])
+                xmax, ymax = float(extmax[10]), float(extmax[20])
+                # Un disegno vuoto dichiara EXTMIN > EXTMAX (±1e20)
+                if xmin <= xmax and ymin <= ymax and max(abs(xmin), abs(xmax), abs(ymin), abs(ymax)) < 1e19:
+                    self.extent = QgsRectangle(xmin, ymin, xmax, ymax)
+            if b'$HANDSEED' in variables:
+                handle_seed = int(variables[b'$HANDSEED'].get(5, b'0'), 16)
+        except (KeyError, ValueError):
+            logging.warning(f"Variabili della HEADER DXF non leggibili in {path}")
+
+        # Stima dalla dimensione del file, limitata da $HANDSEED (il prossimo handle libero)
+        self.entity_estimate = self.file_size // DXF_BYTES_PER_ENTITY
+        if handle_seed:
+            self.entity_estimate = min(self.entity_estimate, handle_seed)
+
+    def units_name(self):
+        return DXF_INSUNITS.get(self.units, f"codice {self.units}")
+
+    def is_large(self):
+        """True se il DXF ha abbastanza entità da richiedere una lettura lunga"""
+        return self.entity_estimate > DXF_LARGE_ENTITY_COUNT
+
+
+class DxfOgrOnlyError(ValueError):
+    """Il DXF contiene un'entità che solo il driver OGR sa convertire"""
+
+
+class DxfReader:
+    """Lettore in streaming della sezione ENTITIES di un DXF ASCII, senza passare dal driver OGR.
+
+    Le entità vengono filtrate per tipo e per layer DXF mentre si legge il file, quindi
+    le coordinate vengono costruite solo per quelle richieste. Gli INSERT sono esplosi usando
+    i blocchi della sezione BLOCKS (le entità sul layer "0" prendono il layer dell'INSERT).
+    entities() genera tuple (tipo, layer, handle, testo, genere, coordinate) dove genere è
+    'point' (coordinate (x, y)), 'line' ([(x, y), ...]) o 'polygon' (lista di anelli).
+    Se compare un'entità di fallback_entities (nella sezione ENTITIES o in un blocco esploso)
+    la lettura si ferma subito con DxfOgrOnlyError, senza leggere il resto del file.
+    """
+
+    def __init__(self, path, entity_types=DXF_SUPPORTED_ENTITIES, layers=None, fallback_entities=()):
+        self.path = path
+        self.entity_types = set(entity_types)
+        self.fallback_entities = set(fallback_entities)
+        self.layers = {name.upper() for name in layers} if layers else None
+        self.encoding = 'cp1252'
+        self.stream = None
+        self.blocks = {}  # nome -> (base x, base y, entità grezze)
+        self.block_geometries = {}  # nome -> entità costruite, in coordinate del blocco
+        self.read_counts = Counter()  # entità per tipo lette nella sezione ENTITIES
+        self.filtered_out = Counter()  # entità su layer DXF esclusi dal filtro
+        self.ignored = Counter()  # entità dei layer richiesti (o dei blocchi esplosi) scartate per tipo
+        self.unsupported = Counter()  # entità richieste ma non convertibili
+
+    def decode(self, value):
+        return value.decode(self.encoding, 'replace').strip()
+
+    def read_header(self, tags):
+        """Legge dalla HEADER le variabili che determinano l'encoding del testo"""
+        self.encoding = dxf_text_encoding(dxf_header_variables(tags))
+
+    def entities(self):
+        """Genera le entità richieste della sezione ENTITIES; ValueError se il file non è un DXF ASCII"""
+        with open(self.path, 'rb') as stream:
+            if stream.read(18) == b'AutoCAD Binary DXF':
+                raise ValueError("DXF binario non supportato dal lettore interno")
+            stream.seek(0)
+            self.stream = stream
+            try:
+                yield from self.build_entities(self.filtered_entities(stream), 0)
+            finally:
+                self.stream = None
+
+    def position(self):
+        """Byte letti finora (per l'avanzamento)"""
+        return self.stream.tell() if self.stream is not None else 0
+
+    def filtered_entities(self, stream):
+        """Entità grezze (tipo, tag) della sezione ENTITIES che passano i filtri; raccoglie intanto i BLOCKS"""
+        block = None
+        pending_polyline = False
+        for section, entity_type, tags in dxf_raw_entities(stream):
+            if entity_type == 'SECTION':
+                if section == 'HEADER':
+                    self.read_header(tags)
+            elif section == 'BLOCKS':
+                if entity_type == 'BLOCK':
+                    name = self.decode(next((v for c, v in tags if c == 2), b''))
+                    block = (dxf_value(tags, 10, 0.0), dxf_value(tags, 20, 0.0), [])
+                    self.blocks[name.upper()] = block
+                elif entity_type == 'ENDBLK':
+                    block = None
+                elif block is not None:
+                    block[2].append((entity_type, tags))
+            elif section == 'ENTITIES':
+                if entity_type in ('VERTEX', 'SEQEND'):
+                    # Vertici di una POLYLINE richiesta (gli altri seguono entità scartate)
+                    if pending_polyline:
+                        yield entity_type, tags
+                    if entity_type == 'SEQEND':
+                        pending_polyline = False
+                    continue
+                if entity_type == 'ATTRIB':
+                    continue
+                self.read_counts[entity_type] += 1
+                pending_polyline = False
+                if self.layers is not None:
+                    layer = next((v for c, v in tags if c == 8), b'0')
+                    if self.decode(layer).upper() not in self.layers:
+                        self.filtered_out[entity_type] += 1
+                        continue
+                if entity_type not in self.entity_types:
+                    self.ignore(entity_type)
+                    continue
+                pending_polyline = entity_type == 'POLYLINE'
+                yield entity_type, tags
+
+    def ignore(self, entity_type):
+        """Conta un'entità scartata; DxfOgrOnlyError se solo il driver OGR sa convertirla"""
+        self.ignored[entity_type] += 1
+        if entity_type in self.fallback_entities:
+            raise DxfOgrOnlyError(f"entità {entity_type} gestita solo dal driver OGR")
+
+    def build_entities(self, raw_entities, depth, inherited_layer=None):
+        """Converte le entità grezze in tuple con coordinate; le POLYLINE raccolgono i VERTEX che le seguono"""
+        raw_entities = iter(raw_entities)
+        pending = next(raw_entities, None)
+        while pending is not None:
+            entity_type, tags = pending
+            pending = next(raw_entities, None)
+            if entity_type not in self.entity_types:
+                # Le entità di primo livello sono già contate da filtered_entities, quelle dei blocchi no
+                if depth and entity_type not in ('VERTEX', 'SEQEND'):
+                    self.ignore(entity_type)
+                continue
+            layer = self.decode(next((v for c, v in tags if c == 8), b'0'))
+            if inherited_layer and layer == '0':
+                layer = inherited_layer
+            handle = self.decode(next((v for c, v in tags if c == 5), b''))
+
+            vertices = []
+            if entity_type == 'POLYLINE':
+                while pending is not None and pending[0] == 'VERTEX':
+                    vertices.append(pending[1])
+                    pending = next(raw_entities, None)
+
+            try:
+                if entity_type == 'INSERT':
+                    yield from self.expand_insert(tags, layer, depth)
+                    continue
+                built = self.build_entity(entity_type, tags, vertices)
+            except DxfOgrOnlyError:
+                raise
+            except (ValueError, ZeroDivisionError) as e:
+                logging.warning(f"Entità DXF {entity_type} {handle} non convertita: {e}")
+                self.unsupported[entity_type] += 1
+                continue
+            if built is None:
+                self.unsupported[entity_type] += 1
+                continue
+            kind, coordinates, text = built
+            if entity_type not in ('LINE', 'POINT') and dxf_value(tags, 230, 1.0) < 0:
+                # Estrusione (0, 0, -1): il sistema dell'entità è specchiato in X
+                coordinates = map_coordinates(kind, coordinates, lambda x, y: (-x, y))
+            yield entity_type, layer, handle, text, kind, coordinates
+
+    def build_entity(self, entity_type, tags, vertices):
+        """Coordinate di una singola entità: (genere, coordinate, testo) oppure None"""
+        if entity_type in ('POINT', 'TEXT'):
+            text = self.decode(next((v for c, v in tags if c == 1), b'')) if entity_type == 'TEXT' else ''
+            return 'point', (dxf_value(tags, 10), dxf_value(tags, 20)), text
+        if entity_type == 'LINE':
+            return 'line', [(dxf_value(tags, 10), dxf_value(tags, 20)), (dxf_value(tags, 11), dxf_value(tags, 21))], ''
+        if entity_type in ('CIRCLE', 'ARC'):
+            cx, cy, radius = dxf_value(tags, 10), dxf_value(tags, 20), dxf_value(tags, 40)
+            if entity_type == 'CIRCLE':
+                return 'line', arc_points(cx, cy, radius, 0.0, 2 * math.pi), ''
+            start = math.radians(dxf_value(tags, 50, 0.0))
+            sweep = (math.radians(dxf_value(tags, 51, 360.0)) - start) % (2 * math.pi) or 2 * math.pi
+            return 'line', arc_points(cx, cy, radius, start, sweep), ''
+        if entity_type == 'LWPOLYLINE':
+            closed = int(dxf_value(tags, 70, 0)) & 1
+            points = vertices_with_bulges(lwpolyline_vertices(tags), closed)
+            return ('line', points, '') if len(points) >= 2 else None
+        if entity_type == 'POLYLINE':
+            flags = int(dxf_value(tags, 70, 0))
+            if flags & (16 | 64):
+                return None  # Mesh poligonali e polyface non gestite
+            vertex_list = [
+                (dxf_value(v, 10, 0.0), dxf_value(v, 20, 0.0), dxf_value(v, 42, 0.0)) for v in vertices
+                if not int(dxf_value(v, 70, 0)) & 16  # Punti di controllo delle spline
+            ]
+            points = vertices_with_bulges(vertex_list, flags & 1)
+            return ('line', points, '') if len(points) >= 2 else None
+        if entity_type == 'HATCH':
+            rings = hatch_rings(tags)
+            return ('polygon', rings, '') if rings else None
+        return None
+
+    def expand_insert(self, tags, layer, depth):
+        """Esplode un INSERT applicando scala, rotazione e posizione al contenuto del blocco"""
+        name = self.decode(next((v for c, v in tags if c == 2), b'')).upper()
+        if name not in self.blocks:
+            raise ValueError(f"blocco {name} non definito")
+        if depth >= DXF_MAX_BLOCK_DEPTH:
+            raise ValueError(f"blocchi annidati oltre {DXF_MAX_BLOCK_DEPTH} livelli")
+        if name not in self.block_geometries:
+            base_x, base_y, raw_entities = self.blocks[name]
+            self.block_geometries[name] = [
+                (entity_type, entity_layer, handle, text, kind,
+                 map_coordinates(kind, coordinates, lambda x, y: (x - base_x, y - base_y)))
+                for entity_type, entity_layer, handle, text, kind, coordinates
+                in self.build_entities(raw_entities, depth + 1, inherited_layer='0')
+            ]
+
+        scale_x = dxf_value(tags, 41, 1.0)
+        scale_y = dxf_value(tags, 42, 1.0)
+        rotation = math.radians(dxf_value(tags, 50, 0.0))
+        cos_r, sin_r = math.cos(rotation), math.sin(rotation)
+        insert_x, insert_y = dxf_value(tags, 10, 0.0), dxf_value(tags, 20, 0.0)
+        columns, rows = int(dxf_value(tags, 70, 1)) or 1, int(dxf_value(tags, 71, 1)) or 1
+        column_spacing, row_spacing = dxf_value(tags, 44, 0.0), dxf_value(tags, 45, 0.0)
+
+        for column in range(columns):
+            for row in range(rows):
+                # Le serie di INSERT sono spaziate nel sistema ruotato del blocco
+                ox = column * column_spacing
+                oy = row * row_spacing
+                tx = insert_x + cos_r * ox - sin_r * oy
+                ty = insert_y + sin_r * ox + cos_r * oy
+
+                def place(x, y):
+                    x *= scale_x
+                    y *= scale_y
+                    return tx + cos_r * x - sin_r * y, ty + sin_r * x + cos_r * y
+
+                for entity_type, entity_layer, handle, text, kind, coordinates in self.block_geometries[name]:
+                    if entity_layer == '0':
+                        entity_layer = layer
+                    yield entity_type, entity_layer, handle, text, kind, map_coordinates(kind, coordinates, place)
+
+
+def map_coordinates(kind, coordinates, function):
+    """Applica function(x, y) -> (x, y) a tutte le coordinate di un'entità"""
+    if kind == 'point':
+        return function(*coordinates)
+    if kind == 'line':
+        return [function(x, y) for x, y in coordinates]
+    return [[function(x, y) for x, y in ring] for ring in coordinates]
+
+
+###############################################################################
+# MODELLO DEI FILE DXF (LETTO UNA SOLA VOLTA)
+###############################################################################
+# Modelli DXF tenuti in memoria: (percorso, dimensione, data modifica, layer) -> DxfModel
+DXF_MODEL_CACHE_SIZE = 2
+# Entità lette tra due aggiornamenti dell'avanzamento
+DXF_PROGRESS_INTERVAL = 256
+# Vertici massimi dell'anteprima del DXF che segue il cursore durante il posizionamento
+DXF_PREVIEW_MAX_VERTICES = 20000
+# Fascia di zoom oltre la quale l'anteprima non viene più semplificata (pixel di 2^40 unità)
+DXF_PREVIEW_MAX_BAND = 40
+# Suffissi dei layer DXF quando il disegno contiene sia linee che poligoni (un layer per tipo)
+DXF_LAYER_SUFFIXES = {QgsWkbTypes.LineGeometry: "linee", QgsWkbTypes.PolygonGeometry: "poligoni"}
+_dxf_model_cache = {}  # Letta e scritta solo nel thread principale
+
+
+class DxfModel:
+    """Contenuto di un file DXF letto in un solo passaggio e condiviso da validazione e posizionamento.
+
+    Contiene geometrie e attributi delle entità, tipo di geometria (della prima entità valida),
+    estensione e conteggi per la validazione. Il centroide è accumulato durante la lettura come media
+    dei centroidi delle entità pesata per area (poligoni) o lunghezza (linee), senza unaryUnion;
+    il centroide esatto dell'unione resta disponibile su richiesta.
+    """
+
+    def __init__(self, path, crs, fields):
+        self.path = path
+        self.crs = crs
+        self.fields = fields
+        self.geometries = []
+        self.attributes = []
+        self.geometry_types = {}  # dimensione -> True se contiene geometrie multiparte (in ordine di lettura)
+        self.extent = QgsRectangle()
+        self.extent.setMinimal()
+        self.total_features = 0
+        self.invalid_geometries = 0
+        self.ignored_entities = Counter()  # entità scartate dal lettore per tipo (punti, testi, ...)
+        self.interrupted = False
+        # Somme pesate dei centroidi per dimensione: {dimensione: [peso, peso * x, peso * y]}
+        self.centroid_sums = {}
+        self.union_centroid_point = None
+        self.preview_cache = {}  # fascia di zoom -> copia semplificata per l'anteprima
+        self.stamp_templates = {}  # (WKT del CRS di destinazione, centroide esatto) -> modello per i timbri
+
+    @staticmethod
+    def cache_key(path, layers=None):
+        """Chiave della cache: il modello resta valido finché file e filtro sui layer non cambiano"""
+        stat = os.stat(path)
+        return (
+            os.path.normcase(os.path.abspath(path)), stat.st_size, stat.st_mtime_ns,
+            tuple(sorted(name.upper() for name in layers)) if layers else None
+        )
+
+    @classmethod
+    def cached(cls, cache_key):
+        """Modello già letto per la chiave, oppure None (solo nel thread principale)"""
+        return _dxf_model_cache.get(cache_key)
+
+    @classmethod
+    def remember(cls, cache_key, model):
+        """Mette in cache un modello letto (solo nel thread principale: i task di lettura non la toccano)"""
+        _dxf_model_cache.pop(cache_key, None)
+        while len(_dxf_model_cache) >= DXF_MODEL_CACHE_SIZE:
+            del _dxf_model_cache[next(iter(_dxf_model_cache))]
+        _dxf_model_cache[cache_key] = model
+
+    @classmethod
+    def load(cls, path, layers=None, progress=None):
+        """Legge il DXF; ValueError se illeggibile.
+
+        Usa il lettore interno, filtrando per layer DXF (None = tutti) e tenendo solo linee e poligoni;
+        ripiega sul driver OGR per i DXF binari o con entità che il lettore non gestisce.
+        progress(frazione) viene chiamata durante la lettura: se restituisce False la lettura
+        si interrompe e load restituisce None.
+        """
+        progress = progress or (lambda fraction: True)
+        try:
+            model = cls.read_entities(path, layers, progress)
+        except (ValueError, UnicodeDecodeError) as e:
+            logging.warning(f"Lettore DXF interno non utilizzabile per {path}: {e}")
+            model = None
+        if model is None:
+            model = cls.read_ogr(path, layers, progress)
+        if model.interrupted:
+            logging.info(f"Lettura del DXF {path} interrotta")
+            return None
+        logging.info(
+            f"Modello DXF letto da {path}: {len(model.geometries)} geometrie, "
+            f"{model.invalid_geometries} non supportate, {sum(model.ignored_entities.values())} ignorate"
+        )
+        return model
+
+    @classmethod
+    def read_entities(cls, path, layers, progress):
+        """Legge il DXF con DxfReader; None se contiene entità gestite solo dal driver OGR"""
+        reader = DxfReader(path, DXF_LINEWORK_ENTITIES, layers, fallback_entities=DXF_OGR_ONLY_ENTITIES)
+        file_size = max(os.path.getsize(path), 1)
+        fields = QgsFields()
+        for name in ('Layer', 'Entity', 'EntityHandle'):
+            fields.append(QgsField(name, QVariant.String))
+        model = cls(path, QgsCoordinateReferenceSystem(), fields)
+        try:
+            for count, (entity_type, layer, handle, text, kind, coordinates) in enumerate(reader.entities(), 1):
+                if count % DXF_PROGRESS_INTERVAL == 0 and not progress(reader.position() / file_size):
+                    model.interrupted = True
+                    return model
+                if kind == 'polygon':
+                    geom = QgsGeometry.fromPolygonXY([[QgsPointXY(x, y) for x, y in ring] for ring in coordinates])
+                else:
+                    geom = QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in coordinates])
+                model.add(geom, [layer, entity_type, handle])
+        except DxfOgrOnlyError as e:
+            # Ci si ferma alla prima entità non gestita: il resto del file lo legge direttamente OGR
+            logging.info(f"Il DXF contiene entità gestite solo dal driver OGR: {e}")
+            return None
+
+        # Le entità richieste ma non convertibili contano come geometrie non valide
+        for count in reader.unsupported.values():
+            model.total_features += count
+            model.invalid_geometries += count
+        model.ignored_entities = reader.ignored
+        return model
+
+    @classmethod
+    def read_ogr(cls, path, layers, progress):
+        """Legge il DXF con il driver OGR, filtrando per layer DXF sul campo 'Layer'.
+
+        Come nel lettore interno punti e testi vengono scartati e contati in ignored_entities.
+        """
+        layer = QgsVectorLayer(path, "DXF_Temp", "ogr")
+        if not layer.isValid():
+            raise ValueError("Errore durante l'importazione del DXF.\nVerifica che il file sia un DXF valido.")
+
+        wanted = {name.upper() for name in layers} if layers else None
+        layer_idx = layer.fields().indexOf('Layer')
+        text_idx = layer.fields().indexOf('Text')
+        model = cls(path, layer.crs(), layer.fields())
+        feature_count = max(layer.featureCount(), 1)
+        for count, feature in enumerate(layer.getFeatures(), 1):
+            if count % DXF_PROGRESS_INTERVAL == 0 and not progress(count / feature_count):
+                model.interrupted = True
+                return model
+            if wanted is not None and layer_idx >= 0 and str(feature.attribute(layer_idx)).upper() not in wanted:
+                continue
+            geom = feature.geometry()
+            if geom and QgsWkbTypes.geometryType(geom.wkbType()) == QgsWkbTypes.PointGeometry:
+                # OGR non distingue il tipo di entità: i testi sono i punti con il campo Text valorizzato
+                text = feature.attribute(text_idx) if text_idx >= 0 else None
+                model.ignored_entities['TEXT' if text and text != NULL else 'POINT'] += 1
+                continue
+            model.add(geom, feature.attributes())
+        return model
+
+    def add(self, geom, attributes):
+        """Aggiunge un'entità, contandola come non valida se non è una linea o un poligono"""
+        self.total_features += 1
+        if not geom or geom.isEmpty():
+            self.invalid_geometries += 1
+            return
+        topo = QgsWkbTypes.geometryType(geom.wkbType())
+        if topo not in [QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry]:
+            self.invalid_geometries += 1
+            return
+        self.geometry_types[topo] = self.geometry_types.get(topo, False) or QgsWkbTypes.isMultiType(geom.wkbType())
+        self.geometries.append(geom)
+        self.attributes.append(attributes)
+        self.extent.combineExtentWith(geom.boundingBox())
+        self.union_centroid_point = None
+        self.preview_cache = {}
+        self.stamp_templates = {}
+
+        centroid = geom.centroid()
+        if centroid and not centroid.isEmpty():
+            weight = geom.area() if topo == QgsWkbTypes.PolygonGeometry else geom.length()
+            point = centroid.asPoint()
+            sums = self.centroid_sums.setdefault(topo, [0.0, 0.0, 0.0])
+            sums[0] += weight
+            sums[1] += weight * point.x()
+            sums[2] += weight * point.y()
+
+    def is_valid(self):
+        """True se il DXF contiene solo linee e poligoni (e almeno una geometria)"""
+        return self.invalid_geometries == 0 and bool(self.geometries)
+
+    def geometry_strings(self):
+        """Tipi di geometria per gli URI dei layer in memoria, uno per dimensione: {dimensione: tipo}.
+
+        Il tipo è multiparte solo se la dimensione contiene geometrie multiparte (es. blocchi letti da OGR).
+        """
+        return {
+            topo: ("Multi" if multi else "") + ("Polygon" if topo == QgsWkbTypes.PolygonGeometry else "LineString")
+            for topo, multi in self.geometry_types.items()
+        }
+
+    def layer_name(self, name, topo):
+        """Nome del layer in memoria per la dimensione: con linee e poligoni insieme si aggiunge un suffisso"""
+        return f"{name}_{DXF_LAYER_SUFFIXES[topo]}" if len(self.geometry_types) > 1 else name
+
+    def centroid(self, exact=False):
+        """Centroide del disegno nel CRS del DXF, oppure None.
+
+        Come per il centroide GEOS conta solo la dimensione più alta presente (poligoni sulle linee);
+        se i pesi sono nulli usa il centro dell'estensione. Con exact=True calcola (una volta)
+        il centroide dell'unione di tutte le geometrie.
+        """
+        if not self.geometries:
+            return None
+        if exact:
+            if self.union_centroid_point is None:
+                centroid = QgsGeometry.unaryUnion(self.geometries).centroid()
+                if centroid and not centroid.isEmpty():
+                    self.union_centroid_point = centroid.asPoint()
+            return self.union_centroid_point
+
+        for topo in (QgsWkbTypes.PolygonGeometry, QgsWkbTypes.LineGeometry):
+            weight, sum_x, sum_y = self.centroid_sums.get(topo, (0.0, 0.0, 0.0))
+            if weight > 0:
+                return QgsPointXY(sum_x / weight, sum_y / weight)
+        return self.extent.center()
+
+    @staticmethod
+    def preview_band(map_units_per_pixel):
+        """Fascia di zoom della scala: esponente della potenza di 2 inferiore alla dimensione del pixel"""
+        return math.floor(math.log2(map_units_per_pixel)) if map_units_per_pixel > 0 else 0
+
+    @staticmethod
+    def preview_fits(preview, band):
+        """True se l'anteprima della fascia è abbastanza leggera (o la fascia è l'ultima)"""
+        return preview.constGet().nCoordinates() <= DXF_PREVIEW_MAX_VERTICES or band >= DXF_PREVIEW_MAX_BAND
+
+    def preview_geometry(self, map_units_per_pixel, previews=None):
+        """Copia semplificata del disegno (solo contorni) per l'anteprima alla scala data, in cache per fascia di zoom.
+
+        Le fasce raddoppiano di scala in scala: la tolleranza di semplificazione è la dimensione del
+        pixel arrotondata alla potenza di 2 inferiore e le entità più piccole di un pixel vengono saltate.
+        Se restano troppi vertici si passa alla fascia successiva. Le copie costruite vanno in previews
+        (di default la cache del modello): un task su un modello già condiviso passa un proprio
+        dizionario, che il thread principale unisce poi alla cache.
+        """
+        previews = self.preview_cache if previews is None else previews
+        band = self.preview_band(map_units_per_pixel)
+        while True:
+            preview = self.preview_cache.get(band)
+            if preview is None:
+                preview = previews.get(band)
+            if preview is None:
+                preview = self.build_preview(2.0 ** band)
+                previews[band] = preview
+            if self.preview_fits(preview, band):
+                return preview
+            band += 1
+
+    def cached_preview(self, map_units_per_pixel):
+        """Anteprima già pronta per la scala (vedi preview_geometry), oppure None se va ancora costruita"""
+        band = self.preview_band(map_units_per_pixel)
+        while True:
+            preview = self.preview_cache.get(band)
+            if preview is None or self.preview_fits(preview, band):
+                return preview
+            band += 1
+
+    def build_preview(self, tolerance):
+        """Multilinea con i contorni semplificati delle entità più grandi di tolerance"""
+        outlines = QgsMultiLineString()
+        for geom in self.geometries:
+            box = geom.boundingBox()
+            if box.width() < tolerance and box.height() < tolerance:
+                continue
+            if QgsWkbTypes.geometryType(geom.wkbType()) == QgsWkbTypes.PolygonGeometry:
+                geom = QgsGeometry(geom.constGet().boundary())
+            simplified = geom.simplify(tolerance)
+            if simplified.isEmpty():
+                continue
+            for part in simplified.constParts():
+                outlines.addGeometry(part.clone())
+        return QgsGeometry(outlines)
+
+
+###############################################################################
+# TRASFORMAZIONE AFFINE PER IL POSIZIONAMENTO DEL DXF
+###############################################################################
+# Scarto massimo (metri) tra la trasformazione di coordinate e la sua approssimazione affine
+DXF_AFFINE_TOLERANCE = 0.001
+# Nodi per lato della griglia su cui si stima (e si verifica) l'approssimazione affine
+DXF_AFFINE_SAMPLES = 5
+
+
+def fit_affine_transform(transform, extent, tolerance):
+    """Approssima la trasformazione di coordinate sull'estensione con una affine (QTransform).
+
+    L'affine è stimata ai minimi quadrati sui nodi di una griglia e verificata anche nei centri
+    delle celle: restituisce None se lo scarto supera tolerance (unità del CRS di destinazione)
+    o se la trasformazione non riesce, nel qual caso le geometrie vanno trasformate una per una.
+    """
+    center = extent.center()
+    # Estensione degenere (una sola linea orizzontale o verticale): campiona un quadrato
+    size = max(extent.width(), extent.height()) or 1.0
+    half = size / 2.0
+    steps = DXF_AFFINE_SAMPLES - 1
+    nodes = [
+        (-half + size * i / steps, -half + size * j / steps)
+        for i in range(DXF_AFFINE_SAMPLES) for j in range(DXF_AFFINE_SAMPLES)
+    ]
+    checks = [
+        (-half + size * (i + 0.5) / steps, -half + size * (j + 0.5) / steps)
+        for i in range(steps) for j in range(steps)
+    ]
+
+    try:
+        projected = [
+            transform.transform(QgsPointXY(center.x() + u, center.y() + v)) for u, v in nodes + checks
+        ]
+        design = [(1.0, u, v) for u, v in nodes]
+        a0, a1, a2 = least_squares(design, [p.x() for p in projected[:len(nodes)]])
+        b0, b1, b2 = least_squares(design, [p.y() for p in projected[:len(nodes)]])
+    except (QgsCsException, ValueError) as e:
+        logging.info(f"Approssimazione affine non disponibile: {e}")
+        return None
+
+    deviation = max(
+        math.hypot(a0 + a1 * u + a2 * v - p.x(), b0 + b1 * u + b2 * v - p.y())
+        for (u, v), p in zip(nodes + checks, projected)
+    )
+    if deviation > tolerance:
+        logging.info(f"Approssimazione affine scartata: scarto {deviation} oltre la tolleranza {tolerance}")
+        return None
+
+    # x' = a0 + a1 (x - cx) + a2 (y - cy); y' = b0 + b1 (x - cx) + b2 (y - cy)
+    return QTransform(
+        a1, b1, a2, b2,
+        a0 - a1 * center.x() - a2 * center.y(),
+        b0 - b1 * center.x() - b2 * center.y()
+    )
+
+
+# Trasformazioni per il posizionamento su punti di controllo: (chiave, etichetta, coppie minime)
+CONTROL_FIT_MODELS = [
+    ('similarity', "Similarità (rotazione, scala, traslazione)", 2),
+    ('affine', "Affine", 3),
+]
+
+
+class ControlPointFit:
+    """Trasformazione stimata ai minimi quadrati da coppie (x, y) -> (x', y') di punti di controllo.
+
+    'similarity': x' = a·x - b·y + tx, y' = b·x + a·y + ty (rotazione, scala uniforme, traslazione);
+    'affine': sei parametri indipendenti. Le coordinate sono ridotte ai baricentri delle coppie.
+    residuals sono gli scarti (trasformato - destinazione) di ogni coppia.
+    """
+
+    def __init__(self, model, pairs):
+        minimum = {key: count for key, _, count in CONTROL_FIT_MODELS}
+        if model not in minimum:
+            raise ValueError(f"Trasformazione sconosciuta: {model}")
+        if len(pairs) < minimum[model]:
+            raise ValueError(f"Servono almeno {minimum[model]} coppie di punti per questa trasformazione")
+        self.model = model
+        count = len(pairs)
+        self.source_x = sum(p[0] for p in pairs) / count
+        self.source_y = sum(p[1] for p in pairs) / count
+        self.target_x = sum(p[2] for p in pairs) / count
+        self.target_y = sum(p[3] for p in pairs) / count
+        source = [(p[0] - self.source_x, p[1] - self.source_y) for p in pairs]
+        target = [(p[2] - self.target_x, p[3] - self.target_y) for p in pairs]
+
+        if model == 'similarity':
+            design = []
+            observations = []
+            for (u, v), (tu, tv) in zip(source, target):
+                design += [(u, -v, 1.0, 0.0), (v, u, 0.0, 1.0)]
+                observations += [tu, tv]
+            a, b, c, f = least_squares(design, observations)
+            self.coefficients = (a, -b, c, b, a, f)
+            parameters = 4
+        else:
+            design = [(u, v, 1.0) for u, v in source]
+            a, b, c = least_squares(design, [t[0] for t in target])
+            d, e, f = least_squares(design, [t[1] for t in target])
+            self.coefficients = (a, b, c, d, e, f)
+            parameters = 6
+
+        self.residuals = []
+        for x, y, tx, ty in pairs:
+            mx, my = self.map(x, y)
+            self.residuals.append((mx - tx, my - ty))
+        self.redundancy = 2 * count - parameters
+        if self.redundancy > 0:
+            self.rms = math.sqrt(sum(vx * vx + vy * vy for vx, vy in self.residuals) / self.redundancy)
+        else:
+            self.rms = None  # Nessuna ridondanza: la trasformazione passa esattamente per le coppie
+
+    def map(self, x, y):
+        """Trasforma un punto"""
+        a, b, c, d, e, f = self.coefficients
+        u = x - self.source_x
+        v = y - self.source_y
+        return self.target_x + a * u + b * v + c, self.target_y + d * u + e * v + f
+
+    def scale_and_rotation(self):
+        """Fattore di scala e rotazione in gradi (per la similarità; per l'affine sono medie indicative)"""
+        a, b, _, d, e, _ = self.coefficients
+        scale = math.sqrt(abs(a * e - b * d))
+        rotation = math.degrees(math.atan2(d - b, a + e))
+        return scale, rotation
+
+    def matrix(self):
+        """La trasformazione come QTransform, da applicare in un solo passaggio a tutte le geometrie"""
+        a, b, c, d, e, f = self.coefficients
+        return QTransform(
+            a, d, b, e,
+            self.target_x + c - a * self.source_x - b * self.source_y,
+            self.target_y + f - d * self.source_x - e * self.source_y
+        )
+
+
+def dxf_stamp_template(model, transform, target_crs, exact_centroid=False):
+    """Geometrie del modello già riproiettate nel CRS di destinazione e punto di aggancio, per i timbri.
+
+    Calcolato una volta per CRS (in cache nel modello): ogni timbro applica solo una traslazione.
+    Restituisce (geometrie, attributi, aggancio); ValueError se il centroide non è trasformabile.
+    """
+    # La WKT distingue anche i CRS personalizzati, che non hanno authid
+    key = (target_crs.toWkt(), exact_centroid)
+    template = model.stamp_templates.get(key)
+    if template is not None:
+        return template
+
+    anchor = model.centroid(exact=exact_centroid)
+    if anchor is None:
+        raise ValueError("Impossibile calcolare il centroide del DXF")
+    matrix = QTransform() if transform is None else fit_affine_transform(
+        transform, model.extent,
+        DXF_AFFINE_TOLERANCE * QgsUnitTypes.fromUnitToUnitFactor(QgsUnitTypes.DistanceMeters, target_crs.mapUnits())
+    )
+    if matrix is not None:
+        geometries = []
+        for geom in model.geometries:
+            geom_copy = QgsGeometry(geom)
+            geom_copy.transform(matrix)
+            geometries.append(geom_copy)
+        anchor = QgsPointXY(*matrix.map(anchor.x(), anchor.y()))
+    else:
+        try:
+            anchor = transform.transform(anchor)
+        except QgsCsException as e:
+            raise ValueError(f"Impossibile trasformare il centroide del DXF nel CRS del progetto:\n{e}")
+        geometries = transform_geometries(transform, model.geometries)
+
+    pairs = [(geom, attributes) for geom, attributes in zip(geometries, model.attributes) if geom]
+    template = ([geom for geom, _ in pairs], [attributes for _, attributes in pairs], anchor)
+    model.stamp_templates[key] = template
+    return template
+
+
+def create_dxf_layer(geometry_string, crs, name, fields):
+    """Layer in memoria vuoto per le geometrie DXF di un tipo, marcato come layer DXF.
+
+    Il CRS viene impostato sul layer e non nell'URI, così valgono anche i CRS personalizzati (senza authid).
+    """
+    layer = QgsVectorLayer(geometry_string, name, "memory")
+    layer.setCrs(crs)
+    layer.dataProvider().addAttributes(fields.toList())
+    layer.updateFields()
+    # Imposta proprietà personalizzata per identificare il layer come DXF
+    layer.setCustomProperty('is_dxf_layer', True)
+    return layer
+
+
+def dxf_features_by_type(fields, geometries, attributes):
+    """Feature con le geometrie date (saltando quelle nulle) raggruppate per dimensione: {dimensione: [feature]}.
+
+    Linee e poligoni vanno in layer distinti: un'unica addFeatures con tipi misti fallirebbe per intero.
+    """
+    features = {}
+    for geom, feature_attributes in zip(geometries, attributes):
+        if not geom:
+            continue
+        new_feat = QgsFeature(fields)
+        new_feat.setAttributes(feature_attributes)
+        new_feat.setGeometry(geom)
+        features.setdefault(QgsWkbTypes.geometryType(geom.wkbType()), []).append(new_feat)
+    return features
+
+
+###############################################################################
+# CARICAMENTO E POSIZIONAMENTO DXF IN BACKGROUND
+###############################################################################
+class DxfLoadTask(QgsTask):
+    """Legge il DXF nel modello in memoria in un thread secondario (vedi DxfModel.load).
+
+    Il task non tocca la cache dei modelli: un modello già in cache gli viene passato dal dialog
+    e restituito così com'è, quello letto viene messo in cache dal dialog nel thread principale.
+    """
+
+    def __init__(self, path, layers=None, preview_resolution=None, cache_key=None, cached_model=None,
+                 exact_centroid=False):
+        super().__init__(f"Lettura DXF: {os.path.basename(path)}", QgsTask.CanCancel)
+        self.path = path
+        self.layers = layers
+        # Unità mappa per pixel del canvas: l'anteprima a questa scala viene preparata subito
+        self.preview_resolution = preview_resolution
+        self.cache_key = cache_key
+        # Centroide dell'unione (lento sui disegni grandi) calcolato qui invece che nel thread principale
+        self.exact_centroid = exact_centroid
+
+        # Risultati letti dal dialog nel thread principale
+        self.model = cached_model
+        self.error = None       # Messaggio per l'utente (file non leggibile)
+        self.exception = None   # Errore imprevisto durante la lettura
+        self.last_progress_update = 0.0
+
+    def run(self):
+        if self.model is not None:
+            logging.info(f"Modello DXF ripreso dalla cache: {self.path}")
+        else:
+            try:
+                self.model = DxfModel.load(self.path, self.layers, self.progress_checkpoint)
+            except (OSError, ValueError) as e:
+                self.error = str(e)
+                return False
+            except Exception as e:
+                self.exception = e
+                logging.error(f"Errore durante la lettura del DXF: {e}")
+                return False
+            if self.model is None:
+                return False  # Interrotta
+            if self.preview_resolution and self.model.geometries:
+                self.model.preview_geometry(self.preview_resolution)
+        if self.exact_centroid:
+            self.model.centroid(exact=True)
+        self.setProgress(100)
+        return True
+
+    def progress_checkpoint(self, fraction):
+        """Aggiorna l'avanzamento (al massimo ogni PROGRESS_UPDATE_INTERVAL secondi); False se annullato"""
+        now = time.monotonic()
+        if now - self.last_progress_update >= PROGRESS_UPDATE_INTERVAL:
+            self.last_progress_update = now
+            self.setProgress(min(99, int(fraction * 100)))
+        return not self.isCanceled()
+
+
+class DxfPreviewTask(QgsTask):
+    """Costruisce in un thread secondario l'anteprima del DXF per una scala (vedi DxfModel.preview_geometry).
+
+    Il modello è condiviso con il thread principale: le copie costruite restano in self.previews
+    e vengono messe nella cache del modello dal map tool, nel thread principale.
+    """
+
+    def __init__(self, model, map_units_per_pixel):
+        super().__init__("Anteprima DXF", QgsTask.CanCancel)
+        self.model = model
+        self.map_units_per_pixel = map_units_per_pixel
+        self.band = model.preview_band(map_units_per_pixel)
+        self.previews = {}
+
+    def run(self):
+        try:
+            self.model.preview_geometry(self.map_units_per_pixel, self.previews)
+        except Exception as e:
+            logging.error(f"Errore durante la preparazione dell'anteprima del DXF: {e}")
+            return False
+        return not self.isCanceled()
+
+
+class DxfPlacementTask(QgsTask):
+    """Riproietta e trasla le geometrie del modello DXF e costruisce i layer in memoria in background.
+
+    Viene creato un layer per tipo di geometria (linee, poligoni) presente nel disegno. I layer sono
+    creati nel thread del task e restituiti al thread principale alla fine di run():
+    aggiunta al progetto e stile restano al dialog.
+    """
+
+    def __init__(self, model, layer_name, target_crs, transform, click_point, exact_centroid=False):
+        super().__init__(f"Posizionamento DXF: {layer_name}", QgsTask.CanCancel)
+        self.model = model
+        self.layer_name = layer_name
+        self.target_crs = QgsCoordinateReferenceSystem(target_crs)
+        # Copia della trasformazione: quella in cache appartiene al thread principale
+        self.transform = QgsCoordinateTransform(transform) if transform is not None else None
+        self.click_point = QgsPointXY(click_point)
+        self.exact_centroid = exact_centroid
+
+        # Risultati letti dal dialog nel thread principale: [(layer, tipo di geometria)]
+        self.layers = []
+        self.error = None
+        self.exception = None
+
+    def run(self):
+        try:
+            return self.place()
+        except Exception as e:
+            self.exception = e
+            logging.error(f"Errore durante il posizionamento del DXF: {e}")
+            return False
+
+    def place(self):
+        model = self.model
+        centroid_point = model.centroid(exact=self.exact_centroid)
+        if centroid_point is None:
+            self.error = "Impossibile calcolare il centroide del DXF"
+            return False
+        self.setProgress(10)
+
+        # Riproiezione e traslazione in un'unica matrice affine: esatta se i CRS coincidono,
+        # altrimenti l'approssimazione lineare della trasformazione se resta entro la tolleranza
+        if self.transform is None:
+            matrix = QTransform()
+        else:
+            tolerance = DXF_AFFINE_TOLERANCE * QgsUnitTypes.fromUnitToUnitFactor(
+                QgsUnitTypes.DistanceMeters, self.target_crs.mapUnits()
+            )
+            matrix = fit_affine_transform(self.transform, model.extent, tolerance)
+
+        if matrix is not None:
+            anchor_x, anchor_y = matrix.map(centroid_point.x(), centroid_point.y())
+            dx = self.click_point.x() - anchor_x
+            dy = self.click_point.y() - anchor_y
+            matrix = matrix * QTransform.fromTranslate(dx, dy)
+            placed_geoms = []
+            for i, geom in enumerate(model.geometries):
+                geom_copy = QgsGeometry(geom)
+                geom_copy.transform(matrix)
+                placed_geoms.append(geom_copy)
+                if i % DXF_PROGRESS_INTERVAL == 0:
+                    if self.isCanceled():
+                        return False
+                    self.setProgress(10 + 80 * i // len(model.geometries))
+        else:
+            # Trasformazione non lineare sull'estensione del disegno: riproiezione a blocchi,
+            # poi traslazione del centroide trasformato sul punto cliccato
+            try:
+                centroid_point = self.transform.transform(centroid_point)
+            except QgsCsException as e:
+                self.error = f"Impossibile trasformare il centroide del DXF nel CRS del progetto:\n{e}"
+                return False
+            dx = self.click_point.x() - centroid_point.x()
+            dy = self.click_point.y() - centroid_point.y()
+            placed_geoms = transform_geometries(self.transform, model.geometries)
+            if self.isCanceled():
+                return False
+            for geom_copy in placed_geoms:
+                if geom_copy and geom_copy.translate(dx, dy) != QgsGeometry.Success:
+                    logging.warning("Errore nella traslazione della geometria")
+        logging.info(
+            f"Posizionamento DXF: {'matrice affine' if matrix is not None else 'trasformazione a blocchi'}, "
+            f"traslazione dx={dx}, dy={dy}"
+        )
+        self.setProgress(90)
+
+        # Un layer per tipo di geometria, ciascuno riempito con un'unica addFeatures
+        geometry_strings = model.geometry_strings()
+        layers = []
+        for topo, features in dxf_features_by_type(model.fields, placed_geoms, model.attributes).items():
+            memory_layer = create_dxf_layer(
+                geometry_strings[topo], self.target_crs, model.layer_name(self.layer_name, topo), model.fields
+            )
+            if not memory_layer.dataProvider().addFeatures(features)[0]:
+                self.error = "Impossibile aggiungere le geometrie del DXF al layer in memoria"
+                return False
+            memory_layer.updateExtents()
+            layers.append((memory_layer, geometry_strings[topo]))
+
+        # I layer sono stati creati in questo thread: vanno restituiti al thread principale prima di usarli
+        for memory_layer, _ in layers:
+            memory_layer.moveToThread(QCoreApplication.instance().thread())
+        self.layers = layers
+        self.setProgress(100)
+        return True
+
+
 ###############################################################################
 # DIALOG PRINCIPALE CON 4 TAB:
 #   1) Importa CSV
@@ -54,6 +2735,8 @@ class CombinedCsvDialog(QDialog):
 
         # Variabili per gestione CSV
         self.import_fields = []
+        self.import_encoding = None
+        self.import_batch_size = IMPORT_BATCH_SIZE  # Feature inserite per ogni addFeatures
         self.name_field = None
         self.x_field = None
         self.y_field = None
@@ -61,7 +2744,15 @@ class CombinedCsvDialog(QDialog):
 
         # Variabili per gestione DXF
         self.dxf_path = None
-        self.dxf_layer = None
+        self.dxf_header = None
+        self.dxf_model = None
+        # Lettura e posizionamento DXF in corso (QgsTask) e clic arrivati durante la lettura
+        self.dxf_load_task = None
+        self.dxf_place_task = None
+        self.dxf_pending_clicks = []  # (punto, timbro): un solo posizionamento o più timbri in attesa
+        # Layer dei timbri della sessione di posizionamento in corso, uno per tipo di geometria
+        self.dxf_stamp_layers = {}
+        self.dxf_stamp_count = 0
         self.map_tool = None
         
         # Variabile per gestione etichette
@@ -107,9 +2798,14 @@ class CombinedCsvDialog(QDialog):
         # Connetti al segnale di rimozione layer per aggiornare automaticamente la lista export
         QgsProject.instance().layersRemoved.connect(self.on_layers_removed)
 
-        # Per mostrare eventuali progress bar di import/export
-        self.progress_import = None
+        # Importazione CSV in corso (QgsTask) e progress bar dell'export
+        self.import_task = None
         self.progress_export = None
+
+        # Finestra della compensazione delle quote su più punti di controllo
+        self.vertical_adjustment_dialog = None
+        # Finestra del posizionamento del DXF su punti di controllo
+        self.dxf_fit_dialog = None
         
         # Abilita drag and drop
         self.setAcceptDrops(True)
@@ -471,25 +3167,9 @@ class CombinedCsvDialog(QDialog):
 
         header = self.import_header_checkbox.isChecked()
         
-        # Prova diversi encoding comuni
-        encodings = ['utf-8', 'cp1252', 'iso-8859-1', 'latin1', 'utf-8-sig']
-        used_encoding = None
-        
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    # Prova a leggere tutto il file per verificare l'encoding
-                    f.read()
-                    used_encoding = encoding
-                    logging.info(f"Encoding trovato: {encoding}")
-                    break
-            except (UnicodeDecodeError, UnicodeError):
-                continue
-                
-        if not used_encoding:
-            # Fallback: prova con errors='ignore'
-            used_encoding = 'utf-8'
-            logging.warning(f"Impossibile determinare l'encoding, uso utf-8 con errors='ignore'")
+        # Rileva l'encoding leggendo solo l'inizio del file (il risultato resta in cache per l'import)
+        used_encoding = detect_file_encoding(file_path)
+        self.import_encoding = used_encoding
             
         try:
             # Apri il file con l'encoding trovato
@@ -678,49 +3358,6 @@ class CombinedCsvDialog(QDialog):
             self.import_dms_checkbox.setChecked(False)
 
     
-    def dms_to_decimal(self, dms_string):
-        """Converte coordinate sessagesimali in decimali"""
-        import re
-        
-        dms_str = str(dms_string).strip()
-        
-        # Pattern più flessibili per diversi formati DMS
-        patterns = [
-            # Formato: 45°30'15.5"N o 45° 30' 15.5" N
-            r"([+-]?\d+)[°\s]+(\d+)['\s]+(\d+(?:\.\d+)?)[\"'\s]*([NSEW]?)",
-            # Formato: 45 30 15.5 N
-            r"([+-]?\d+)\s+(\d+)\s+(\d+(?:\.\d+)?)\s*([NSEW]?)",
-            # Formato: 45:30:15.5N
-            r"([+-]?\d+):(\d+):(\d+(?:\.\d+)?)\s*([NSEW]?)",
-            # Formato: 45d30m15.5s
-            r"([+-]?\d+)d\s*(\d+)m\s*(\d+(?:\.\d+)?)s?\s*([NSEW]?)",
-        ]
-        
-        for pattern in patterns:
-            match = re.match(pattern, dms_str, re.IGNORECASE)
-            if match:
-                degrees = float(match.group(1))
-                minutes = float(match.group(2))
-                seconds = float(match.group(3))
-                direction = match.group(4).upper() if match.group(4) else ''
-                
-                # Calcola valore decimale
-                decimal = abs(degrees) + minutes/60 + seconds/3600
-                
-                # Applica segno
-                if degrees < 0:
-                    decimal = -decimal
-                elif direction in ['S', 'W']:
-                    decimal = -decimal
-                    
-                return decimal
-        
-        # Se non matcha nessun pattern DMS, prova come decimale
-        try:
-            return float(dms_str)
-        except:
-            raise ValueError(f"Formato coordinate non valido: {dms_string}")
-    
     def decimal_to_dms(self, decimal, is_longitude=False, format_type="standard"):
         """Converte coordinate decimali in sessagesimali con formato personalizzabile"""
         import math
@@ -751,6 +3388,10 @@ class CombinedCsvDialog(QDialog):
             return f"{degrees}° {minutes}' {seconds:.2f}\" {direction}"
 
     def import_csv(self):
+        if self.import_task is not None:
+            QMessageBox.information(self, "Importazione in corso", "Attendi il termine dell'importazione in corso.")
+            return
+
         file_path = self.import_file_line_edit.text().strip()
         if not file_path:
             QMessageBox.warning(self, "Errore", "Nessun file selezionato.")
@@ -824,21 +3465,25 @@ class CombinedCsvDialog(QDialog):
         if not selected_crs or selected_crs == "custom":
             selected_crs = "EPSG:4326"  # Default a WGS84
         
-        # Costruzione URI per il CSV
-        # Normalizza il percorso del file per essere sicuri che sia corretto
-        normalized_path = os.path.abspath(file_path).replace('\\', '/')
-        uri = f"file:///{normalized_path}?type=csv&detectTypes=yes&xField={self.x_field}&yField={self.y_field}&crs={selected_crs}&encoding=cp1252"
-        if not header:
-            uri += "&useHeader=no"
-            field_names = ','.join(selected_fields)
-            uri += f"&fieldNames={field_names}"
-
-        csv_layer = QgsVectorLayer(uri, layer_name, "delimitedtext")
-        if not csv_layer.isValid():
-            QMessageBox.warning(self, "Errore", "Layer non valido. Controlla il file CSV e i parametri.")
-            logging.error("Layer CSV non valido.")
+        # Encoding rilevato in fase di caricamento campi (in cache, non rilegge il file)
+        encoding = detect_file_encoding(file_path)
+        self.import_encoding = encoding
+
+        # Lettura diretta del CSV in un solo passaggio (niente layer delimitedtext intermedio)
+        reader = CsvPointReader(file_path, encoding, header)
+        try:
+            source_fields = reader.read_field_names()
+        except Exception as e:
+            QMessageBox.warning(self, "Errore", f"Impossibile leggere il file CSV: {e}")
+            logging.error(f"Impossibile leggere il file CSV: {e}")
             return
 
+        for field_name in selected_fields:
+            if field_name not in source_fields:
+                QMessageBox.warning(self, "Errore", f"Il campo '{field_name}' non esiste nel file CSV.")
+                logging.warning(f"Campo mancante: {field_name}")
+                return
+
         # Se il CRS è geografico (4326), riproietta in Web Mercator (3857)
         # Altrimenti mantieni il CRS piano originale
         source_crs_obj = QgsCoordinateReferenceSystem(selected_crs)
@@ -848,112 +3493,88 @@ class CombinedCsvDialog(QDialog):
         else:
             target_crs = selected_crs
             logging.info(f"Mantenimento del CRS piano originale: {selected_crs}")
-        
-        # Creazione layer in memoria
-        mem_layer = QgsVectorLayer(f"Point?crs={target_crs}", layer_name, "memory")
-        mem_provider = mem_layer.dataProvider()
-
-        # Costruzione dei campi
-        fields = QgsFields()
-        for field_name in selected_fields:
-            field_index = csv_layer.fields().indexFromName(field_name)
-            if field_index == -1:
-                QMessageBox.warning(self, "Errore", f"Il campo '{field_name}' non esiste nel layer CSV.")
-                logging.warning(f"Campo mancante: {field_name}")
-                return
-            field = csv_layer.fields().field(field_index)
-            if not header and field_name.startswith('field_'):
-                new_field = QgsField(field_name, QVariant.String)
-            else:
-                new_field = QgsField(field.name(), field.type(), field.typeName())
-            fields.append(new_field)
-        mem_provider.addAttributes(fields)
-        mem_layer.updateFields()
 
-        total_features = csv_layer.featureCount()
-        if total_features == 0:
-            QMessageBox.warning(self, "Errore", "Il layer CSV non contiene alcuna feature.")
-            logging.warning("Layer CSV vuoto.")
-            return
-
-        # Barra di progresso e controllo delle feature con coordinate non valide
-        self.progress_import = QProgressDialog("Importazione delle feature...", "Annulla", 0, total_features, self)
-        self.progress_import.setWindowModality(Qt.WindowModal)  # Modal solo rispetto alla finestra di Spotter, non all'intera applicazione
-        self.progress_import.setMinimumDuration(0)
-        self.progress_import.show()
-
-        # Prepara la trasformazione delle coordinate se necessario
-        source_crs = QgsCoordinateReferenceSystem(selected_crs)
-        dest_crs = QgsCoordinateReferenceSystem(target_crs)
-        transform = None
-        if source_crs != dest_crs:
-            transform = QgsCoordinateTransform(source_crs, dest_crs, QgsProject.instance())
-        
-        processed_features = 0
-        invalid_features = 0  # Contatore per feature con coordinate non valide
-        try:
-            for feat in csv_layer.getFeatures():
-                if self.progress_import.wasCanceled():
-                    QMessageBox.information(self, "Interrotto", "L'importazione è stata interrotta dall'utente.")
-                    logging.info("Importazione interrotta dall'utente.")
-                    self.progress_import.close()
-                    return
-                # Estrai e verifica i valori delle coordinate
-                y_val = feat.attribute(self.y_field)
-                x_val = feat.attribute(self.x_field)
-                try:
-                    # Se è abilitata la conversione DMS e siamo in WGS84
-                    if self.import_dms_checkbox.isChecked() and selected_crs == "EPSG:4326":
-                        y = self.dms_to_decimal(str(y_val))
-                        x = self.dms_to_decimal(str(x_val))
-                    else:
-                        y = float(y_val)
-                        x = float(x_val)
-                except Exception:
-                    invalid_features += 1
-                    continue  # Salta la feature se i valori non sono numerici
-
-                # Crea la geometria
-                point = QgsPointXY(x, y)
-                
-                # Trasforma le coordinate se necessario
-                if transform:
-                    try:
-                        point = transform.transform(point)
-                    except Exception as e:
-                        logging.warning(f"Errore nella trasformazione delle coordinate: {e}")
-                        invalid_features += 1
-                        continue
-                
-                # Verifica le coordinate PRIMA della trasformazione se sono in WGS84
-                if selected_crs == "EPSG:4326" and not transform:
-                    # Solo se NON c'è trasformazione, verifica i limiti WGS84
-                    if not (-90 <= y <= 90) or not (-180 <= x <= 180):
-                        invalid_features += 1
-                        continue
-
-                new_feat = QgsFeature()
-                new_feat.setGeometry(QgsGeometry.fromPointXY(point))
-                attr_values = [feat.attribute(field_name) for field_name in selected_fields]
-                new_feat.setAttributes(attr_values)
-                mem_provider.addFeature(new_feat)
-                processed_features += 1
-                self.progress_import.setValue(processed_features)
-        except Exception as e:
-            QMessageBox.critical(self, "Errore", f"Errore durante l'importazione delle feature: {e}")
-            logging.error(f"Errore durante l'importazione delle feature: {e}")
-            self.progress_import.close()
-            return
+        use_dms = self.import_dms_checkbox.isChecked() and selected_crs == "EPSG:4326"
+
+        # Lettura, conversione e costruzione del layer in background: QGIS resta utilizzabile,
+        # avanzamento e annullamento sono nel gestore delle attività
+        task = CsvImportTask(
+            reader, layer_name, selected_fields, self.x_field, self.y_field,
+            selected_crs, target_crs, QgsProject.instance().transformContext(),
+            dms_format=self.import_dms_format_combo.currentData() if use_dms else None,
+            batch_size=self.import_batch_size,
+            name_field=self.name_field,
+            elevation_field=self.selected_elevation_field
+        )
+        self.start_csv_import(task)
+        logging.info(f"Importazione di '{file_path}' avviata in background")
+
+    def start_csv_import(self, task):
+        """Avvia il task di importazione nel gestore delle attività di QGIS"""
+        task.taskCompleted.connect(lambda: self.finish_csv_import(task))
+        task.taskTerminated.connect(lambda: self.abort_csv_import(task))
+        self.import_task = task
+        self.import_execute_button.setEnabled(False)
+        QgsApplication.taskManager().addTask(task)
+
+    def abort_csv_import(self, task):
+        """Gestisce un'importazione CSV annullata o fallita (thread principale)"""
+        self.import_task = None
+        self.import_execute_button.setEnabled(True)
+        if task.exception is not None:
+            QMessageBox.critical(self, "Errore", f"Errore durante l'importazione delle feature: {task.exception}")
+        elif task.validation_errors:
+            self.report_csv_validation_errors(task)
+        elif task.invalid_features > 0:
+            QMessageBox.warning(self, "Attenzione", task.error)
+        elif task.error:
+            QMessageBox.warning(self, "Errore", task.error)
+        else:
+            QMessageBox.information(self, "Interrotto", "L'importazione è stata interrotta dall'utente.")
 
-        self.progress_import.setValue(total_features)
-        self.progress_import.close()
+    def report_csv_validation_errors(self, task):
+        """Mostra le righe errate trovate dalla validazione e chiede se saltarle o annullare l'importazione"""
+        errors = task.validation_errors
+        if task.validation_complete:
+            summary = f"Sono state trovate {len(errors)} righe con coordinate non valide."
+        else:
+            summary = f"La validazione si è fermata dopo le prime {len(errors)} righe con coordinate non valide."
+        error_lines = [f"Riga {line_number}: {message}" for line_number, message in errors]
+        logging.warning(summary + "\n" + "\n".join(error_lines))
 
-        # Se sono state trovate feature con coordinate non valide, annulla l'importazione (il layer non viene creato)
-        if invalid_features > 0:
-            QMessageBox.warning(self, "Attenzione", f"Sono state trovate {invalid_features} feature con coordinate non valide. Importazione annullata.")
+        msg_box = QMessageBox(self)
+        msg_box.setIcon(QMessageBox.Warning)
+        msg_box.setWindowTitle('Coordinate non valide')
+        msg_box.setText(summary)
+        msg_box.setInformativeText("\n".join(error_lines[:5]) + "\n\nVuoi importare il file saltando le righe errate?")
+        msg_box.setDetailedText("\n".join(error_lines))
+
+        skip_button = msg_box.addButton('Salta righe errate', QMessageBox.AcceptRole)
+        abort_button = msg_box.addButton('Annulla', QMessageBox.RejectRole)
+        msg_box.setDefaultButton(abort_button)
+        msg_box.exec_()
+
+        if msg_box.clickedButton() != skip_button:
+            logging.info("Importazione annullata dopo la validazione")
             return
-
-        mem_layer.updateExtents()
+        # Nuova importazione con le stesse impostazioni che scarta le righe errate
+        self.start_csv_import(task.with_skip_invalid())
+
+    def finish_csv_import(self, task):
+        """Aggiunge al progetto il layer costruito dal task e ne imposta etichette e stile (thread principale)"""
+        self.import_task = None
+        self.import_execute_button.setEnabled(True)
+        # Ripristina i campi dell'importazione (il layer attivo può essere cambiato nel frattempo)
+        self.name_field = task.name_field
+        self.x_field = task.x_field
+        self.y_field = task.y_field
+        self.selected_elevation_field = task.elevation_field
+        mem_layer = task.layer
+        layer_name = task.layer_name
+        selected_crs = task.source_crs
+        target_crs = task.target_crs
+        header = task.reader.has_header
+        source_crs_obj = QgsCoordinateReferenceSystem(selected_crs)
 
         # Imposta default value per X e Y se presenti
         if self.x_field and self.y_field:
@@ -987,32 +3608,9 @@ class CombinedCsvDialog(QDialog):
         if self.name_field:
             name_idx = mem_layer.fields().indexFromName(self.name_field)
             if name_idx != -1:
-                # Trova il numero massimo esistente
-                max_num = 0
-                for feat in mem_layer.getFeatures():
-                    name_val = feat[self.name_field]
-                    if name_val:
-                        try:
-                            # Prova a estrarre un numero dal nome
-                            import re
-                            name_str = str(name_val)
-                            # Se il nome è solo un numero o inizia con un numero seguito da non-cifre
-                            if name_str.isdigit():
-                                num = int(name_str)
-                                max_num = max(max_num, num)
-                            else:
-                                # Cerca un numero all'inizio della stringa
-                                match = re.match(r'^(\d+)(?:\D|$)', name_str)
-                                if match:
-                                    num = int(match.group(1))
-                                    max_num = max(max_num, num)
-                        except:
-                            pass
-                
-                # Imposta il valore predefinito come il prossimo numero progressivo
-                # Usa aggregate per ottenere il massimo valore numerico esistente + 1
-                expression = f"coalesce(array_max(array_foreach(array_agg(regexp_substr(\"{self.name_field}\", '[0-9]+')), to_int(@element))), 0) + 1"
-                mem_layer.setDefaultValueDefinition(name_idx, QgsDefaultValue(expression))
+                # Imposta il valore predefinito come il prossimo numero progressivo (indice dei numeri
+                # a plugin caricato, espressione nativa nel progetto salvato)
+                PointNumberDefaults.apply(mem_layer, name_idx)
         
         # Imposta valore di default 0 per il campo quota se presente
         if self.selected_elevation_field:
@@ -1145,6 +3743,11 @@ class CombinedCsvDialog(QDialog):
         else:
             success_msg = f"Layer temporaneo '{layer_name}' creato con successo!\n\nCRS: {selected_crs}"
         
+        if task.invalid_features > 0:
+            success_msg += f"\n\nRighe con coordinate non valide scartate: {task.invalid_features}"
+        if task.unconverted_values:
+            unconverted = ", ".join(f"{name} ({count})" for name, count in task.unconverted_values.most_common())
+            success_msg += f"\n\nValori non compatibili con il tipo del campo, importati come NULL: {unconverted}"
         QMessageBox.information(self, "Successo", success_msg)
         logging.info(f"Layer temporaneo '{layer_name}' creato con successo. CRS: {target_crs}")
         
@@ -1440,7 +4043,7 @@ class CombinedCsvDialog(QDialog):
         if not file_path.lower().endswith('.csv'):
             file_path += '.csv'
 
-        transform = QgsCoordinateTransform(layer.crs(), target_crs, QgsProject.instance())
+        transform = TransformCache.get(layer.crs(), target_crs)
         is_epsg_4326 = (crs_code == "EPSG:4326")
 
         def format_number(value, decimals):
@@ -1488,29 +4091,44 @@ class CombinedCsvDialog(QDialog):
                 if export_headers and header_fields:
                     writer.writerow(header_fields)
 
-                for feat in layer.getFeatures():
-                    geom = feat.geometry()
-                    feat_x_val = None
-                    feat_y_val = None
-                    if geom and not geom.isEmpty():
-                        geom.transform(transform)
-                        if geom.type() == QgsWkbTypes.PointGeometry:
+                features = layer.getFeatures()
+                while True:
+                    # Legge un blocco di feature e ne trasforma le coordinate con una sola chiamata
+                    chunk = list(itertools.islice(features, EXPORT_BATCH_SIZE))
+                    if not chunk:
+                        break
+
+                    xs = array('d')
+                    ys = array('d')
+                    point_rows = []
+                    for row_index, feat in enumerate(chunk):
+                        geom = feat.geometry()
+                        if geom and not geom.isEmpty() and geom.type() == QgsWkbTypes.PointGeometry:
                             p = geom.asPoint()
-                            feat_x_val = p.x()
-                            feat_y_val = p.y()
+                            xs.append(p.x())
+                            ys.append(p.y())
+                            point_rows.append(row_index)
 
-                    row = []
-                    for f in selected_fields:
-                        val = feat[f]
-                        if f == x_field and feat_x_val is not None:
-                            val = feat_x_val
-                        if f == y_field and feat_y_val is not None:
-                            val = feat_y_val
+                    xs, ys, failed = transform_coordinates(transform, xs, ys)
+                    if failed:
+                        raise ValueError(f"impossibile trasformare le coordinate di {len(failed)} punti")
+                    transformed_points = {row_index: (xs[i], ys[i]) for i, row_index in enumerate(point_rows)}
 
-                        formatted_val = format_value(f, val)
-                        row.append(formatted_val)
+                    for row_index, feat in enumerate(chunk):
+                        feat_x_val, feat_y_val = transformed_points.get(row_index, (None, None))
 
-                    writer.writerow(row)
+                        row = []
+                        for f in selected_fields:
+                            val = feat[f]
+                            if f == x_field and feat_x_val is not None:
+                                val = feat_x_val
+                            if f == y_field and feat_y_val is not None:
+                                val = feat_y_val
+
+                            formatted_val = format_value(f, val)
+                            row.append(formatted_val)
+
+                        writer.writerow(row)
 
             QMessageBox.information(self, "Successo", "Esportazione CSV completata con successo.")
             logging.info(f"Esportazione CSV completata: {file_path}")
@@ -1667,6 +4285,17 @@ class CombinedCsvDialog(QDialog):
         file_layout.addWidget(self.dxf_file_line_edit)
         file_layout.addWidget(self.select_dxf_button)
         layout.addLayout(file_layout)
+
+        # Filtro sui layer DXF, applicato durante la lettura del file
+        dxf_layers_layout = QHBoxLayout()
+        dxf_layers_layout.addWidget(QLabel("Layer DXF:"))
+        self.dxf_layers_line_edit = QLineEdit()
+        self.dxf_layers_line_edit.setPlaceholderText("Tutti (nomi separati da virgola)")
+        self.dxf_layers_line_edit.setToolTip(
+            "Legge solo le entità dei layer DXF indicati.\nIl filtro viene applicato al caricamento del file."
+        )
+        dxf_layers_layout.addWidget(self.dxf_layers_line_edit)
+        layout.addLayout(dxf_layers_layout)
         layout.addSpacing(15)
         
         # Layout orizzontale per posizionamento DXF (per allineamento)
@@ -1680,12 +4309,34 @@ class CombinedCsvDialog(QDialog):
         self.place_dxf_button.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         position_layout.addWidget(self.place_dxf_button, 1)  # stretch factor 1
         
-        # Spazio vuoto a destra (metà destra - 50%) per allineamento
-        empty_layout = QHBoxLayout()
-        empty_layout.setContentsMargins(0, 0, 0, 0)
-        position_layout.addLayout(empty_layout, 1)  # stretch factor 1
+        # Centroide esatto dell'unione (metà destra - 50%), lento sui disegni grandi
+        centroid_layout = QHBoxLayout()
+        centroid_layout.setContentsMargins(0, 0, 0, 0)
+        centroid_layout.addStretch()  # Spinge tutto a destra
+        self.exact_centroid_checkbox = QCheckBox("Centroide esatto")
+        self.exact_centroid_checkbox.setToolTip(
+            "Calcola il punto di aggancio come centroide dell'unione di tutte le geometrie.\n"
+            "Più preciso con geometrie sovrapposte, ma lento sui disegni con molte entità."
+        )
+        centroid_layout.addWidget(self.exact_centroid_checkbox)
+        self.dxf_stamp_checkbox = QCheckBox("Timbro")
+        self.dxf_stamp_checkbox.setToolTip(
+            "Posiziona lo stesso DXF a ogni clic, finché non si clicca con il tasto destro.\n"
+            "Tutte le copie finiscono in un unico layer."
+        )
+        centroid_layout.addWidget(self.dxf_stamp_checkbox)
+        position_layout.addLayout(centroid_layout, 1)  # stretch factor 1
         
         layout.addLayout(position_layout)
+        
+        # Rototraslazione e scala del DXF già posizionato su coppie di punti di controllo
+        self.dxf_fit_button = QPushButton("Posiziona con punti di controllo")
+        self.dxf_fit_button.clicked.connect(self.start_dxf_control_fit)
+        self.dxf_fit_button.setToolTip(
+            "Seleziona un layer DXF posizionato, poi clicca coppie di punti: prima sul DXF,\n"
+            "poi nella posizione corretta. Stima rotazione, scala e traslazione (o un'affine)."
+        )
+        layout.addWidget(self.dxf_fit_button)
         layout.addSpacing(15)
         rename_layout = QHBoxLayout()
         rename_layout.setSpacing(10)
@@ -1734,6 +4385,14 @@ class CombinedCsvDialog(QDialog):
         self.start_vertex_number.setAlignment(Qt.AlignRight)  # Align text to the right
         # Non impostare un placeholder, verrà calcolato quando si apre il tab
         numero_layout.addWidget(self.start_vertex_number)
+        tolerance_label = QLabel("Toll. (m):")
+        numero_layout.addWidget(tolerance_label)
+        self.vertex_tolerance = QLineEdit()
+        self.vertex_tolerance.setFixedWidth(60)  # Larghezza fissa per il campo
+        self.vertex_tolerance.setAlignment(Qt.AlignRight)
+        self.vertex_tolerance.setText(str(VERTEX_MERGE_TOLERANCE))
+        self.vertex_tolerance.setToolTip("Distanza entro la quale un vertice coincide con un punto già presente")
+        numero_layout.addWidget(self.vertex_tolerance)
         
         # Aggiungi il layout numero con stesso stretch factor
         vertices_layout.addLayout(numero_layout, 1)  # stretch factor 1
@@ -1767,6 +4426,15 @@ class CombinedCsvDialog(QDialog):
         
         layout.addLayout(elevation_layout)
         
+        # Compensazione delle quote su più punti di controllo (minimi quadrati)
+        self.vertical_adjustment_button = QPushButton("Compensazione quote")
+        self.vertical_adjustment_button.clicked.connect(self.start_vertical_adjustment)
+        self.vertical_adjustment_button.setToolTip(
+            "Corregge le quote del layer a partire da più punti di quota nota"
+        )
+        self.vertical_adjustment_button.setEnabled(False)  # Disabilitato di default
+        layout.addWidget(self.vertical_adjustment_button)
+        
         # Aggiungi spazio elastico
         layout.addStretch()
         
@@ -1790,58 +4458,130 @@ class CombinedCsvDialog(QDialog):
         if not path:
             self.dxf_file_line_edit.setText("")
             self.place_dxf_button.setEnabled(False)
-            self.dxf_layer = None
+            self.dxf_model = None
             return
 
         self.dxf_path = path
         self.dxf_file_line_edit.setText(path)
+        self.load_dxf(path)
 
-        # Carica layer DXF in modo temporaneo (senza aggiungerlo al progetto)
-        temp_dxf_layer = QgsVectorLayer(path, "DXF_Temp", "ogr")
-        
-        if not temp_dxf_layer.isValid():
-            QMessageBox.critical(self, "Errore", "Errore durante l'importazione del DXF.\nVerifica che il file sia un DXF valido.")
+    def load_dxf(self, path):
+        """Pre-legge la HEADER del DXF e ne avvia la lettura completa in background"""
+        # Pre-lettura della sola HEADER: estensione, unità e dimensione del disegno
+        layers = [name.strip() for name in self.dxf_layers_line_edit.text().split(',') if name.strip()]
+        try:
+            header = DxfHeader(path)
+            cache_key = DxfModel.cache_key(path, layers or None)
+        except OSError as e:
+            QMessageBox.critical(self, "Errore", f"Impossibile leggere il file DXF:\n{e}")
             self.place_dxf_button.setEnabled(False)
-            self.dxf_layer = None
+            self.dxf_model = None
             return
+        self.dxf_header = header
+        logging.info(
+            f"HEADER DXF {path}: versione {header.version}, unità {header.units_name()}, "
+            f"estensione {header.extent.toString() if header.extent else 'non dichiarata'}, "
+            f"circa {header.entity_estimate} entità"
+        )
 
-        # Verifica linee/poligoni
-        total_features = 0
-        invalid_geometries = 0
-        for feat in temp_dxf_layer.getFeatures():
-            total_features += 1
-            geom = feat.geometry()
-            if not geom:
-                invalid_geometries += 1
-                continue
-            topo = QgsWkbTypes.geometryType(geom.wkbType())
-            if topo not in [QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry]:
-                invalid_geometries += 1
+        # Una nuova lettura sostituisce quella in corso
+        if self.dxf_load_task is not None:
+            self.dxf_load_task.cancel()
+        self.dxf_model = None
+        self.dxf_pending_clicks = []
+
+        task = DxfLoadTask(
+            path, layers or None, self.iface.mapCanvas().mapUnitsPerPixel(),
+            cache_key=cache_key, cached_model=DxfModel.cached(cache_key),
+            exact_centroid=self.exact_centroid_checkbox.isChecked()
+        )
+        task.taskCompleted.connect(lambda: self.finish_dxf_load(task))
+        task.taskTerminated.connect(lambda: self.abort_dxf_load(task))
+        self.dxf_load_task = task
+        QgsApplication.taskManager().addTask(task)
+        self.place_dxf_button.setEnabled(True)
+
+        # La domanda arriva subito: il posizionamento può iniziare mentre le entità vengono lette
+        header_note = f"\nUnità di disegno: {header.units_name()}"
+        if header.extent:
+            header_note += f" - dimensioni {header.extent.width():.2f} x {header.extent.height():.2f}"
+        if header.is_large():
+            header_note += f"\nDisegno grande (circa {header.entity_estimate} entità): la lettura continua in background."
+        reply = QMessageBox.question(
+            self,
+            "DXF Caricato",
+            f"Il file DXF è in caricamento.\n{header_note}\n\nVuoi posizionarlo sulla mappa?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.Yes
+        )
+        
+        if reply == QMessageBox.Yes:
+            self.start_placing_dxf()
+
+    def finish_dxf_load(self, task):
+        """Verifica il modello letto in background (thread principale)"""
+        if task is not self.dxf_load_task:
+            return  # Lettura sostituita da una più recente
+        self.dxf_load_task = None
+        model = task.model
+        DxfModel.remember(task.cache_key, model)
 
-        if invalid_geometries > 0:
+        # Verifica linee/poligoni
+        if not model.is_valid():
+            self.dxf_pending_clicks = []
+            self.cancel_dxf_placing()
             QMessageBox.warning(
                 self,
                 "Geometrie Non Supportate",
-                f"Il file DXF contiene {invalid_geometries} geometrie non valide su un totale di {total_features}.\n"
+                f"Il file DXF contiene {model.invalid_geometries} geometrie non valide su un totale di {model.total_features}.\n"
                 "Solo linee e poligoni sono supportati"
             )
             self.place_dxf_button.setEnabled(False)
-            self.dxf_layer = None
-        else:
-            self.dxf_layer = temp_dxf_layer
-            self.place_dxf_button.setEnabled(True)
-            
-            # Chiedi se vuole posizionare il DXF sulla mappa
-            reply = QMessageBox.question(
-                self,
-                "DXF Caricato",
-                "Il file DXF è stato caricato correttamente.\n\nVuoi posizionarlo sulla mappa?",
-                QMessageBox.Yes | QMessageBox.No,
-                QMessageBox.Yes
+            return
+
+        self.dxf_model = model
+        # Segnala le entità non lineari (punti, testi, ...) scartate in lettura
+        message = f"DXF letto: {len(model.geometries)} geometrie"
+        if model.ignored_entities:
+            ignored = ", ".join(f"{count} {name}" for name, count in model.ignored_entities.most_common())
+            message += f" (entità ignorate: {ignored})"
+        self.iface.messageBar().pushMessage("Spotter", message, level=Qgis.Info, duration=5)
+
+        if self.map_tool is not None:
+            self.map_tool.model = model
+            self.map_tool.source_crs = self.dxf_source_crs(model)
+            self.map_tool.set_preview(
+                self.map_tool.preview_extent or model.extent,
+                model.centroid(exact=self.exact_centroid_checkbox.isChecked())
             )
-            
-            if reply == QMessageBox.Yes:
-                self.start_placing_dxf()
+        # Clic arrivati durante la lettura: posiziona adesso, nell'ordine dei clic
+        pending, self.dxf_pending_clicks = self.dxf_pending_clicks, []
+        for point, stamp in pending:
+            if not stamp:
+                self.place_dxf_on_map(point)
+            elif not self.stamp_dxf(point):
+                break
+
+    def abort_dxf_load(self, task):
+        """Gestisce una lettura DXF annullata o fallita (thread principale)"""
+        if task is not self.dxf_load_task:
+            return  # Lettura sostituita da una più recente
+        self.dxf_load_task = None
+        self.dxf_pending_clicks = []
+        self.cancel_dxf_placing()
+        self.place_dxf_button.setEnabled(False)
+        if task.exception is not None:
+            QMessageBox.critical(self, "Errore", f"Errore durante la lettura del DXF: {task.exception}")
+        elif task.error:
+            QMessageBox.critical(self, "Errore", task.error)
+        else:
+            QMessageBox.information(self, "Interrotto", "Lettura del DXF interrotta")
+
+    def cancel_dxf_placing(self):
+        """Disattiva il map tool di posizionamento del DXF, se attivo"""
+        if self.map_tool is not None:
+            self.iface.mapCanvas().unsetMapTool(self.map_tool)
+            self.map_tool = None
 
     def extract_vertices_from_geometry(self):
         """Estrae i vertici da geometrie selezionate in qualsiasi layer e li aggiunge al layer CSV"""
@@ -1915,9 +4655,11 @@ class CombinedCsvDialog(QDialog):
             QMessageBox.warning(self, "Errore", "Il layer CSV non ha le informazioni necessarie sui campi")
             return
             
-        # Verifica che il layer sia in modalità di editing
-        if not target_layer.isEditable():
-            target_layer.startEditing()
+        # Verifica che il layer sia in modalità di editing (si salva alla fine solo se la sessione è aperta qui)
+        started_editing = not target_layer.isEditable()
+        if started_editing and not target_layer.startEditing():
+            QMessageBox.critical(self, "Errore", f"Impossibile modificare il layer '{target_layer.name()}'.")
+            return
             
         # Ottieni il numero iniziale dal campo di input
         try:
@@ -1930,20 +4672,25 @@ class CombinedCsvDialog(QDialog):
         
         logging.info(f"Numero iniziale per estrazione vertici: {start_num}")
             
-        # Crea un set per tenere traccia dei vertici già estratti
-        # per evitare duplicati in punti condivisi tra poligoni
-        extracted_points = set()
+        # Tolleranza (in metri) entro la quale un vertice coincide con un punto esistente
+        try:
+            tolerance = float(self.vertex_tolerance.text().replace(',', '.'))
+        except ValueError:
+            tolerance = VERTEX_MERGE_TOLERANCE
+        if tolerance < 0:
+            tolerance = VERTEX_MERGE_TOLERANCE
         
-        # Prima, raccogli tutti i punti esistenti nel layer CSV target
-        # per evitare di estrarre vertici già presenti
-        for feat in target_layer.getFeatures():
-            geom = feat.geometry()
-            if geom and not geom.isEmpty():
-                point = geom.asPoint()
-                point_key = (round(point.x(), 8), round(point.y(), 8))
-                extracted_points.add(point_key)
+        # Punti già presenti nel layer CSV target: griglia costruita una volta e riusata tra le estrazioni
+        existing_points = PointGridIndex.for_layer(target_layer, tolerance)
+        existing_points.ensure_built()
+        # Vertici estratti in questa esecuzione (punti condivisi tra poligoni), con la stessa tolleranza
+        extracted_points = PointGrid(existing_points.grid.tolerance)
         
-        logging.info(f"Trovati {len(extracted_points)} punti già esistenti nel layer CSV")
+        logging.info(f"Trovati {len(existing_points.grid)} punti già esistenti nel layer CSV")
+        
+        # Nomi già presenti: l'indice dei nomi del layer (costruito una volta sola) più quelli aggiunti in questa estrazione
+        name_index = PointNumberIndex.for_layer(target_layer)
+        added_names = set()
         
         # Estrai vertici da ogni layer con selezioni
         features_added = 0
@@ -1954,12 +4701,30 @@ class CombinedCsvDialog(QDialog):
         # Variabile per memorizzare la scelta dell'utente sui duplicati
         duplicate_choice = None  # None = chiedi ogni volta, 'yes_all' = sì a tutti, 'no_all' = no a tutti
         
+        # Le nuove feature si accumulano in memoria e vengono aggiunte tutte insieme alla fine
+        new_features = []
+        # Valori di default degli altri campi del layer target, calcolati una volta sola
+        other_field_defaults = {}
+        for field in target_layer.fields():
+            if field.name() not in [name_field, x_field, y_field]:
+                if field.type() == QVariant.String:
+                    other_field_defaults[field.name()] = ""
+                elif field.type() in [QVariant.Int, QVariant.Double]:
+                    other_field_defaults[field.name()] = 0
+        
+        # Le coordinate per i campi X e Y devono essere nel CRS originale
+        transform_to_original = None
+        if original_crs and original_crs != target_layer.crs().authid():
+            # Trasforma dal CRS del layer al CRS originale per i campi
+            transform_to_original = TransformCache.get(target_layer.crs(), QgsCoordinateReferenceSystem(original_crs))
+        
         for source_layer, selected_features in selected_features_by_layer.items():
             # Prepara la trasformazione delle coordinate se necessario
-            transform = None
-            if source_layer.crs() != target_layer.crs():
-                transform = QgsCoordinateTransform(source_layer.crs(), target_layer.crs(), QgsProject.instance())
-                
+            transform = TransformCache.get(source_layer.crs(), target_layer.crs())
+            
+            # Raccoglie i vertici di tutte le feature selezionate in un unico blocco di coordinate
+            source_x = array('d')
+            source_y = array('d')
             for feature in selected_features:
                 geom = feature.geometry()
                 if not geom:
@@ -1978,122 +4743,124 @@ class CombinedCsvDialog(QDialog):
                         vertices = vertices[:-1]
                 
                 for vertex in vertices:
-                    total_vertices_processed += 1
-                    # Crea il punto
-                    point = QgsPointXY(vertex.x(), vertex.y())
-                    
-                    # Trasforma le coordinate se necessario
-                    if transform:
-                        try:
-                            point = transform.transform(point)
-                        except Exception as e:
-                            logging.warning(f"Errore nella trasformazione delle coordinate: {e}")
-                            continue
-                    
-                    # Crea una chiave univoca per il punto (arrotondata per evitare problemi di precisione)
-                    point_key = (round(point.x(), 8), round(point.y(), 8))
+                    source_x.append(vertex.x())
+                    source_y.append(vertex.y())
+            
+            total_vertices_processed += len(source_x)
+            
+            # Trasforma tutti i vertici nel CRS del layer target e poi nel CRS originale, un blocco per volta
+            layer_x, layer_y, failed = transform_coordinates(transform, source_x, source_y)
+            if transform_to_original:
+                original_x, original_y, failed_original = transform_coordinates(transform_to_original, layer_x, layer_y)
+                failed = set(failed).union(failed_original)
+            else:
+                original_x, original_y = layer_x, layer_y
+                failed = set(failed)
+            if failed:
+                logging.warning(f"Errore nella trasformazione delle coordinate di {len(failed)} vertici")
+                
+            for vertex_index in range(len(layer_x)):
+                if vertex_index in failed:
+                    continue
+                # Crea il punto
+                point = QgsPointXY(layer_x[vertex_index], layer_y[vertex_index])
                     
-                    # Controlla se questo vertice è già stato estratto
-                    if point_key in extracted_points:
-                        vertices_skipped += 1
-                        continue
+                # Controlla se questo vertice coincide (entro la tolleranza) con un punto esistente o già estratto
+                if (existing_points.find_near(point.x(), point.y()) is not None or
+                        extracted_points.find_near(point.x(), point.y()) is not None):
+                    vertices_skipped += 1
+                    continue
                         
-                    extracted_points.add(point_key)
+                extracted_points.add(len(extracted_points), point.x(), point.y())
                     
-                    # Crea la nuova feature
-                    new_feat = QgsFeature(target_layer.fields())
-                    new_feat.setGeometry(QgsGeometry.fromPointXY(point))
+                # Crea la nuova feature
+                new_feat = QgsFeature(target_layer.fields())
+                new_feat.setGeometry(QgsGeometry.fromPointXY(point))
                     
-                    # Le coordinate per i campi X e Y devono essere nel CRS originale
-                    if original_crs and original_crs != target_layer.crs().authid():
-                        # Trasforma dal CRS del layer al CRS originale per i campi
-                        transform_to_original = QgsCoordinateTransform(
-                            target_layer.crs(), 
-                            QgsCoordinateReferenceSystem(original_crs), 
-                            QgsProject.instance()
-                        )
-                        original_point = transform_to_original.transform(point)
-                        x_coord = original_point.x()
-                        y_coord = original_point.y()
-                    else:
-                        # Se non c'è riproiezione, usa le coordinate dirette
-                        x_coord = point.x()
-                        y_coord = point.y()
+                x_coord = original_x[vertex_index]
+                y_coord = original_y[vertex_index]
                     
-                    # Controlla se il nome esiste già
-                    proposed_name = str(point_num)
-                    name_exists = False
-                    existing_names = []
+                # Controlla se il nome esiste già (ricerca O(1) invece di scorrere il layer)
+                proposed_name = str(point_num)
+                name_exists = proposed_name in added_names or name_index.name_exists(proposed_name)
                     
-                    # Cerca nomi duplicati nel layer
-                    for existing_feat in target_layer.getFeatures():
-                        if existing_feat[name_field] == proposed_name:
-                            name_exists = True
-                            existing_names.append(proposed_name)
-                            break
-                    
-                    # Se il nome esiste, gestisci in base alla scelta precedente o chiedi
-                    if name_exists:
-                        if duplicate_choice == 'yes_all':
-                            # L'utente ha scelto di inserire tutti i duplicati
-                            pass
-                        elif duplicate_choice == 'no_all':
-                            # L'utente ha scelto di saltare tutti i duplicati
-                            point_num += 1
-                            continue
-                        else:
-                            # Chiedi all'utente con opzioni aggiuntive
-                            msg_box = QMessageBox(self)
-                            msg_box.setWindowTitle('Nome Duplicato')
-                            msg_box.setText(f'Il nome "{proposed_name}" esiste già nel layer.\n\nVuoi inserirlo ugualmente?')
+                # Se il nome esiste, gestisci in base alla scelta precedente o chiedi
+                if name_exists:
+                    if duplicate_choice == 'yes_all':
+                        # L'utente ha scelto di inserire tutti i duplicati
+                        pass
+                    elif duplicate_choice == 'no_all':
+                        # L'utente ha scelto di saltare tutti i duplicati
+                        point_num += 1
+                        continue
+                    else:
+                        # Chiedi all'utente con opzioni aggiuntive
+                        msg_box = QMessageBox(self)
+                        msg_box.setWindowTitle('Nome Duplicato')
+                        msg_box.setText(f'Il nome "{proposed_name}" esiste già nel layer.\n\nVuoi inserirlo ugualmente?')
                             
-                            yes_button = msg_box.addButton('Sì', QMessageBox.YesRole)
-                            no_button = msg_box.addButton('No', QMessageBox.NoRole)
-                            yes_all_button = msg_box.addButton('Sì a tutti', QMessageBox.YesRole)
-                            no_all_button = msg_box.addButton('No a tutti', QMessageBox.NoRole)
+                        yes_button = msg_box.addButton('Sì', QMessageBox.YesRole)
+                        no_button = msg_box.addButton('No', QMessageBox.NoRole)
+                        yes_all_button = msg_box.addButton('Sì a tutti', QMessageBox.YesRole)
+                        no_all_button = msg_box.addButton('No a tutti', QMessageBox.NoRole)
                             
-                            msg_box.setDefaultButton(no_button)
-                            msg_box.exec_()
+                        msg_box.setDefaultButton(no_button)
+                        msg_box.exec_()
                             
-                            clicked_button = msg_box.clickedButton()
+                        clicked_button = msg_box.clickedButton()
                             
-                            if clicked_button == yes_button:
-                                # Inserisci solo questo duplicato
-                                pass
-                            elif clicked_button == no_button:
-                                # Salta solo questo duplicato
-                                point_num += 1
-                                continue
-                            elif clicked_button == yes_all_button:
-                                # Inserisci questo e tutti i futuri duplicati
-                                duplicate_choice = 'yes_all'
-                            elif clicked_button == no_all_button:
-                                # Salta questo e tutti i futuri duplicati
-                                duplicate_choice = 'no_all'
-                                point_num += 1
-                                continue
+                        if clicked_button == yes_button:
+                            # Inserisci solo questo duplicato
+                            pass
+                        elif clicked_button == no_button:
+                            # Salta solo questo duplicato
+                            point_num += 1
+                            continue
+                        elif clicked_button == yes_all_button:
+                            # Inserisci questo e tutti i futuri duplicati
+                            duplicate_choice = 'yes_all'
+                        elif clicked_button == no_all_button:
+                            # Salta questo e tutti i futuri duplicati
+                            duplicate_choice = 'no_all'
+                            point_num += 1
+                            continue
                     
-                    # Imposta gli attributi
-                    new_feat[name_field] = proposed_name
-                    new_feat[x_field] = x_coord
-                    new_feat[y_field] = y_coord
+                # Imposta gli attributi
+                new_feat[name_field] = proposed_name
+                new_feat[x_field] = x_coord
+                new_feat[y_field] = y_coord
                     
-                    # Copia altri attributi se esistono nel layer target
-                    for field in target_layer.fields():
-                        if field.name() not in [name_field, x_field, y_field]:
-                            # Imposta valori di default per altri campi
-                            if field.type() == QVariant.String:
-                                new_feat[field.name()] = ""
-                            elif field.type() in [QVariant.Int, QVariant.Double]:
-                                new_feat[field.name()] = 0
+                # Imposta valori di default per gli altri campi del layer target
+                for field_name, default_value in other_field_defaults.items():
+                    new_feat[field_name] = default_value
                                 
-                    # Aggiungi la feature al layer
-                    if target_layer.addFeature(new_feat):
-                        features_added += 1
-                        point_num += 1
+                new_features.append(new_feat)
+                added_names.add(proposed_name)
+                point_num += 1
+        
+        # Aggiunge tutte le feature con un solo addFeatures, in un unico comando di annullamento.
+        # Canvas congelato e indice dei nomi aggiornato in blocco: niente ridisegni o ricerche per ogni punto
+        if new_features:
+            canvas = self.iface.mapCanvas()
+            canvas.freeze(True)
+            try:
+                with name_index.deferred_updates(), existing_points.deferred_updates():
+                    target_layer.beginEditCommand(f"Estrazione di {len(new_features)} vertici")
+                    if target_layer.addFeatures(new_features):
+                        target_layer.endEditCommand()
+                        features_added = len(new_features)
+                    else:
+                        target_layer.destroyEditCommand()
+                        logging.error(f"Impossibile aggiungere i vertici estratti al layer '{target_layer.name()}'")
+                        QMessageBox.critical(self, "Errore", "Impossibile aggiungere i vertici estratti al layer.")
+                        point_num = start_num
+            finally:
+                canvas.freeze(False)
                     
-        # Salva le modifiche
-        target_layer.commitChanges()
+        # Salva le modifiche solo se la sessione di modifica è stata aperta qui: in una sessione già aperta
+        # l'estrazione resta nel buffer come un unico comando annullabile
+        if started_editing:
+            target_layer.commitChanges()
         target_layer.updateExtents()
         target_layer.triggerRepaint()
         
@@ -2247,60 +5014,14 @@ class CombinedCsvDialog(QDialog):
             QMessageBox.warning(self, "Avviso", "Nessun punto è stato rinominato")
     
     def find_max_point_number(self):
-        """Trova il numero massimo solo nel layer attivo per evitare rallentamenti"""
-        max_num = 0
-        
-        # OTTIMIZZAZIONE: Controlla solo il layer attivo
+        """Trova il numero massimo solo nel layer attivo (dall'indice dei numeri, senza riscandire il layer)"""
         active_layer = self.iface.activeLayer()
         if (active_layer and 
             active_layer.type() == QgsVectorLayer.VectorLayer and 
             active_layer.geometryType() == QgsWkbTypes.PointGeometry):
-            layer = active_layer
-            
-            # Prima prova con il campo nome specificato durante l'importazione
-            name_field = layer.customProperty('import_name_field')
-            
-            # Se non c'è un campo nome specificato, cerca campi comuni
-            if not name_field:
-                # Cerca campi che potrebbero contenere il nome/numero del punto
-                possible_name_fields = ['nome', 'name', 'id', 'punto', 'point', 'numero', 'number']
-                field_names = [f.name().lower() for f in layer.fields()]
-                
-                for possible_field in possible_name_fields:
-                    if possible_field in field_names:
-                        # Trova il nome esatto del campo (case-sensitive)
-                        for field in layer.fields():
-                            if field.name().lower() == possible_field:
-                                name_field = field.name()
-                                break
-                        if name_field:
-                            break
-                
-            if name_field and name_field in layer.fields().names():
-                for feature in layer.getFeatures():
-                    value = feature[name_field]
-                    if value:
-                        try:
-                            # Prova a estrarre numeri
-                            import re
-                            name_str = str(value)
-                            # Se il nome è solo un numero o inizia con un numero seguito da non-cifre
-                            if name_str.isdigit():
-                                num = int(name_str)
-                                max_num = max(max_num, num)
-                            else:
-                                # Cerca un numero all'inizio della stringa
-                                match = re.match(r'^(\d+)(?:\D|$)', name_str)
-                                if match:
-                                    num = int(match.group(1))
-                                    max_num = max(max_num, num)
-                        except:
-                            pass
-        else:
-            # Se non c'è un layer attivo appropriato, usa un valore di default
-            max_num = 0
-                        
-        return max_num
+            return PointNumberIndex.for_layer(active_layer).max_point_number()
+        # Se non c'è un layer attivo appropriato, usa un valore di default
+        return 0
     
     def enable_snap_on_startup(self):
         """Abilita lo snap all'avvio del plugin"""
@@ -2442,206 +5163,66 @@ class CombinedCsvDialog(QDialog):
             # Per QGIS 3.x usa VertexAndSegment che include vertici e segmenti
             snapping_config.setType(QgsSnappingConfig.VertexAndSegment)
             snapping_config.setTolerance(10)
-            snapping_config.setUnits(QgsTolerance.Pixels)
-            # Abilita lo snapping all'intersezione se disponibile
-            try:
-                snapping_config.setIntersectionSnapping(True)
-            except AttributeError:
-                # Metodo non disponibile in questa versione di QGIS
-                pass
-            # Pulsante rimosso
-            QMessageBox.information(self, "Snap", "Snap abilitato su tutti i layer")
-            
-        QgsProject.instance().setSnappingConfig(snapping_config)
-    
-    def start_placing_dxf(self):
-        if not self.dxf_layer:
-            QMessageBox.warning(self, "Avviso", "Nessun layer DXF valido disponibile")
-            return
-
-        # Imposta CRS del progetto al layer se non ne ha uno
-        if not self.dxf_layer.crs().isValid():
-            crs_project = QgsProject.instance().crs()
-            self.dxf_layer.setCrs(crs_project)
-
-        # Abilita snapping sempre quando si posiziona il DXF
-        snapping_config = QgsProject.instance().snappingConfig()
-        snapping_config.setEnabled(True)
-        snapping_config.setMode(QgsSnappingConfig.AllLayers)
-        snapping_config.setType(QgsSnappingConfig.VertexAndSegment)
-        snapping_config.setTolerance(10)
-        snapping_config.setUnits(QgsTolerance.Pixels)
-        try:
-            snapping_config.setIntersectionSnapping(True)
-        except AttributeError:
-            pass
-        QgsProject.instance().setSnappingConfig(snapping_config)
-        
-        # Forza l'aggiornamento del canvas per attivare lo snap visivamente
-        self.iface.mapCanvas().snappingUtils().setConfig(snapping_config)
-        self.iface.mapCanvas().refresh()
-
-        # Crea map tool personalizzato per il clic
-        self.map_tool = DXFMapTool(self.iface.mapCanvas(), self.dxf_layer)
-        self.map_tool.pointClicked.connect(self.place_dxf_on_map)
-        self.iface.mapCanvas().setMapTool(self.map_tool)
-
-        # Mostra anteprima del DXF
-        extent = self.dxf_layer.extent()
-        width = extent.width()
-        height = extent.height()
-        
-        # Ottieni informazioni sui CRS
-        dxf_crs = self.dxf_layer.crs()
-        project_crs = QgsProject.instance().crs()
-        
-        # Determina le unità
-        dxf_units = "gradi" if dxf_crs.isGeographic() else "metri"
-        project_units = "gradi" if project_crs.isGeographic() else "metri"
-        
-        # Avviso se c'è mismatch tra geografico e proiettato
-        warning_msg = ""
-        if dxf_crs.isGeographic() != project_crs.isGeographic():
-            warning_msg = "\n⚠️ ATTENZIONE: Il DXF e il progetto usano sistemi di coordinate diversi!\n"
-        
-        # Messagebox rimosso per richiesta utente
-        # L'utente può cliccare direttamente sulla mappa per posizionare il DXF
-
-    def place_dxf_on_map(self, qgs_point_xy):
-        if not self.dxf_layer:
-            QMessageBox.warning(self, "Errore", "Nessun layer DXF disponibile.")
-            return
-
-        # Ottieni CRS
-        dxf_crs = self.dxf_layer.crs()
-        project_crs = QgsProject.instance().crs()
-        
-        # Calcola il centroide di tutte le geometrie del DXF
-        all_geoms = []
-        for feat in self.dxf_layer.getFeatures():
-            geom = feat.geometry()
-            if geom:
-                all_geoms.append(geom)
-        
-        if not all_geoms:
-            QMessageBox.warning(self, "Errore", "Nessuna geometria valida trovata nel DXF")
-            return
-            
-        # Combina tutte le geometrie e calcola il centroide
-        combined_geom = QgsGeometry.unaryUnion(all_geoms)
-        centroid = combined_geom.centroid()
-        
-        if not centroid or centroid.isEmpty():
-            QMessageBox.warning(self, "Errore", "Impossibile calcolare il centroide del DXF")
-            return
-            
-        centroid_point = centroid.asPoint()
-        origin_x = centroid_point.x()
-        origin_y = centroid_point.y()
-        
-        print(f"Click point: {qgs_point_xy.x()}, {qgs_point_xy.y()}")
-        print(f"DXF centroide: x={origin_x}, y={origin_y}")
-        print(f"DXF CRS: {dxf_crs.authid()}, Project CRS: {project_crs.authid()}")
-
-        # Conta le features e determina il tipo
-        feature_count = self.dxf_layer.featureCount()
-        if feature_count == 0:
-            QMessageBox.critical(self, "Errore", "DXF vuoto, nessuna geometria")
-            return
-            
-        # Prima feature per determinare se line o polygon
-        features = list(self.dxf_layer.getFeatures())
-        if not features:
-            QMessageBox.critical(self, "Errore", "Impossibile leggere le geometrie dal DXF")
-            return
-            
-        first_feat = features[0]
-        if not first_feat or not first_feat.geometry():
-            QMessageBox.critical(self, "Errore", "Prima geometria non valida")
-            return
-
-        topo = QgsWkbTypes.geometryType(first_feat.geometry().wkbType())
-        if topo == QgsWkbTypes.LineGeometry:
-            geometry_string = "LineString"
-        elif topo == QgsWkbTypes.PolygonGeometry:
-            geometry_string = "Polygon"
-        else:
-            QMessageBox.critical(self, "Errore", "Tipo di geometria non supportato")
-            return
-
-        # Usa il CRS del progetto per il layer DXF posizionato
-        target_crs = project_crs
-        # Estrai il nome del file DXF senza percorso e estensione
-        dxf_name = os.path.splitext(os.path.basename(self.dxf_path))[0] if self.dxf_path else "DXF_Posizionato"
-        memory_layer = QgsVectorLayer(f"{geometry_string}?crs={target_crs.authid()}", dxf_name, "memory")
-        provider = memory_layer.dataProvider()
-
-        # Copia campi
-        fields = self.dxf_layer.fields()
-        provider.addAttributes(fields.toList())
-        memory_layer.updateFields()
-
-        # Prepara trasformazione coordinate se necessario
-        if dxf_crs != target_crs:
-            transform = QgsCoordinateTransform(dxf_crs, target_crs, QgsProject.instance())
-        else:
-            transform = None
-            
-        # Trasforma il punto cliccato nel CRS di destinazione se necessario
-        if project_crs != target_crs:
-            click_transform = QgsCoordinateTransform(project_crs, target_crs, QgsProject.instance())
-            click_point = click_transform.transform(qgs_point_xy)
-        else:
-            click_point = qgs_point_xy
-            
-        # Calcola la traslazione corretta basata sul centroide
-        # Se i CRS sono diversi, trasforma prima il centroide nel CRS di destinazione
-        if transform:
-            centroid_point = QgsPointXY(origin_x, origin_y)
-            centroid_transformed = transform.transform(centroid_point)
-            print(f"Centroide DXF trasformato: {centroid_transformed.x()}, {centroid_transformed.y()}")
-            dx = click_point.x() - centroid_transformed.x()
-            dy = click_point.y() - centroid_transformed.y()
-        else:
-            # Se i CRS sono uguali, calcola direttamente
-            dx = click_point.x() - origin_x
-            dy = click_point.y() - origin_y
-            
-        print(f"Traslazione finale: dx={dx}, dy={dy}")
-        print(f"Distanza di traslazione: {(dx**2 + dy**2)**0.5} unità")
-            
-        # Trasla feature
-        for feat in self.dxf_layer.getFeatures():
-            geom = feat.geometry()
-            if not geom:
-                continue
-            
-            # Crea una copia della geometria per non modificare l'originale
-            geom_copy = QgsGeometry(geom)
-            
-            # Prima trasforma al CRS di destinazione (EPSG:3857) se necessario
-            if transform:
-                geom_copy.transform(transform)
-            
-            # Poi trasla nella posizione desiderata  
-            if not geom_copy.translate(dx, dy):
-                print(f"Errore nella traslazione della geometria")
+            snapping_config.setUnits(QgsTolerance.Pixels)
+            # Abilita lo snapping all'intersezione se disponibile
+            try:
+                snapping_config.setIntersectionSnapping(True)
+            except AttributeError:
+                # Metodo non disponibile in questa versione di QGIS
+                pass
+            # Pulsante rimosso
+            QMessageBox.information(self, "Snap", "Snap abilitato su tutti i layer")
             
-            new_feat = QgsFeature()
-            new_feat.setFields(fields)
-            new_feat.setAttributes(feat.attributes())
-            new_feat.setGeometry(geom_copy)
-            provider.addFeature(new_feat)
-        
-        memory_layer.updateExtents()
-        
-        # Imposta proprietà personalizzata per identificare il layer come DXF
-        memory_layer.setCustomProperty('is_dxf_layer', True)
+        QgsProject.instance().setSnappingConfig(snapping_config)
+    
+    def start_placing_dxf(self):
+        if not self.dxf_model and self.dxf_load_task is None:
+            QMessageBox.warning(self, "Avviso", "Nessun layer DXF valido disponibile")
+            return
+
+        # Abilita snapping sempre quando si posiziona il DXF
+        snapping_config = QgsProject.instance().snappingConfig()
+        snapping_config.setEnabled(True)
+        snapping_config.setMode(QgsSnappingConfig.AllLayers)
+        snapping_config.setType(QgsSnappingConfig.VertexAndSegment)
+        snapping_config.setTolerance(10)
+        snapping_config.setUnits(QgsTolerance.Pixels)
+        try:
+            snapping_config.setIntersectionSnapping(True)
+        except AttributeError:
+            pass
+        QgsProject.instance().setSnappingConfig(snapping_config)
         
-        QgsProject.instance().addMapLayer(memory_layer)
+        # Forza l'aggiornamento del canvas per attivare lo snap visivamente
+        self.iface.mapCanvas().snappingUtils().setConfig(snapping_config)
+        self.iface.mapCanvas().refresh()
 
-        # Stile personalizzato: usa i colori selezionati nelle impostazioni
-        if geometry_string == "Polygon":
+        # Crea map tool personalizzato per il clic
+        # Riquadro di anteprima: estensione dichiarata nella HEADER (o quella letta), agganciata al centroide
+        # (finché il modello non è pronto il riquadro è agganciato al suo centro)
+        model = self.dxf_model
+        preview_extent = self.dxf_header.extent if self.dxf_header and self.dxf_header.extent else None
+        if preview_extent is None and model is not None:
+            preview_extent = model.extent
+        # In modalità timbro il tool resta attivo e ogni clic aggiunge una copia allo stesso layer
+        repeat = self.dxf_stamp_checkbox.isChecked()
+        self.dxf_pending_clicks = []
+        self.dxf_stamp_layers = {}
+        self.dxf_stamp_count = 0
+        # Stesso punto di aggancio del posizionamento (centroide esatto se richiesto), nel CRS del disegno
+        anchor = model.centroid(exact=self.exact_centroid_checkbox.isChecked()) if model is not None else None
+        self.map_tool = DXFMapTool(
+            self.iface.mapCanvas(), model, preview_extent, anchor,
+            repeat=repeat, source_crs=self.dxf_source_crs(model)
+        )
+        self.map_tool.pointClicked.connect(self.place_dxf_on_map)
+        self.iface.mapCanvas().setMapTool(self.map_tool)
+
+        # L'utente può cliccare direttamente sulla mappa per posizionare il DXF
+
+    def style_dxf_layer(self, memory_layer, geometry_string):
+        """Stile personalizzato del layer DXF: usa i colori selezionati nelle impostazioni"""
+        if geometry_string.endswith("Polygon"):
             # Per i poligoni: crea un nuovo simbolo con riempimento trasparente e bordo del colore scelto
             from qgis.core import QgsFillSymbol
             symbol = QgsFillSymbol.createSimple({
@@ -2660,8 +5241,143 @@ class CombinedCsvDialog(QDialog):
                 'line_style': 'solid'
             })
             memory_layer.setRenderer(QgsSingleSymbolRenderer(symbol))
-            
-        memory_layer.triggerRepaint()
+
+    def dxf_source_crs(self, model):
+        """CRS del disegno: quello del modello o, se il DXF non ne dichiara uno, quello del progetto.
+
+        Il modello non viene modificato: è condiviso tramite la cache dei modelli DXF.
+        """
+        return model.crs if model is not None and model.crs.isValid() else QgsProject.instance().crs()
+
+    def stamp_dxf(self, qgs_point_xy):
+        """Aggiunge una copia del DXF ai layer dei timbri, traslando il modello già riproiettato.
+
+        Come nel posizionamento c'è un layer dei timbri per tipo di geometria (linee, poligoni).
+        Restituisce True se il timbro è stato aggiunto.
+        """
+        model = self.dxf_model
+        project_crs = QgsProject.instance().crs()
+        try:
+            geometries, attributes, anchor = dxf_stamp_template(
+                model, TransformCache.get(self.dxf_source_crs(model), project_crs), project_crs,
+                exact_centroid=self.exact_centroid_checkbox.isChecked()
+            )
+        except ValueError as e:
+            QMessageBox.warning(self, "Errore", str(e))
+            self.cancel_dxf_placing()
+            return False
+
+        dx = qgs_point_xy.x() - anchor.x()
+        dy = qgs_point_xy.y() - anchor.y()
+        translated = []
+        for geom in geometries:
+            geom_copy = QgsGeometry(geom)
+            geom_copy.translate(dx, dy)
+            translated.append(geom_copy)
+
+        dxf_name = os.path.splitext(os.path.basename(self.dxf_path))[0] if self.dxf_path else "DXF"
+        geometry_strings = model.geometry_strings()
+        stamp_layers = []
+        for topo, features in dxf_features_by_type(model.fields, translated, attributes).items():
+            # Il layer dei timbri viene creato al primo clic (o ricreato se è stato rimosso)
+            layer = self.dxf_stamp_layers.get(topo)
+            if layer is None or QgsProject.instance().mapLayer(layer.id()) is None:
+                layer = create_dxf_layer(
+                    geometry_strings[topo], project_crs, model.layer_name(f"{dxf_name}_timbri", topo), model.fields
+                )
+                QgsProject.instance().addMapLayer(layer)
+                self.style_dxf_layer(layer, geometry_strings[topo])
+                self.reorder_layers()
+                self.update_buttons_state()
+                self.dxf_stamp_layers[topo] = layer
+            if not layer.dataProvider().addFeatures(features)[0]:
+                QMessageBox.critical(self, "Errore", f"Impossibile aggiungere il timbro al layer '{layer.name()}'")
+                return False
+            layer.updateExtents()
+            layer.triggerRepaint()
+            stamp_layers.append(f"'{layer.name()}'")
+        self.dxf_stamp_count += 1
+        self.iface.messageBar().pushMessage(
+            "Spotter",
+            f"Timbro {self.dxf_stamp_count} posizionato in {', '.join(stamp_layers)} "
+            "(tasto destro per terminare)",
+            level=Qgis.Info, duration=2
+        )
+        return True
+
+    def place_dxf_on_map(self, qgs_point_xy):
+        model = self.dxf_model
+        if not model:
+            if self.dxf_load_task is not None:
+                # Il DXF è ancora in lettura: il posizionamento parte al termine.
+                # In modalità timbro ogni clic resta in coda, altrimenti vale l'ultimo
+                stamp = self.map_tool is not None and self.map_tool.repeat
+                if stamp:
+                    self.dxf_pending_clicks.append((QgsPointXY(qgs_point_xy), True))
+                    message = (f"{len(self.dxf_pending_clicks)} timbri in attesa: "
+                               "verranno posizionati al termine della lettura")
+                else:
+                    self.dxf_pending_clicks = [(QgsPointXY(qgs_point_xy), False)]
+                    message = "Il DXF verrà posizionato al termine della lettura"
+                self.iface.messageBar().pushMessage("Spotter", message, level=Qgis.Info, duration=3)
+                return
+            QMessageBox.warning(self, "Errore", "Nessun layer DXF disponibile.")
+            return
+        if self.dxf_place_task is not None:
+            self.iface.messageBar().pushMessage("Spotter", "Posizionamento del DXF già in corso", level=Qgis.Warning)
+            return
+
+        # Il DXF senza CRS è nel CRS del progetto
+        project_crs = QgsProject.instance().crs()
+        source_crs = self.dxf_source_crs(model)
+
+        if self.map_tool is not None and self.map_tool.repeat:
+            self.stamp_dxf(qgs_point_xy)
+            return
+
+        # Usa il CRS del progetto per il layer DXF posizionato
+        target_crs = project_crs
+        # Trasforma il punto cliccato nel CRS di destinazione se necessario
+        click_transform = TransformCache.get(project_crs, target_crs)
+        if click_transform:
+            click_point = click_transform.transform(qgs_point_xy)
+        else:
+            click_point = qgs_point_xy
+        logging.info(f"Posizionamento DXF: clic {click_point.x()}, {click_point.y()}, "
+                     f"CRS DXF {source_crs.authid()}, CRS progetto {project_crs.authid()}")
+
+        # Estrai il nome del file DXF senza percorso e estensione
+        dxf_name = os.path.splitext(os.path.basename(self.dxf_path))[0] if self.dxf_path else "DXF_Posizionato"
+        task = DxfPlacementTask(
+            model, dxf_name, target_crs, TransformCache.get(source_crs, target_crs), click_point,
+            exact_centroid=self.exact_centroid_checkbox.isChecked()
+        )
+        task.taskCompleted.connect(lambda: self.finish_dxf_placement(task))
+        task.taskTerminated.connect(lambda: self.abort_dxf_placement(task))
+        self.dxf_place_task = task
+        self.place_dxf_button.setEnabled(False)
+        QgsApplication.taskManager().addTask(task)
+
+    def abort_dxf_placement(self, task):
+        """Gestisce un posizionamento DXF annullato o fallito (thread principale)"""
+        self.dxf_place_task = None
+        self.place_dxf_button.setEnabled(self.dxf_model is not None)
+        self.cancel_dxf_placing()
+        if task.exception is not None:
+            QMessageBox.critical(self, "Errore", f"Errore durante il posizionamento del DXF: {task.exception}")
+        elif task.error:
+            QMessageBox.warning(self, "Errore", task.error)
+        else:
+            QMessageBox.information(self, "Interrotto", "Posizionamento del DXF interrotto")
+
+    def finish_dxf_placement(self, task):
+        """Aggiunge al progetto e applica lo stile al layer DXF posizionato (thread principale)"""
+        self.dxf_place_task = None
+        self.place_dxf_button.setEnabled(self.dxf_model is not None)
+        for memory_layer, geometry_string in task.layers:
+            QgsProject.instance().addMapLayer(memory_layer)
+            self.style_dxf_layer(memory_layer, geometry_string)
+            memory_layer.triggerRepaint()
         
         # Aggiorna lo stato dei pulsanti dopo aver posizionato il DXF
         self.update_buttons_state()
@@ -2679,8 +5395,7 @@ class CombinedCsvDialog(QDialog):
         self.iface.mapCanvas().refresh()
 
         # Scollega e disabilita map tool
-        self.iface.mapCanvas().unsetMapTool(self.map_tool)
-        self.map_tool = None
+        self.cancel_dxf_placing()
         
     ############################################################################
     #                               TAB 4: SETTINGS (MOVED TO GESTIONE)
@@ -3281,6 +5996,7 @@ class CombinedCsvDialog(QDialog):
         self.rename_vertices_button.setEnabled(has_vector_layers)
         self.extract_vertices_button.setEnabled(has_geometry_layers)
         self.set_elevation_button.setEnabled(has_vector_layers)
+        self.vertical_adjustment_button.setEnabled(has_vector_layers)
         
         # Abilita/disabilita i campi numerici e svuota se disabilitati
         self.rename_start_number.setEnabled(has_vector_layers)
@@ -3320,27 +6036,8 @@ class CombinedCsvDialog(QDialog):
         if self.tabs.currentWidget() == self.dxf_tab:
             if (layer.type() == QgsVectorLayer.VectorLayer and 
                 layer.geometryType() == QgsWkbTypes.PointGeometry):
-                # Trova il numero massimo nel layer attivo
-                max_num = 0
-                name_field = layer.customProperty('import_name_field')
-                if name_field:
-                    for feature in layer.getFeatures():
-                        try:
-                            name_value = str(feature[name_field])
-                            # Prova a estrarre un numero dal nome
-                            import re
-                            # Se il nome è solo un numero o inizia con un numero seguito da non-cifre
-                            if name_value.isdigit():
-                                num = int(name_value)
-                                max_num = max(max_num, num)
-                            else:
-                                # Cerca un numero all'inizio della stringa
-                                match = re.match(r'^(\d+)(?:\D|$)', name_value)
-                                if match:
-                                    num = int(match.group(1))
-                                    max_num = max(max_num, num)
-                        except:
-                            continue
+                # Numero massimo nel layer attivo dall'indice dei numeri del layer
+                max_num = PointNumberIndex.for_layer(layer).max_point_number()
                 
                 # Aggiorna sempre i campi numerici con il prossimo numero disponibile
                 self.start_vertex_number.setText(str(max_num + 1))
@@ -3378,6 +6075,7 @@ class CombinedCsvDialog(QDialog):
                     found_elevation_field = True
             
             self.set_elevation_button.setEnabled(found_elevation_field)
+            self.vertical_adjustment_button.setEnabled(found_elevation_field)
         elif tab_name == "Impostazioni":
             # Non c'è più bisogno di aggiornare i campi quota qui
             pass
@@ -3533,7 +6231,7 @@ class CombinedCsvDialog(QDialog):
                         # Simula il click sul file selezionato
                         self.dxf_path = file_path
                         # Carica il DXF
-                        self.load_dropped_dxf(file_path)
+                        self.load_dxf(file_path)
                         event.acceptProposedAction()
                 else:
                     logging.warning(f"File non trovato: {file_path}")
@@ -3609,7 +6307,7 @@ class CombinedCsvDialog(QDialog):
                 # Simula il click sul file selezionato
                 self.dxf_path = file_path
                 # Carica il DXF
-                self.load_dropped_dxf(file_path)
+                self.load_dxf(file_path)
         else:
             if file_path:
                 logging.warning(f"File non trovato: {file_path}")
@@ -3618,55 +6316,6 @@ class CombinedCsvDialog(QDialog):
                 logging.warning("Nessun percorso file valido trovato")
             event.ignore()
     
-    def load_dropped_dxf(self, path):
-        """Carica il DXF trascinato"""
-        # Carica layer DXF in modo temporaneo (senza aggiungerlo al progetto)
-        temp_dxf_layer = QgsVectorLayer(path, "DXF_Temp", "ogr")
-        
-        if not temp_dxf_layer.isValid():
-            QMessageBox.critical(self, "Errore", "Errore durante l'importazione del DXF.\nVerifica che il file sia un DXF valido.")
-            self.place_dxf_button.setEnabled(False)
-            self.dxf_layer = None
-            return
-
-        # Verifica linee/poligoni
-        total_features = 0
-        invalid_geometries = 0
-        for feat in temp_dxf_layer.getFeatures():
-            total_features += 1
-            geom = feat.geometry()
-            if not geom:
-                invalid_geometries += 1
-                continue
-            topo = QgsWkbTypes.geometryType(geom.wkbType())
-            if topo not in [QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry]:
-                invalid_geometries += 1
-
-        if invalid_geometries > 0:
-            QMessageBox.warning(
-                self,
-                "Geometrie Non Supportate",
-                f"Il file DXF contiene {invalid_geometries} geometrie non valide su un totale di {total_features}.\n"
-                "Solo linee e poligoni sono supportati"
-            )
-            self.place_dxf_button.setEnabled(False)
-            self.dxf_layer = None
-        else:
-            self.dxf_layer = temp_dxf_layer
-            self.place_dxf_button.setEnabled(True)
-            
-            # Chiedi se vuole posizionare il DXF sulla mappa
-            reply = QMessageBox.question(
-                self,
-                "DXF Caricato",
-                "Il file DXF è stato caricato correttamente.\n\nVuoi posizionarlo sulla mappa?",
-                QMessageBox.Yes | QMessageBox.No,
-                QMessageBox.Yes
-            )
-            
-            if reply == QMessageBox.Yes:
-                self.start_placing_dxf()
-    
     def connect_to_point_layers(self):
         """Connette ai layer di punti per aggiornare il contatore quando vengono aggiunti punti"""
         # Prima disconnetti i segnali esistenti
@@ -3812,8 +6461,8 @@ class CombinedCsvDialog(QDialog):
             
             # Trasforma il punto cliccato dal CRS della mappa al CRS del layer
             clicked_point_in_layer_crs = clicked_point
-            if layer_crs != map_crs:
-                transform = QgsCoordinateTransform(map_crs, layer_crs, QgsProject.instance())
+            transform = TransformCache.get(map_crs, layer_crs)
+            if transform:
                 clicked_point_in_layer_crs = transform.transform(clicked_point)
                 logging.info(f"Trasformazione click da {map_crs.authid()} a {layer_crs.authid()}")
             
@@ -3834,31 +6483,30 @@ class CombinedCsvDialog(QDialog):
             if not elevation_field:
                 continue  # Skip layer se non ha campo elevation
             
-            for feature in layer.getFeatures():
-                geom = feature.geometry()
-                if geom:
-                    point = geom.asPoint()
-                    
-                    # Calcola la distanza nel CRS del layer
-                    distance = clicked_point_in_layer_crs.distance(point)
-                    if distance <= search_radius:
-                        point_info = {
-                            'feature': feature,
-                            'layer': layer,
-                            'distance': distance,
-                            'name': str(feature[name_field]) if name_field else str(feature.id()),
-                            'elevation': feature[elevation_field],
-                            'elevation_field': elevation_field,  # Salva il nome del campo per uso successivo
-                            'point': point,
-                            'is_active_layer': layer == active_layer
-                        }
-                        nearby_points.append(point_info)
+            # Punti entro il raggio dall'indice spaziale del layer (calcolato nel CRS del layer)
+            matches = PointSpatialIndex.for_layer(layer).within_radius(clicked_point_in_layer_crs, search_radius)
+            if not matches:
+                continue
+            distances = {fid: distance for distance, fid in matches}
+            for feature in layer.getFeatures(QgsFeatureRequest().setFilterFids(list(distances))):
+                point_info = {
+                    'feature': feature,
+                    'layer': layer,
+                    'distance': distances[feature.id()],
+                    'name': str(feature[name_field]) if name_field else str(feature.id()),
+                    'elevation': feature[elevation_field],
+                    'elevation_field': elevation_field,  # Salva il nome del campo per uso successivo
+                    'point': feature.geometry().asPoint(),
+                    'is_active_layer': layer == active_layer
+                }
+                nearby_points.append(point_info)
         
         logging.info(f"Trovati {len(nearby_points)} punti vicini al click")
         
         if not nearby_points:
             # Prova a trovare il punto più vicino senza limite di distanza per dare un feedback migliore
             closest_point = None
+            closest_layer_crs = None
             min_distance = float('inf')
             
             for layer in QgsProject.instance().mapLayers().values():
@@ -3874,24 +6522,21 @@ class CombinedCsvDialog(QDialog):
                     
                     # Trasforma il punto cliccato nel CRS del layer
                     clicked_point_in_layer_crs = clicked_point
-                    if layer_crs != map_crs:
-                        transform = QgsCoordinateTransform(map_crs, layer_crs, QgsProject.instance())
+                    transform = TransformCache.get(map_crs, layer_crs)
+                    if transform:
                         clicked_point_in_layer_crs = transform.transform(clicked_point)
                     
-                    for feature in layer.getFeatures():
-                        geom = feature.geometry()
-                        if geom:
-                            point = geom.asPoint()
-                            
-                            # Calcola la distanza nel CRS del layer
-                            distance = clicked_point_in_layer_crs.distance(point)
-                            if distance < min_distance:
-                                min_distance = distance
-                                closest_point = point
+                    # Punto più vicino dall'indice spaziale (distanza nel CRS del layer)
+                    point_index = PointSpatialIndex.for_layer(layer)
+                    for distance, fid in point_index.nearest(clicked_point_in_layer_crs, 1):
+                        if distance < min_distance:
+                            min_distance = distance
+                            closest_point = point_index.points[fid]
+                            closest_layer_crs = layer_crs
             
             if closest_point:
-                # Determina l'unità di misura in base al tipo di CRS
-                if layer_crs and layer_crs.isGeographic():
+                # Determina l'unità di misura in base al tipo di CRS del layer del punto più vicino
+                if closest_layer_crs and closest_layer_crs.isGeographic():
                     unit_str = "gradi"
                     # Converti in metri approssimativi per dare un'idea
                     min_distance_meters = min_distance * 111000  # approssimazione
@@ -4039,24 +6684,27 @@ class CombinedCsvDialog(QDialog):
             QMessageBox.warning(self, "Errore", "Il layer non ha un campo quota configurato")
             return
             
-        if not closest_layer.isEditable():
-            closest_layer.startEditing()
-            
         field_idx = closest_layer.fields().indexOf(elevation_field)
         
-        # Aggiorna TUTTE le feature del layer selezionato
-        for feature in closest_layer.getFeatures():
-            old_value = feature[elevation_field]
-            if old_value is not None:
-                try:
-                    old_val = float(old_value)
-                    new_val = round(old_val + elevation_delta, 3)  # Arrotonda a 3 decimali
-                    closest_layer.changeAttributeValue(feature.id(), field_idx, new_val)
-                    updated_count += 1
-                except (ValueError, TypeError):
-                    continue
+        # Prepara in memoria tutte le nuove quote (solo il campo quota, senza geometrie)
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes([field_idx])
+        changes = {}
+        for feature in closest_layer.getFeatures(request):
+            old_value = feature.attribute(field_idx)
+            if old_value is None or old_value == NULL:
+                continue
+            try:
+                new_val = round(float(old_value) + elevation_delta, 3)  # Arrotonda a 3 decimali
+            except (ValueError, TypeError):
+                continue
+            changes[feature.id()] = {field_idx: new_val}
         
-        closest_layer.commitChanges()
+        # Aggiorna TUTTE le feature del layer selezionato in un'unica operazione
+        if not apply_attribute_changes(closest_layer, changes, f"Delta quota {elevation_delta:+.3f}"):
+            QMessageBox.critical(self, "Errore", f"Impossibile aggiornare le quote del layer '{closest_layer.name()}'.")
+            logging.error(f"Aggiornamento delle quote non riuscito per il layer {closest_layer.name()}")
+            return
+        updated_count = len(changes)
         closest_layer.triggerRepaint()
         # Non riavviare automaticamente la modalità di modifica
         # closest_layer.startEditing()
@@ -4072,6 +6720,52 @@ class CombinedCsvDialog(QDialog):
         self.iface.mapCanvas().unsetMapTool(self.elevation_map_tool)
         self.elevation_map_tool = None
     
+    def start_vertical_adjustment(self):
+        """Apre la compensazione delle quote sul layer punti attivo"""
+        layer = self.iface.activeLayer()
+        if (not layer or layer.type() != QgsVectorLayer.VectorLayer or
+                layer.geometryType() != QgsWkbTypes.PointGeometry):
+            QMessageBox.warning(self, "Errore", "Seleziona un layer di punti nel pannello dei layer")
+            return
+        
+        elevation_field = layer.customProperty('import_elevation_field')
+        if not elevation_field or elevation_field not in layer.fields().names():
+            QMessageBox.warning(
+                self,
+                "Campo quota non configurato",
+                f"Il layer '{layer.name()}' non ha un campo quota configurato.\n\n"
+                "Durante l'importazione CSV, seleziona il campo quota (Hei)."
+            )
+            return
+        
+        # Una sola compensazione alla volta
+        if self.vertical_adjustment_dialog is not None:
+            self.vertical_adjustment_dialog.close()
+        self.vertical_adjustment_dialog = VerticalAdjustmentDialog(self.iface, layer, elevation_field, self)
+        self.vertical_adjustment_dialog.finished.connect(self.on_vertical_adjustment_closed)
+        self.vertical_adjustment_dialog.show()
+    
+    def on_vertical_adjustment_closed(self):
+        self.vertical_adjustment_dialog = None
+    
+    def start_dxf_control_fit(self):
+        """Apre il posizionamento su punti di controllo per il layer DXF attivo"""
+        layer = self.iface.activeLayer()
+        if (not layer or layer.type() != QgsVectorLayer.VectorLayer or
+                not layer.customProperty('is_dxf_layer')):
+            QMessageBox.warning(self, "Errore", "Seleziona un layer DXF posizionato nel pannello dei layer")
+            return
+        
+        # Un solo posizionamento alla volta
+        if self.dxf_fit_dialog is not None:
+            self.dxf_fit_dialog.close()
+        self.dxf_fit_dialog = DxfControlFitDialog(self.iface, layer, self)
+        self.dxf_fit_dialog.finished.connect(self.on_dxf_control_fit_closed)
+        self.dxf_fit_dialog.show()
+    
+    def on_dxf_control_fit_closed(self):
+        self.dxf_fit_dialog = None
+    
     def reorder_layers(self):
         """Riordina i layer: mappe in fondo, poi poligoni, poi linee, poi punti in cima"""
         root = QgsProject.instance().layerTreeRoot()
@@ -4133,14 +6827,168 @@ class CombinedCsvDialog(QDialog):
 # MAP TOOL PER IL CLIC SULLA MAPPA (PER IL DXF)
 ###############################################################################
 class DXFMapTool(QgsMapToolEmitPoint):
+    """Map tool del posizionamento: il DXF segue il cursore (agganciato allo snap) fino al clic.
+
+    Con il modello già letto l'anteprima è la sua copia semplificata per la fascia di zoom corrente,
+    impostata nella rubber band una sola volta per fascia e spostata con setTranslationOffset.
+    Le fasce non ancora pronte vengono costruite da un DxfPreviewTask, mostrando intanto quella
+    precedente; durante la lettura viene mostrato il riquadro dell'estensione dichiarata nella HEADER.
+    Estensione e aggancio sono nel CRS del disegno (source_crs, di default quello del progetto):
+    se il canvas usa un CRS diverso l'anteprima viene riproiettata (una volta per fascia) e il
+    riquadro non viene mostrato.
+    """
     pointClicked = pyqtSignal(QgsPointXY)
 
-    def __init__(self, canvas, layer):
+    def __init__(self, canvas, model, preview_extent=None, anchor=None, repeat=False, source_crs=None):
         super().__init__(canvas)
         self.canvas = canvas
-        self.layer = layer
+        self.model = model
+        self.source_crs = source_crs or QgsProject.instance().crs()
+        # Modalità timbro: il tool resta attivo dopo ogni clic, il tasto destro lo chiude
+        self.repeat = repeat
+        self.preview_extent = None
+        self.anchor = None
+        self.preview_band = None
+        self.ghost_band = None
+        self.ghost_geometry = None
+        self.ghost_transform = None
+        # Costruzione in background della fascia di anteprima mancante e ultima scala richiesta nel frattempo
+        self.preview_task = None
+        self.pending_resolution = None
+        self.cursor_point = None
+        self.set_preview(preview_extent, anchor)
+
+    def set_preview(self, preview_extent, anchor=None):
+        """Imposta il riquadro di anteprima e il punto del DXF che segue il cursore (di default il centro)"""
+        self.preview_extent = preview_extent
+        self.anchor = anchor or (preview_extent.center() if preview_extent else None)
+
+    def canvas_transform(self):
+        """Trasformazione dal CRS del disegno a quello del canvas (None se coincidono)"""
+        return TransformCache.get(self.source_crs, self.canvas.mapSettings().destinationCrs())
+
+    def snap_point(self, point):
+        """Punto agganciato dallo snap, oppure il punto stesso"""
+        snap_match = self.canvas.snappingUtils().snapToMap(point)
+        return snap_match.point() if snap_match.isValid() else point
+
+    def canvasMoveEvent(self, event):
+        """Sposta l'anteprima del DXF sotto il cursore"""
+        if self.anchor is None:
+            return
+        self.cursor_point = self.snap_point(self.toMapCoordinates(event.pos()))
+        self.update_preview(self.cursor_point)
+
+    def update_preview(self, point):
+        """Disegna l'anteprima agganciata al punto (coordinate del canvas)"""
+        if self.anchor is None:
+            return
+        transform = self.canvas_transform()
+        anchor = self.anchor
+        try:
+            if transform is not None:
+                anchor = transform.transform(anchor)
+        except QgsCsException:
+            return
+        dx = point.x() - anchor.x()
+        dy = point.y() - anchor.y()
+
+        if self.model is not None:
+            self.preview_band = self.remove_band(self.preview_band)
+            if self.ghost_band is None:
+                self.ghost_band = QgsRubberBand(self.canvas, QgsWkbTypes.LineGeometry)
+                self.ghost_band.setColor(QColor(255, 0, 0, 160))
+                self.ghost_band.setWidth(1)
+            # La fascia di zoom si sceglie con la dimensione del pixel nelle unità del disegno
+            map_units_per_pixel = self.canvas.mapUnitsPerPixel()
+            if transform is not None:
+                map_units_per_pixel *= QgsUnitTypes.fromUnitToUnitFactor(
+                    self.canvas.mapUnits(), self.source_crs.mapUnits()
+                )
+            # La geometria cambia solo al cambio di fascia di zoom (la copia è in cache nel modello)
+            ghost = self.model.cached_preview(map_units_per_pixel)
+            if ghost is None:
+                # Fascia non ancora pronta: la costruisce un task, intanto resta l'anteprima precedente
+                self.request_preview(map_units_per_pixel)
+                ghost = self.ghost_geometry
+                if ghost is None:
+                    return
+            if ghost is not self.ghost_geometry or transform is not self.ghost_transform:
+                self.ghost_geometry = ghost
+                self.ghost_transform = transform
+                if transform is not None:
+                    ghost = QgsGeometry(ghost)
+                    try:
+                        ghost.transform(transform)
+                    except QgsCsException:
+                        self.ghost_band = self.remove_band(self.ghost_band)
+                        self.ghost_geometry = None
+                        return
+                self.ghost_band.setToGeometry(ghost, None)
+            self.ghost_band.setTranslationOffset(dx, dy)
+            return
+
+        if self.preview_extent is None or self.preview_extent.isEmpty():
+            return
+        if self.canvas_transform() is not None:
+            # Estensione della HEADER in coordinate del disegno: senza riproiezione il riquadro sarebbe fuori posto
+            return
+        if self.preview_band is None:
+            self.preview_band = QgsRubberBand(self.canvas, QgsWkbTypes.PolygonGeometry)
+            self.preview_band.setColor(QColor(255, 0, 0, 180))
+            self.preview_band.setFillColor(QColor(255, 0, 0, 30))
+            self.preview_band.setWidth(1)
+        extent = self.preview_extent
+        rect = QgsRectangle(
+            extent.xMinimum() + dx, extent.yMinimum() + dy, extent.xMaximum() + dx, extent.yMaximum() + dy
+        )
+        self.preview_band.setToGeometry(QgsGeometry.fromRect(rect), None)
+
+    def request_preview(self, map_units_per_pixel):
+        """Avvia la costruzione della fascia di anteprima; con un task già in corso la richiesta attende la sua fine"""
+        if self.preview_task is not None:
+            if self.model.preview_band(map_units_per_pixel) != self.preview_task.band:
+                self.pending_resolution = map_units_per_pixel
+            return
+        self.pending_resolution = None
+        task = DxfPreviewTask(self.model, map_units_per_pixel)
+        task.taskCompleted.connect(lambda: self.finish_preview(task))
+        task.taskTerminated.connect(lambda: self.finish_preview(task))
+        self.preview_task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def finish_preview(self, task):
+        """Mette in cache le fasce costruite e aggiorna l'anteprima sotto il cursore (thread principale)"""
+        self.preview_task = None
+        task.model.preview_cache.update(task.previews)
+        if task.model is not self.model or not self.isActive():
+            return
+        pending, self.pending_resolution = self.pending_resolution, None
+        if pending is not None and self.model.cached_preview(pending) is None:
+            self.request_preview(pending)
+        if self.cursor_point is not None:
+            self.update_preview(self.cursor_point)
+
+    def remove_band(self, band):
+        """Toglie una rubber band dal canvas; restituisce None da assegnare al riferimento"""
+        if band is not None:
+            self.canvas.scene().removeItem(band)
+        return None
+
+    def deactivate(self):
+        """Rimuove l'anteprima dal canvas quando il tool viene disattivato"""
+        self.preview_band = self.remove_band(self.preview_band)
+        self.ghost_band = self.remove_band(self.ghost_band)
+        self.ghost_geometry = None
+        self.ghost_transform = None
+        super().deactivate()
 
     def canvasReleaseEvent(self, event):
+        if event.button() == Qt.RightButton:
+            # Il tasto destro termina il posizionamento (e la serie di timbri)
+            self.canvas.unsetMapTool(self)
+            return
+
         # Ottieni le coordinate del punto cliccato
         click_point = self.toMapCoordinates(event.pos())
         
@@ -4170,8 +7018,9 @@ class DXFMapTool(QgsMapToolEmitPoint):
             print(f"No snap, using click point: {final_point.x()}, {final_point.y()}")
             
         self.pointClicked.emit(final_point)
-        # Disabilita il map tool dopo il click
-        self.canvas.unsetMapTool(self)
+        # Disabilita il map tool dopo il click (in modalità timbro resta attivo)
+        if not self.repeat:
+            self.canvas.unsetMapTool(self)
 
 
 ###############################################################################
@@ -4206,6 +7055,439 @@ class ElevationReferenceTool(QgsMapToolEmitPoint):
         self.canvas.unsetMapTool(self)
 
 
+###############################################################################
+# FINESTRE DEI PUNTI DI CONTROLLO CLICCATI SULLA MAPPA
+###############################################################################
+class ControlPointDialogMeta(type(QDialog), ABCMeta):
+    """Metaclasse che unisce quella dei widget Qt e ABCMeta, per i metodi astratti di ControlPointDialog"""
+
+
+class ControlPointDialog(QDialog, metaclass=ControlPointDialogMeta):
+    """Base (astratta) delle finestre che raccolgono punti di controllo cliccando sulla mappa.
+
+    Gestisce il map tool di selezione (riattivato dopo ogni clic finché il pulsante di aggiunta
+    resta premuto), tabella, pulsanti, rimozione delle righe e chiusura. Le sottoclassi tengono
+    una riga di self.controls per punto di controllo, ricevono i clic in point_picked(punto)
+    e ricalcolano stima, tabella e riepilogo in refresh().
+    """
+
+    def __init__(self, iface, layer, parent=None):
+        super().__init__(parent)
+        self.iface = iface
+        self.layer = layer
+        self.controls = []
+        self.pick_tool = None
+        self.picking = False
+        self.setWindowFlags(self.windowFlags() | Qt.WindowStaysOnTopHint)
+
+    def create_controls_table(self, headers):
+        """Tabella dei punti di controllo, una riga per punto, non modificabile"""
+        self.controls_table = QTableWidget(0, len(headers))
+        self.controls_table.setHorizontalHeaderLabels(headers)
+        self.controls_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.controls_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.controls_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        return self.controls_table
+
+    def create_buttons(self, pick_label, apply_slot):
+        """Riga dei pulsanti: aggiunta (attiva/disattiva la selezione), Rimuovi, Applica, Chiudi"""
+        buttons_layout = QHBoxLayout()
+        self.pick_button = QPushButton(pick_label)
+        self.pick_button.setCheckable(True)
+        self.pick_button.toggled.connect(self.toggle_picking)
+        buttons_layout.addWidget(self.pick_button)
+        remove_button = QPushButton("Rimuovi")
+        remove_button.clicked.connect(self.remove_selected_controls)
+        buttons_layout.addWidget(remove_button)
+        buttons_layout.addStretch()
+        self.apply_button = QPushButton("Applica")
+        self.apply_button.clicked.connect(apply_slot)
+        buttons_layout.addWidget(self.apply_button)
+        close_button = QPushButton("Chiudi")
+        close_button.clicked.connect(self.close)
+        buttons_layout.addWidget(close_button)
+        return buttons_layout
+
+    def toggle_picking(self, enabled):
+        """Attiva o disattiva la selezione dei punti di controllo sulla mappa"""
+        self.picking = enabled
+        if enabled:
+            self.arm_pick_tool()
+        elif self.pick_tool is not None:
+            self.iface.mapCanvas().unsetMapTool(self.pick_tool)
+
+    def arm_pick_tool(self):
+        """(Ri)attiva il map tool: ElevationReferenceTool si disattiva da solo dopo ogni clic"""
+        if not self.picking:
+            return
+        canvas = self.iface.mapCanvas()
+        if self.pick_tool is None:
+            self.pick_tool = ElevationReferenceTool(canvas)
+            self.pick_tool.pointClicked.connect(self.on_point_clicked)
+        canvas.setMapTool(self.pick_tool)
+
+    def on_point_clicked(self, clicked_point):
+        """Passa il clic alla sottoclasse e riattiva il map tool a evento concluso"""
+        try:
+            self.point_picked(clicked_point)
+        finally:
+            QTimer.singleShot(0, self.arm_pick_tool)
+
+    def to_layer_crs(self, point):
+        """Punto del canvas nel CRS del layer; None (con log) se non trasformabile"""
+        transform = TransformCache.get(self.iface.mapCanvas().mapSettings().destinationCrs(), self.layer.crs())
+        if transform is None:
+            return point
+        try:
+            return transform.transform(point)
+        except QgsCsException as e:
+            logging.error(f"Errore nella trasformazione del punto di controllo: {e}")
+            return None
+
+    @abstractmethod
+    def point_picked(self, clicked_point):
+        """Registra il punto cliccato (nel CRS del canvas) tra i punti di controllo"""
+
+    @abstractmethod
+    def refresh(self):
+        """Ricalcola la stima e aggiorna tabella, riepilogo e pulsante Applica"""
+
+    def remove_selected_controls(self):
+        rows = sorted({index.row() for index in self.controls_table.selectedIndexes()}, reverse=True)
+        for row in rows:
+            del self.controls[row]
+        self.refresh()
+
+    def closeEvent(self, event):
+        """Disattiva il map tool alla chiusura"""
+        self.picking = False
+        if self.pick_tool is not None:
+            self.iface.mapCanvas().unsetMapTool(self.pick_tool)
+        super().closeEvent(event)
+
+
+###############################################################################
+# FINESTRA DELLA COMPENSAZIONE DELLE QUOTE
+###############################################################################
+class VerticalAdjustmentDialog(ControlPointDialog):
+    """Raccoglie i punti di controllo sulla mappa e applica al layer la correzione stimata"""
+
+    # Raggio di ricerca del punto cliccato, in pixel (come la tolleranza di snap)
+    PICK_TOLERANCE_PIXELS = 20
+
+    def __init__(self, iface, layer, elevation_field, parent=None):
+        super().__init__(iface, layer, parent)
+        self.elevation_field = elevation_field
+        self.name_field = point_name_field(layer)
+        self.adjustment = None  # self.controls: dict con fid, name, x, y, current, known
+
+        self.setWindowTitle(f"Compensazione quote - {layer.name()}")
+        self.setMinimumWidth(520)
+        self.initUI()
+        self.refresh()
+
+    def initUI(self):
+        layout = QVBoxLayout()
+
+        model_layout = QHBoxLayout()
+        model_layout.addWidget(QLabel("Modello:"))
+        self.model_combo = QComboBox()
+        for key, label, count in VERTICAL_ADJUSTMENT_MODELS:
+            self.model_combo.addItem(f"{label} (min. {count} punti)", key)
+        self.model_combo.currentIndexChanged.connect(self.refresh)
+        model_layout.addWidget(self.model_combo, 1)
+        layout.addLayout(model_layout)
+
+        layout.addWidget(self.create_controls_table(["Punto", "Quota attuale", "Quota nota", "Correzione", "Residuo"]))
+
+        self.summary_label = QLabel()
+        self.summary_label.setWordWrap(True)
+        layout.addWidget(self.summary_label)
+
+        layout.addLayout(self.create_buttons("Aggiungi punti", self.apply_adjustment))
+        self.setLayout(layout)
+
+    def current_model(self):
+        return self.model_combo.currentData()
+
+    def point_picked(self, clicked_point):
+        """Aggiunge come punto di controllo il punto del layer più vicino al clic"""
+        canvas = self.iface.mapCanvas()
+        # Il raggio di ricerca è fissato in pixel e convertito nelle unità del layer
+        offset_point = self.to_layer_crs(QgsPointXY(
+            clicked_point.x() + canvas.mapUnitsPerPixel() * self.PICK_TOLERANCE_PIXELS, clicked_point.y()
+        ))
+        clicked_point = self.to_layer_crs(clicked_point)
+        if clicked_point is None or offset_point is None:
+            return
+        radius = clicked_point.distance(offset_point)
+
+        matches = PointSpatialIndex.for_layer(self.layer).nearest(clicked_point, 1)
+        if not matches or matches[0][0] > radius:
+            self.iface.messageBar().pushMessage(
+                "Spotter", f"Nessun punto del layer '{self.layer.name()}' vicino al clic", level=Qgis.Warning
+            )
+            return
+        fid = matches[0][1]
+
+        if any(control['fid'] == fid for control in self.controls):
+            self.iface.messageBar().pushMessage("Spotter", "Punto già presente tra i punti di controllo", level=Qgis.Info)
+            return
+
+        feature = self.layer.getFeature(fid)
+        try:
+            current = float(feature[self.elevation_field])
+        except (KeyError, TypeError, ValueError):
+            QMessageBox.warning(self, "Errore", "Il punto selezionato non ha una quota valida")
+            return
+        name = str(feature[self.name_field]) if self.name_field else str(fid)
+
+        known, ok = QInputDialog.getDouble(
+            self, "Quota nota", f"Quota nota del punto {name}:", current, -1e9, 1e9, 3
+        )
+        if ok:
+            point = feature.geometry().asPoint()
+            self.controls.append({
+                'fid': fid, 'name': name, 'x': point.x(), 'y': point.y(),
+                'current': current, 'known': known
+            })
+            self.refresh()
+
+    def refresh(self):
+        """Ricalcola la compensazione e aggiorna tabella e riepilogo"""
+        self.adjustment = None
+        message = ""
+        if self.controls:
+            try:
+                self.adjustment = VerticalAdjustment(
+                    self.current_model(),
+                    [(c['x'], c['y'], c['known'] - c['current']) for c in self.controls]
+                )
+            except ValueError as e:
+                message = str(e)
+
+        self.controls_table.setRowCount(len(self.controls))
+        for row, control in enumerate(self.controls):
+            values = [control['name'], f"{control['current']:.3f}", f"{control['known']:.3f}", "", ""]
+            if self.adjustment is not None:
+                values[3] = f"{self.adjustment.correction(control['x'], control['y']):+.3f}"
+                values[4] = f"{self.adjustment.residuals[row]:+.3f}"
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.controls_table.setItem(row, column, item)
+
+        if not self.controls:
+            message = "Attiva 'Aggiungi punti' e clicca sui punti di quota nota."
+        elif self.adjustment is not None:
+            if self.adjustment.rms is None:
+                message = f"{len(self.controls)} punti di controllo, nessuna ridondanza (residui nulli)."
+            else:
+                worst = max(abs(v) for v in self.adjustment.residuals)
+                message = (
+                    f"{len(self.controls)} punti di controllo, s.q.m. {self.adjustment.rms:.3f}, "
+                    f"residuo massimo {worst:.3f}."
+                )
+        self.summary_label.setText(message)
+        self.apply_button.setEnabled(self.adjustment is not None)
+
+    def apply_adjustment(self):
+        """Applica la correzione stimata a tutte le quote del layer in un'unica operazione"""
+        if self.adjustment is None:
+            return
+        model_label = self.model_combo.currentText()
+        reply = QMessageBox.question(
+            self,
+            "Conferma compensazione",
+            f"Applicare la compensazione '{model_label}' a tutte le quote del layer '{self.layer.name()}'?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+
+        field_idx = self.layer.fields().indexOf(self.elevation_field)
+        request = QgsFeatureRequest().setSubsetOfAttributes([field_idx])
+        fids = []
+        old_values = []
+        xs = array('d')
+        ys = array('d')
+        for feature in self.layer.getFeatures(request):
+            geom = feature.geometry()
+            if geom.isEmpty():
+                continue
+            old_value = feature.attribute(field_idx)
+            if old_value is None or old_value == NULL:
+                continue
+            try:
+                old_value = float(old_value)
+            except (ValueError, TypeError):
+                continue
+            point = geom.asPoint()
+            fids.append(feature.id())
+            old_values.append(old_value)
+            xs.append(point.x())
+            ys.append(point.y())
+
+        corrections = self.adjustment.corrections(xs, ys)
+        changes = {
+            fid: {field_idx: round(old_value + correction, 3)}  # Arrotonda a 3 decimali
+            for fid, old_value, correction in zip(fids, old_values, corrections)
+        }
+        if not apply_attribute_changes(self.layer, changes, f"Compensazione quote ({model_label})"):
+            QMessageBox.critical(self, "Errore", f"Impossibile aggiornare le quote del layer '{self.layer.name()}'.")
+            logging.error(f"Compensazione delle quote non riuscita per il layer {self.layer.name()}")
+            return
+        self.layer.triggerRepaint()
+        logging.info(f"Compensazione quote applicata a {len(changes)} punti del layer {self.layer.name()}")
+        QMessageBox.information(
+            self,
+            "Completato",
+            f"Compensate le quote di {len(changes)} punti nel layer '{self.layer.name()}'."
+        )
+        self.close()
+
+
+###############################################################################
+# FINESTRA DEL POSIZIONAMENTO DEL DXF SU PUNTI DI CONTROLLO
+###############################################################################
+class DxfControlFitDialog(ControlPointDialog):
+    """Raccoglie coppie di punti (DXF -> posizione corretta) e rototrasla/scala il layer DXF"""
+
+    def __init__(self, iface, layer, parent=None):
+        super().__init__(iface, layer, parent)
+        # self.controls: (x DXF, y DXF, x destinazione, y destinazione) nel CRS del layer
+        self.pending_source = None  # Punto del DXF in attesa della sua destinazione
+        self.fit = None
+
+        self.setWindowTitle(f"Posizionamento su punti di controllo - {layer.name()}")
+        self.setMinimumWidth(560)
+        self.initUI()
+        self.refresh()
+
+    def initUI(self):
+        layout = QVBoxLayout()
+
+        model_layout = QHBoxLayout()
+        model_layout.addWidget(QLabel("Trasformazione:"))
+        self.model_combo = QComboBox()
+        for key, label, count in CONTROL_FIT_MODELS:
+            self.model_combo.addItem(f"{label} (min. {count} coppie)", key)
+        self.model_combo.currentIndexChanged.connect(self.refresh)
+        model_layout.addWidget(self.model_combo, 1)
+        layout.addLayout(model_layout)
+
+        layout.addWidget(self.create_controls_table(["DXF X", "DXF Y", "Mappa X", "Mappa Y", "Residuo"]))
+
+        self.summary_label = QLabel()
+        self.summary_label.setWordWrap(True)
+        layout.addWidget(self.summary_label)
+
+        layout.addLayout(self.create_buttons("Aggiungi coppie", self.apply_fit))
+        self.setLayout(layout)
+
+    def current_model(self):
+        return self.model_combo.currentData()
+
+    def toggle_picking(self, enabled):
+        """Come nella base; disattivando la selezione si scarta la coppia lasciata a metà"""
+        super().toggle_picking(enabled)
+        if not enabled:
+            self.pending_source = None
+        self.refresh()
+
+    def point_picked(self, clicked_point):
+        """Il primo clic di ogni coppia è il punto del DXF, il secondo la sua posizione corretta"""
+        clicked_point = self.to_layer_crs(clicked_point)
+        if clicked_point is None:
+            return
+        if self.pending_source is None:
+            self.pending_source = (clicked_point.x(), clicked_point.y())
+        else:
+            self.controls.append(self.pending_source + (clicked_point.x(), clicked_point.y()))
+            self.pending_source = None
+        self.refresh()
+
+    def refresh(self):
+        """Ristima la trasformazione e aggiorna tabella e riepilogo"""
+        self.fit = None
+        message = ""
+        if self.controls:
+            try:
+                self.fit = ControlPointFit(self.current_model(), self.controls)
+            except ValueError as e:
+                message = str(e)
+
+        self.controls_table.setRowCount(len(self.controls))
+        for row, pair in enumerate(self.controls):
+            values = [f"{value:.3f}" for value in pair] + [""]
+            if self.fit is not None:
+                values[4] = f"{math.hypot(*self.fit.residuals[row]):.3f}"
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.controls_table.setItem(row, column, item)
+
+        if self.fit is not None:
+            scale, rotation = self.fit.scale_and_rotation()
+            message = f"{len(self.controls)} coppie, scala {scale:.6f}, rotazione {rotation:+.4f}°"
+            if self.fit.rms is None:
+                message += ", nessuna ridondanza (residui nulli)."
+            else:
+                worst = max(math.hypot(vx, vy) for vx, vy in self.fit.residuals)
+                message += f", s.q.m. {self.fit.rms:.3f}, residuo massimo {worst:.3f}."
+        elif not self.controls:
+            message = "Attiva 'Aggiungi coppie' e clicca un punto del DXF, poi la sua posizione corretta."
+        if self.picking:
+            step = "la posizione corretta" if self.pending_source is not None else "un punto del DXF"
+            message += f"\nProssimo clic: {step}."
+        self.summary_label.setText(message)
+        self.apply_button.setEnabled(self.fit is not None)
+
+    def apply_fit(self):
+        """Applica la trasformazione a tutte le geometrie del layer in un unico passaggio"""
+        if self.fit is None:
+            return
+        model_label = self.model_combo.currentText()
+        reply = QMessageBox.question(
+            self,
+            "Conferma posizionamento",
+            f"Applicare la trasformazione '{model_label}' a tutte le geometrie del layer '{self.layer.name()}'?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+
+        # Una sola matrice per tutte le coordinate: QgsGeometry.transform le scorre in C++
+        matrix = self.fit.matrix()
+        geometries = {}
+        for feature in self.layer.getFeatures(QgsFeatureRequest().setNoAttributes()):
+            geom = feature.geometry()
+            if geom.isEmpty():
+                continue
+            if geom.transform(matrix) != QgsGeometry.Success:
+                logging.warning(f"Trasformazione non riuscita per la feature {feature.id()}")
+                continue
+            geometries[feature.id()] = geom
+
+        if not apply_geometry_changes(self.layer, geometries, f"Posizionamento su punti di controllo ({model_label})"):
+            QMessageBox.critical(self, "Errore", f"Impossibile aggiornare le geometrie del layer '{self.layer.name()}'.")
+            logging.error(f"Posizionamento su punti di controllo non riuscito per il layer {self.layer.name()}")
+            return
+        logging.info(
+            f"Trasformazione {self.current_model()} applicata a {len(geometries)} geometrie del layer "
+            f"{self.layer.name()} (s.q.m. {self.fit.rms})"
+        )
+        QMessageBox.information(
+            self,
+            "Completato",
+            f"Trasformate {len(geometries)} geometrie nel layer '{self.layer.name()}'."
+        )
+        self.close()
+
+
 ###############################################################################
 # FUNZIONE DI AVVIO DELLA FINESTRA DI DIALOGO
 ###############################################################################
@@ -4,7 +4,7 @@ from qgis.PyQt.QtWidgets import QAction, QMessageBox
 from qgis.PyQt.QtGui import QIcon
 
 # Importa la tua finestra di dialogo, ad esempio se è in main.py
-from .main import CombinedCsvDialog
+from .main import CombinedCsvDialog, PointNumberDefaults
 
 class SpotterPlugin:
     def __init__(self, iface):
@@ -26,10 +26,14 @@ class SpotterPlugin:
         self.iface.addToolBarIcon(self.action)
         self.iface.addPluginToMenu(self.tr("&spotter"), self.action)
 
+        # Funzione di espressione usata come valore predefinito del campo nome dei layer importati
+        PointNumberDefaults.install()
+
     def unload(self):
         """Rimuove l'azione quando il plugin viene disabilitato o chiuso."""
         self.iface.removePluginMenu(self.tr("&spotter"), self.action)
         self.iface.removeToolBarIcon(self.action)
+        PointNumberDefaults.uninstall()
         
         # Chiudi la finestra se è aperta
         if self.dialog is not None:
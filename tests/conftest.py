@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.fixture(scope="session")
+def qgis_app():
+    """QgsApplication inizializzata una volta per sessione (serve ai provider, es. OGR)"""
+    qgis_core = pytest.importorskip("qgis.core")
+    app = qgis_core.QgsApplication([], False)
+    app.initQgis()
+    yield app
+    app.exitQgis()
@@ -0,0 +1,94 @@
+import os
+import sys
+
+import pytest
+
+# main.py importa PyQGIS a livello di modulo: senza QGIS i test vengono saltati
+pytest.importorskip("qgis.core")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qgis.core import (  # noqa: E402
+    QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsField, QgsFields, QgsGeometry, QgsPointXY, QgsProject
+)
+from qgis.PyQt.QtCore import QVariant  # noqa: E402
+
+from main import DxfModel, DxfPlacementTask, dxf_stamp_template  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# LINE e SPLINE nel layer STRADE, POINT e TEXT nel layer PUNTI
+SPLINE_POINTS = os.path.join(DATA_DIR, "spline_points.dxf")
+
+
+def test_ogr_fallback_skips_points_and_texts(qgis_app):
+    # La SPLINE fa ripiegare sul driver OGR
+    assert DxfModel.read_entities(SPLINE_POINTS, None, lambda fraction: True) is None
+
+    model = DxfModel.load(SPLINE_POINTS)
+
+    assert model.fields.indexOf("SubClasses") >= 0
+    assert len(model.geometries) == 2
+    assert model.invalid_geometries == 0
+    assert model.ignored_entities == {"POINT": 1, "TEXT": 1}
+    assert model.is_valid()
+
+
+def test_ogr_fallback_filters_by_layer(qgis_app):
+    model = DxfModel.load(SPLINE_POINTS, layers=["punti"])
+
+    assert model.geometries == []
+    assert model.ignored_entities == {"POINT": 1, "TEXT": 1}
+    assert not model.is_valid()
+
+
+def mixed_model():
+    """Modello con una linea e un poligono, come un DXF con LWPOLYLINE e HATCH"""
+    fields = QgsFields()
+    fields.append(QgsField("Layer", QVariant.String))
+    model = DxfModel("misto.dxf", QgsCoordinateReferenceSystem("EPSG:3003"), fields)
+    model.add(QgsGeometry.fromWkt("LINESTRING (0 0, 10 0)"), ["STRADE"])
+    model.add(QgsGeometry.fromWkt("POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0))"), ["EDIFICI"])
+    model.add(QgsGeometry.fromWkt("LINESTRING (0 10, 10 10)"), ["STRADE"])
+    return model
+
+
+def test_placement_splits_mixed_geometry_types(qgis_app):
+    model = mixed_model()
+    task = DxfPlacementTask(model, "misto", model.crs, None, QgsPointXY(1000.0, 1000.0))
+
+    assert task.place()
+
+    layers = {layer.name(): (layer, geometry_string) for layer, geometry_string in task.layers}
+    assert sorted(layers) == ["misto_linee", "misto_poligoni"]
+    assert layers["misto_linee"][0].featureCount() == 2
+    assert layers["misto_poligoni"][0].featureCount() == 1
+    assert layers["misto_poligoni"][1] == "Polygon"
+    assert layers["misto_linee"][0].crs() == model.crs
+
+
+def test_stamp_template_keeps_custom_crs_apart(qgis_app):
+    model = DxfModel("gradi.dxf", QgsCoordinateReferenceSystem("EPSG:4326"), QgsFields())
+    model.add(QgsGeometry.fromWkt("LINESTRING (12 42, 12.01 42)"), [])
+    anchors = []
+    for lon_0 in (9, 15):
+        # CRS personalizzati: authid vuoto
+        crs = QgsCoordinateReferenceSystem.fromProj(f"+proj=tmerc +lon_0={lon_0} +k=0.9996 +x_0=500000 +ellps=intl")
+        assert crs.authid() == ""
+        transform = QgsCoordinateTransform(model.crs, crs, QgsProject.instance())
+        anchors.append(dxf_stamp_template(model, transform, crs)[2])
+
+    assert anchors[0].x() != pytest.approx(anchors[1].x())
+
+
+def test_preview_built_apart_is_merged_into_the_cache(qgis_app):
+    model = mixed_model()
+    assert model.cached_preview(0.5) is None
+
+    # Come DxfPreviewTask: le fasce costruite restano fuori dalla cache del modello
+    previews = {}
+    preview = model.preview_geometry(0.5, previews)
+    assert model.preview_cache == {}
+    assert list(previews) == [DxfModel.preview_band(0.5)]
+
+    model.preview_cache.update(previews)
+    assert model.cached_preview(0.5) is preview
+    assert model.cached_preview(0.7) is preview
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+# main.py importa PyQGIS a livello di modulo: senza QGIS i test vengono saltati
+pytest.importorskip("qgis.core")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import DXF_LINEWORK_ENTITIES, DXF_OGR_ONLY_ENTITIES, DxfOgrOnlyError, DxfReader  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# BLOCK B1 con una LINE e un'ELLIPSE, inserito una volta nel layer EDIFICI, più un TEXT
+BLOCK_ELLIPSE = os.path.join(DATA_DIR, "block_ellipse.dxf")
+
+
+def write_dxf(path, entities):
+    """Scrive un DXF minimo con le sole entità indicate (liste di coppie codice, valore)"""
+    lines = ["0", "SECTION", "2", "ENTITIES"]
+    for tags in entities:
+        for code, value in tags:
+            lines += [str(code), str(value)]
+    lines += ["0", "ENDSEC", "0", "EOF"]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_block_entities_skipped_by_type_are_counted():
+    reader = DxfReader(BLOCK_ELLIPSE, DXF_LINEWORK_ENTITIES)
+    entities = list(reader.entities())
+
+    assert [(e[0], e[1]) for e in entities] == [("LINE", "EDIFICI")]
+    assert entities[0][5] == [(100.0, 200.0), (110.0, 200.0)]
+    assert reader.ignored == {"TEXT": 1, "ELLIPSE": 1}
+
+
+def test_ogr_only_entity_in_block_stops_reading():
+    reader = DxfReader(BLOCK_ELLIPSE, DXF_LINEWORK_ENTITIES, fallback_entities=DXF_OGR_ONLY_ENTITIES)
+    with pytest.raises(DxfOgrOnlyError):
+        list(reader.entities())
+
+
+def test_ogr_only_entity_in_entities_stops_before_the_rest(tmp_path):
+    line = [(0, "LINE"), (8, "0"), (10, 0.0), (20, 0.0), (11, 1.0), (21, 0.0)]
+    spline = [(0, "SPLINE"), (8, "0"), (70, 8), (71, 3)]
+    path = write_dxf(tmp_path / "spline.dxf", [line, spline, line])
+
+    reader = DxfReader(path, DXF_LINEWORK_ENTITIES, fallback_entities=DXF_OGR_ONLY_ENTITIES)
+    with pytest.raises(DxfOgrOnlyError):
+        list(reader.entities())
+
+    # L'ultima LINE non viene nemmeno letta
+    assert reader.read_counts == {"LINE": 1, "SPLINE": 1}